@@ -3,12 +3,19 @@
 # pylint: disable=broad-exception-caught,R0913
 import typing as t
 import logging
-from es_pii_tool.exceptions import FatalError, MissingIndex
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from es_pii_tool.exceptions import BadClientResult, FatalError, MissingIndex
 from es_pii_tool.job import Job
 from es_pii_tool.redacters.index import RedactIndex
+from es_pii_tool.redacters.pipeline import RedactionPipeline
 from es_pii_tool.task import Task
-from es_pii_tool.helpers.elastic_api import get_hits
-from es_pii_tool.helpers.utils import end_it, get_redactions
+from es_pii_tool.helpers.batch import Countdown
+from es_pii_tool.helpers.elastic_api import put_redact_script
+from es_pii_tool.helpers.journal import Journal
+from es_pii_tool.helpers.search_api import get_hits, get_hits_per_index
+from es_pii_tool.helpers.tracking import TrackingCache
+from es_pii_tool.helpers.utils import end_it, get_redactions, is_mounted
 
 if t.TYPE_CHECKING:
     from elasticsearch8 import Elasticsearch
@@ -26,15 +33,24 @@ class PiiTool:
         redaction_file: str = '',
         redaction_dict: t.Union[t.Dict, None] = None,
         dry_run: bool = False,
+        max_concurrent_indices: int = 1,
+        index_major: bool = False,
+        journal: t.Union[str, None] = None,
     ):
         if redaction_dict is None:
             redaction_dict = {}
         logger.debug('Redactions file: %s', redaction_file)
-        self.counter = 0
         self.client = client
         self.redactions = get_redactions(redaction_file, redaction_dict)
         self.tracking_index = tracking_index
         self.dry_run = dry_run
+        self.max_concurrent_indices = max(1, max_concurrent_indices)
+        self.index_major = index_major
+        #: The tracking docs of every job in :py:attr:`redactions`, loaded by
+        #: :py:meth:`load_tracking`
+        self.cache = TrackingCache()
+        #: The local write-ahead journal of tracking doc updates, if any
+        self.journal = Journal(journal) if journal else None
 
     def verify_doc_count(self, job: Job) -> bool:
         """Verify that expected_docs and the hits from the query have the same value
@@ -53,14 +69,22 @@ class PiiTool:
             return True  # We're done already
         # Log task start
         task.begin()
-        hits = get_hits(self.client, job.config['pattern'], job.config['query'])
+        # Searchable snapshot indices can skip shards which cannot match
+        prefilter = 1 if any(is_mounted(idx) for idx in job.indices) else None
+        hits = get_hits(
+            self.client,
+            job.config['pattern'],
+            job.query,
+            pre_filter_shard_size=prefilter,
+        )
         msg = f'{hits} hit(s)'
         logger.debug(msg)
         task.add_log(msg)
         logger.info("Checking expected document count...")
+        query = job.config.get('query', job.config.get('terms_file'))
         zeromsg = (
             f"For index pattern {job.config['pattern']}, with query "
-            f"{job.config['query']} 'expected_docs' is {job.config['expected_docs']} "
+            f"{query} 'expected_docs' is {job.config['expected_docs']} "
             f"but query results is {hits} matches."
         )
         if job.config['expected_docs'] == hits:
@@ -84,70 +108,434 @@ class PiiTool:
         task.end(success, errors=errors)
         return success
 
+    def skip_indices_without_hits(self, job: Job) -> None:
+        """Remove indices with no documents matching the query from job.indices
+
+        The hits in every index are counted with a single request, so indices without
+        any matching documents never get tracking docs or per-index API calls.
+
+        :param job: The job object for the present redaction run
+        """
+        counts = get_hits_per_index(
+            self.client, job.config['pattern'], job.query, job.indices
+        )
+        with_hits = [idx for idx in job.indices if counts.get(idx, 0) > 0]
+        skipped = len(job.indices) - len(with_hits)
+        if skipped:
+            msg = (
+                f'Skipping {skipped} of {len(job.indices)} indices with no documents '
+                f'matching the query'
+            )
+            logger.info(msg)
+            job.add_log(msg)
+            job.indices = with_hits
+            job.total = len(with_hits)
+
+    def redact_index(self, job: Job, idx: str) -> bool:
+        """Redact a single index from job.indices
+
+        This is safe to run in a worker thread. Each index has its own ``PARENT-TASK``
+        tracking doc, and shared job state is only changed through the locking methods
+        of :py:class:`~.es_pii_tool.job.Job`.
+
+        :param job: The job object for the present redaction run
+        :param idx: The index name
+
+        :returns: Whether the index was (or had previously been) completed
+        """
+        task = Task(job, index=idx, id_suffix='PARENT-TASK')
+        # First check to see if idx has been touched as part of a previous run
+        if task.finished():
+            return True  # This index has already been verified
+        task.begin()
+        task_success = False
+        try:
+            msg = f'Iterating per index: Index {idx} of {job.indices}'
+            logger.debug(msg)
+            task.add_log(msg)
+            redact = RedactIndex(idx, job)
+            redact.run()
+            task_success = redact.success
+            logger.debug('RESULT: %s', task_success)
+        except MissingIndex as err:
+            logger.critical(err)
+            raise FatalError(f'Index {err.missing} not found.', err) from err
+        except FatalError as err:
+            logger.critical('Fatal upstream error encountered: %s', err.message)
+            raise FatalError('We suffered a fatal upstream error', err) from err
+        end_it(task, task_success)
+        if not task.completed:
+            job.add_log(f'Unable to complete task {task.task_id}')
+        return task.completed
+
     def iterate_indices(self, job: Job) -> bool:
         """Iterate over every index in job.indices"""
+        if 'pipeline' in job.config and job.config['pipeline']:
+            return self.iterate_indices_pipelined(job)
+        if self.max_concurrent_indices > 1 and len(job.indices) > 1:
+            return self.iterate_indices_concurrently(job)
         all_succeeded = True
+        for idx in job.indices:
+            if not self.redact_index(job, idx):
+                all_succeeded = False
+        return all_succeeded
+
+    def iterate_indices_concurrently(self, job: Job) -> bool:
+        """
+        Redact up to :py:attr:`max_concurrent_indices` indices from job.indices at
+        the same time.
+
+        If any index raises an exception, no further indices are started. Indices
+        already in flight are allowed to finish before the exception is re-raised, as
+        interrupting a restore or snapshot midway would only leave more to clean up.
+        """
+        workers = min(self.max_concurrent_indices, len(job.indices))
+        msg = f'Redacting up to {workers} indices concurrently'
+        logger.info(msg)
+        job.add_log(msg)
+        countdown = self.countdown([job], len(job.indices), workers)
+        all_succeeded = True
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='pii-tool'
+        ) as pool:
+            futures = [
+                pool.submit(self.counted, countdown, self.redact_index, job, idx)
+                for idx in job.indices
+            ]
+            try:
+                for future in as_completed(futures):
+                    if not future.result():
+                        all_succeeded = False
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        return all_succeeded
+
+    @staticmethod
+    def countdown(jobs: t.Sequence[Job], count: int, workers: int) -> Countdown:
+        """
+        Tell the batchers of ``jobs`` that ``workers`` threads will redact ``count``
+        indices, and retire each thread from them as it runs out of indices
+
+        :param jobs: The jobs whose indices the threads redact
+        :param count: The number of indices
+        :param workers: The number of threads
+
+        :returns: The countdown of the indices
+        """
+        for job in jobs:
+            job.workers = {'restore': workers, 'snapshot': workers}
+
+        def retire() -> None:
+            for job in jobs:
+                job.retire_worker()
+
+        return Countdown(count, workers, retire)
+
+    @staticmethod
+    def counted(countdown: Countdown, func: t.Callable, *args) -> t.Any:
+        """
+        Run ``func(*args)``, and count it down in ``countdown`` however it ends
+
+        :param countdown: Retires each worker thread as it runs out of items
+        :param func: The function to run for a single item
+        """
+        try:
+            return func(*args)
+        finally:
+            countdown.finished()
+
+    def pipeline_stage(self, item: t.Tuple[Task, RedactIndex], stage: str) -> None:
+        """Run a single pipeline stage for a single index
+
+        :param item: The ``PARENT-TASK`` Task and the RedactIndex for the index
+        :param stage: The stage name
+        """
+        task, redact = item
+        try:
+            redact.snapshot_stage(stage)
+        except MissingIndex as err:
+            logger.critical(err)
+            raise FatalError(f'Index {err.missing} not found.', err) from err
+        except FatalError as err:
+            logger.critical('Fatal upstream error encountered: %s', err.message)
+            raise FatalError('We suffered a fatal upstream error', err) from err
+        if redact.task.completed:
+            end_it(task, redact.success)
+            if not task.completed:
+                task.job.add_log(f'Unable to complete task {task.task_id}')
+
+    def iterate_indices_pipelined(self, job: Job) -> bool:
+        """
+        Redact every index in job.indices, overlapping the searchable snapshot
+        redaction stages of different indices per the job's ``pipeline`` settings.
+
+        Every index is first checked for matching documents and its ILM phase in
+        sequence. Indices that are not searchable snapshots are redacted in place
+        right away. The rest are handed to a
+        :py:class:`~.es_pii_tool.redacters.pipeline.RedactionPipeline`, so that while
+        one index is being snapshotted, the next can be restoring.
+        """
+        all_succeeded = True
+        items = []
         for idx in job.indices:
             task = Task(job, index=idx, id_suffix='PARENT-TASK')
-            # First check to see if idx has been touched as part of a previous run
             if task.finished():
                 continue  # This index has already been verified
             task.begin()
-            task_success = False
+            msg = f'Iterating per index: Index {idx} of {job.indices}'
+            logger.debug(msg)
+            task.add_log(msg)
             try:
-                msg = f'Iterating per index: Index {idx} of {job.indices}'
-                logger.debug(msg)
-                task.add_log(msg)
-                redact = RedactIndex(idx, job, self.counter)
-                redact.run()
-                task_success = redact.success
-                self.counter = redact.counter
-                logger.debug('RESULT: %s', task_success)
+                redact = RedactIndex(idx, job)
+                if redact.prepare():
+                    if not redact.is_snapshot:
+                        redact.normal_redact()
+                        redact.finish()
+                    elif redact.snapshot_setup():
+                        items.append((task, redact))
+                        continue  # The pipeline will end this task
+                    else:
+                        redact.finish()  # A prior run redacted the snapshot
             except MissingIndex as err:
                 logger.critical(err)
                 raise FatalError(f'Index {err.missing} not found.', err) from err
             except FatalError as err:
                 logger.critical('Fatal upstream error encountered: %s', err.message)
                 raise FatalError('We suffered a fatal upstream error', err) from err
-            end_it(task, task_success)
+            end_it(task, redact.success)
             if not task.completed:
                 all_succeeded = False
                 job.add_log(f'Unable to complete task {task.task_id}')
-        return all_succeeded
+        if items:
+            pipeline = RedactionPipeline(job.config['pipeline'])
+            countdowns = {}
+            for stage in job.workers:
+                workers = min(pipeline.depths[stage], len(items))
+                job.workers[stage] = workers
+                retire = partial(job.retire_worker, stage)
+                countdowns[stage] = Countdown(len(items), workers, retire)
+
+            def run_stage(item: t.Tuple[Task, RedactIndex], stage: str) -> None:
+                if stage in countdowns:
+                    self.counted(countdowns[stage], self.pipeline_stage, item, stage)
+                else:
+                    self.pipeline_stage(item, stage)
+
+            pipeline.run(items, run_stage)
+        return all_succeeded and all(task.completed for task, _ in items)
+
+    def redact_shared_index(self, idx: str, jobs: t.Sequence[Job]) -> t.Dict[str, bool]:
+        """Redact a single index for every job in ``jobs`` in one pass
+
+        Each job still gets its own ``PARENT-TASK`` and ``REDACT-INDEX`` tracking docs,
+        and its own query and fields are checked against the index. If the index is a
+        searchable snapshot, the first job with documents to redact restores it, and
+        the update by query of every other such job is run against the same restored
+        index before it is snapshotted and mounted once.
+
+        :param idx: The index name
+        :param jobs: Every job with documents to redact in ``idx``
+
+        :returns: Whether the index was (or had previously been) completed, per job
+            name
+        """
+        results = {}
+        pending: t.List[t.Tuple[Task, RedactIndex]] = []
+        try:
+            for job in jobs:
+                task = Task(job, index=idx, id_suffix='PARENT-TASK')
+                if task.finished():
+                    results[job.name] = True  # Already verified
+                    continue
+                task.begin()
+                msg = f'Iterating per index: Index {idx} of {job.indices}'
+                logger.debug(msg)
+                task.add_log(msg)
+                redact = RedactIndex(idx, job)
+                if redact.prepare():
+                    if redact.is_snapshot:
+                        pending.append((task, redact))
+                        continue  # Ended below, once the shared redaction is done
+                    redact.normal_redact()
+                    redact.finish()
+                end_it(task, redact.success)
+                results[job.name] = task.completed
+            if pending:
+                (_, lead), riders = pending[0], pending[1:]
+                if riders:
+                    msg = (
+                        f'Redacting {idx} for {len(pending)} jobs with a single '
+                        f'restore: {[redact.task.job.name for _, redact in pending]}'
+                    )
+                    logger.info(msg)
+                    for _, redact in pending:
+                        redact.task.add_log(msg)
+                lead.snapshot_redact(riders=[redact.task for _, redact in riders])
+                for _, redact in riders:
+                    if lead.success:
+                        redact.finish()
+                    else:
+                        redact.success = False
+                for task, redact in pending:
+                    end_it(task, redact.success)
+                    results[task.job.name] = task.completed
+        except MissingIndex as err:
+            logger.critical(err)
+            raise FatalError(f'Index {err.missing} not found.', err) from err
+        except FatalError as err:
+            logger.critical('Fatal upstream error encountered: %s', err.message)
+            raise FatalError('We suffered a fatal upstream error', err) from err
+        for task, _ in pending:
+            if not task.completed:
+                task.job.add_log(f'Unable to complete task {task.task_id}')
+        return results
+
+    def iterate_index_major(self, jobs: t.Sequence[Job]) -> t.Dict[str, bool]:
+        """
+        Redact every index of every job in ``jobs``, grouping the jobs by index so
+        each index is only restored, snapshotted, and mounted once
+
+        Up to :py:attr:`max_concurrent_indices` indices are redacted at the same time.
+
+        :param jobs: The jobs which passed their document count verification
+
+        :returns: Whether every index of each job was completed, per job name
+        """
+        plan: t.Dict[str, t.List[Job]] = {}
+        for job in jobs:
+            for idx in job.indices:
+                plan.setdefault(idx, []).append(job)
+        shared = sum(1 for idx_jobs in plan.values() if len(idx_jobs) > 1)
+        msg = (
+            f'Index-major plan: {len(plan)} indices across {len(jobs)} jobs, '
+            f'{shared} of which are redacted for more than one job'
+        )
+        logger.info(msg)
+        for job in jobs:
+            job.add_log(msg)
+        success = {job.name: True for job in jobs}
+        workers = min(self.max_concurrent_indices, max(1, len(plan)))
+        countdown = self.countdown(jobs, len(plan), workers)
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='pii-tool'
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self.counted, countdown, self.redact_shared_index, idx, idx_jobs
+                )
+                for idx, idx_jobs in plan.items()
+            ]
+            try:
+                for future in as_completed(futures):
+                    for name, completed in future.result().items():
+                        success[name] = success[name] and completed
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        return success
+
+    def start_job(self, config_block: t.Dict) -> t.Union[Job, None]:
+        """
+        Build and begin the job for ``config_block``, and verify its document count
+
+        :param config_block: A single configuration block from self.redactions
+
+        :returns: The job, ready to have its indices redacted, or ``None`` if it was
+            already finished or failed its document count verification
+        """
+        if self.dry_run:
+            logger.info("DRY-RUN MODE ENABLED. No data will be changed.")
+
+        # There's really only 1 root-level key for each configuration block,
+        # and that's job_id
+        job_name = list(config_block.keys())[0]
+        args = (self.client, self.tracking_index, job_name, config_block[job_name])
+        job = Job(*args, dry_run=self.dry_run, cache=self.cache, journal=self.journal)
+        if job.finished():
+            return None
+        job.begin()
+        if not self.verify_doc_count(job):
+            # This configuration block can't go further because of the mismatch
+            end_it(job, False)
+            job.close()
+            return None
+        self.skip_indices_without_hits(job)
+        return job
+
+    def load_tracking(self) -> None:
+        """
+        Load the tracking docs of every job in self.redactions into
+        :py:attr:`cache` with a single scan, after replaying any updates left in
+        :py:attr:`journal` by a prior run
+        """
+        names = [
+            list(config_block.keys())[0]
+            for config_block in self.redactions['redactions']  # type: ignore
+        ]
+        try:
+            if self.journal is not None:
+                # Updates which never reached the index come before anything else
+                self.journal.replay(self.client)
+            self.cache.load(self.client, self.tracking_index, names)
+        except BadClientResult as exc:
+            logger.critical(exc.message)
+            raise FatalError(
+                f'Unable to load tracking docs from {self.tracking_index}', exc
+            ) from exc
 
     def iterate_configuration(self) -> None:
         """Iterate over every configuration block in self.redactions"""
         logger.debug('Full redactions object from config: %s', self.redactions)
+        self.load_tracking()
+        if self.index_major:
+            self.iterate_configuration_index_major()
+            return
         for config_block in self.redactions['redactions']:  # type: ignore
-            job_success = True
-            # Reset counter to zero for each full iteration
-            self.counter = 0
-            if self.dry_run:
-                logger.info("DRY-RUN MODE ENABLED. No data will be changed.")
-
-            # There's really only 1 root-level key for each configuration block,
-            # and that's job_id
-            job_name = list(config_block.keys())[0]
-            args = (self.client, self.tracking_index, job_name, config_block[job_name])
-            job = Job(*args, dry_run=self.dry_run)
-            if job.finished():
-                continue
-            job.begin()
-            if not self.verify_doc_count(job):
-                # This configuration block can't go further because of the mismatch
-                job_success = False
-                end_it(job, job_success)
+            job = self.start_job(config_block)
+            if job is None:
                 continue
+            try:
+                job_success = self.iterate_indices(job)
+                # At this point, job.counter should be equal to total, indicating that
+                # we matched expected_docs. We should therefore register that the job
+                # was successful, if we have reached this point with no other errors
+                # having interrupted the process.
 
-            job_success = self.iterate_indices(job)
-            # At this point, self.counter should be equal to total, indicating that we
-            # matched expected_docs. We should therefore register that the job was
-            # successful, if we have reached this point with no other errors having
-            # interrupted the process.
+                end_it(job, job_success)
+            finally:
+                job.close()
 
-            end_it(job, job_success)
+    def iterate_configuration_index_major(self) -> None:
+        """
+        Start every job in self.redactions, then redact index by index, so that
+        jobs sharing an index share a single restore of it
+        """
+        jobs = []
+        for config_block in self.redactions['redactions']:  # type: ignore
+            job = self.start_job(config_block)
+            if job is not None:
+                jobs.append(job)
+        if not jobs:
+            return
+        try:
+            success = self.iterate_index_major(jobs)
+            for job in jobs:
+                end_it(job, success[job.name])
+        finally:
+            for job in jobs:
+                job.close()
 
     def run(self) -> None:
         """Do the thing"""
         logger.info('PII scrub initiated')
-        self.iterate_configuration()
+        if not self.dry_run:
+            # Every job's update_by_query uses the same stored script
+            put_redact_script(self.client)
+        try:
+            self.iterate_configuration()
+        finally:
+            if self.journal is not None:
+                self.journal.close()
@@ -5,6 +5,8 @@ from es_client.defaults import OPTION_DEFAULTS, SHOW_EVERYTHING
 from es_client.helpers import config as cfg
 from es_client.helpers.logging import configure_logging
 from es_pii_tool.commands.from_yaml import file_based
+from es_pii_tool.commands.migrate import migrate_tracking
+from es_pii_tool.commands.rethrottle import rethrottle
 
 # pylint: disable=W0613,W0622,R0913,R0914
 # These pylint items are being disabled because of how Click works.
@@ -94,3 +96,5 @@ def show_all_options(
 
 
 run.add_command(file_based)
+run.add_command(migrate_tracking)
+run.add_command(rethrottle)
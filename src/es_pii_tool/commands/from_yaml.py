@@ -4,10 +4,19 @@ import logging
 import click
 from es_client.helpers.config import cli_opts, get_client
 from es_client.helpers.utils import option_wrapper
-from es_pii_tool.defaults import CLICK_DRYRUN, CLICK_TRACKING
+from es_pii_tool.defaults import (
+    CLICK_CONCURRENCY,
+    CLICK_DRYRUN,
+    CLICK_INDEX_MAJOR,
+    CLICK_JOURNAL,
+    CLICK_TRACKING,
+)
 from es_pii_tool.exceptions import FatalError
 from es_pii_tool.base import PiiTool
 
+# pylint: disable=R0913,R0917
+# These pylint items are being disabled because of how Click works.
+
 logger = logging.getLogger(__name__)
 
 click_opt_wrap = option_wrapper()  # Needed or pylint blows a fuse
@@ -16,9 +25,20 @@ click_opt_wrap = option_wrapper()  # Needed or pylint blows a fuse
 @click.command()
 @click_opt_wrap(*cli_opts('dry-run', settings=CLICK_DRYRUN))
 @click_opt_wrap(*cli_opts('tracking-index', settings=CLICK_TRACKING))
+@click_opt_wrap(*cli_opts('max-concurrent-indices', settings=CLICK_CONCURRENCY))
+@click_opt_wrap(*cli_opts('index-major', settings=CLICK_INDEX_MAJOR))
+@click_opt_wrap(*cli_opts('journal', settings=CLICK_JOURNAL))
 @click.argument('redactions_file', type=click.Path(exists=True), nargs=1)
 @click.pass_context
-def file_based(ctx, dry_run, redactions_file, tracking_index):
+def file_based(
+    ctx,
+    dry_run,
+    redactions_file,
+    tracking_index,
+    max_concurrent_indices,
+    index_major,
+    journal,
+):
     """Redact from YAML config file"""
     try:
         client = get_client(configdict=ctx.obj['configdict'])
@@ -29,7 +49,13 @@ def file_based(ctx, dry_run, redactions_file, tracking_index):
         ) from exc
     try:
         main = PiiTool(
-            client, tracking_index, redaction_file=redactions_file, dry_run=dry_run
+            client,
+            tracking_index,
+            redaction_file=redactions_file,
+            dry_run=dry_run,
+            max_concurrent_indices=max_concurrent_indices,
+            index_major=index_major,
+            journal=journal,
         )
         main.run()
     except Exception as exc:
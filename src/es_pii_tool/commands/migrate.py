@@ -0,0 +1,29 @@
+"""Click decorated function for migrating the tracking index to the current schema"""
+
+import logging
+import click
+from es_client.helpers.config import cli_opts, get_client
+from es_client.helpers.utils import option_wrapper
+from es_pii_tool.defaults import CLICK_KEEP_SOURCE, CLICK_TRACKING
+from es_pii_tool.exceptions import FatalError
+from es_pii_tool.helpers.tracking import migrate_tracking as migrate
+
+logger = logging.getLogger(__name__)
+
+click_opt_wrap = option_wrapper()  # Needed or pylint blows a fuse
+
+
+@click.command()
+@click_opt_wrap(*cli_opts('tracking-index', settings=CLICK_TRACKING))
+@click_opt_wrap(*cli_opts('keep-source', settings=CLICK_KEEP_SOURCE))
+@click.pass_context
+def migrate_tracking(ctx, tracking_index, keep_source):
+    """Migrate the tracking index to the current schema"""
+    try:
+        client = get_client(configdict=ctx.obj['configdict'])
+    except Exception as exc:
+        logger.critical('Error attempting to get client connection: %s', exc.args[0])
+        raise FatalError(
+            'Unable to establish connection to Elasticsearch!', exc
+        ) from exc
+    migrate(client, tracking_index, keep_source=keep_source)
@@ -0,0 +1,29 @@
+"""Click decorated function for rethrottling a running update_by_query"""
+
+import logging
+import click
+from es_client.helpers.config import cli_opts, get_client
+from es_client.helpers.utils import option_wrapper
+from es_pii_tool.defaults import CLICK_RETHROTTLE
+from es_pii_tool.exceptions import FatalError
+from es_pii_tool.helpers.elastic_api import rethrottle_update_by_query
+
+logger = logging.getLogger(__name__)
+
+click_opt_wrap = option_wrapper()  # Needed or pylint blows a fuse
+
+
+@click.command()
+@click_opt_wrap(*cli_opts('requests-per-second', settings=CLICK_RETHROTTLE))
+@click.argument('task_id', type=str, nargs=1)
+@click.pass_context
+def rethrottle(ctx, requests_per_second, task_id):
+    """Rethrottle a running update_by_query redaction task"""
+    try:
+        client = get_client(configdict=ctx.obj['configdict'])
+    except Exception as exc:
+        logger.critical('Error attempting to get client connection: %s', exc.args[0])
+        raise FatalError(
+            'Unable to establish connection to Elasticsearch!', exc
+        ) from exc
+    rethrottle_update_by_query(client, task_id, requests_per_second)
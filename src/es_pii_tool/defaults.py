@@ -1,9 +1,28 @@
 """App Defaults"""
 
 import typing as t
-from voluptuous import All, Any, Boolean, Coerce, Optional, Range, Required, Schema
+import click
+from voluptuous import (
+    All,
+    Any,
+    Boolean,
+    Coerce,
+    Exclusive,
+    Invalid,
+    Optional,
+    Range,
+    Required,
+    Schema,
+)
 
 TRACKING_INDEX = 'redactions-tracker'
+#: Seconds between flushes of buffered tracking doc updates
+TRACKING_FLUSH_INTERVAL: float = 5.0
+#: The most recent log lines of each job or task kept in memory. Every line is
+#: still written to the tracking index.
+TRACKING_LOG_LINES: int = 100
+#: The version of :py:func:`status_mappings`. Version 1 used a parent/child join.
+TRACKING_SCHEMA_VERSION: int = 2
 
 CLICK_DRYRUN = {
     'dry-run': {
@@ -14,6 +33,14 @@ CLICK_DRYRUN = {
     }
 }
 
+CLICK_RETHROTTLE = {
+    'requests-per-second': {
+        'help': 'New throttle for the task. -1 means no throttling.',
+        'type': click.FloatRange(min=-1),
+        'required': True,
+    }
+}
+
 CLICK_TRACKING = {
     'tracking-index': {
         'help': 'Name for the tracking index.',
@@ -24,6 +51,45 @@ CLICK_TRACKING = {
     }
 }
 
+CLICK_JOURNAL = {
+    'journal': {
+        'help': 'Path to a local write-ahead journal of tracking updates.',
+        'type': click.Path(dir_okay=False),
+        'default': None,
+        'show_envvar': True,
+        'envvar': 'PII_TOOL_JOURNAL',
+    }
+}
+
+CLICK_KEEP_SOURCE = {
+    'keep-source': {
+        'help': 'Keep the original tracking index after migrating it.',
+        'is_flag': True,
+        'show_envvar': True,
+        'envvar': 'PII_TOOL_KEEP_SOURCE',
+    }
+}
+
+CLICK_CONCURRENCY = {
+    'max-concurrent-indices': {
+        'help': 'Maximum number of indices to redact at the same time.',
+        'type': click.IntRange(min=1),
+        'default': 1,
+        'show_default': True,
+        'show_envvar': True,
+        'envvar': 'PII_TOOL_MAX_CONCURRENT_INDICES',
+    }
+}
+
+CLICK_INDEX_MAJOR = {
+    'index-major': {
+        'help': 'Redact index by index across all jobs, restoring each index once.',
+        'is_flag': True,
+        'show_envvar': True,
+        'envvar': 'PII_TOOL_INDEX_MAJOR',
+    }
+}
+
 PHASES: t.Sequence = ['hot', 'warm', 'cold', 'frozen', 'delete']
 
 PAUSE_DEFAULT: str = '9.0'
@@ -31,6 +97,39 @@ PAUSE_ENVVAR: str = 'PII_TOOL_PAUSE'
 TIMEOUT_DEFAULT: str = '7200.0'
 TIMEOUT_ENVVAR: str = 'PII_TOOL_TIMEOUT'
 
+#: The polling schedule for each kind of wait. Checks start ``initial`` seconds
+#: apart, and the pause grows by ``factor`` after each check until it reaches ``cap``.
+#: No pause will ever exceed the value of PII_TOOL_PAUSE.
+BACKOFF_SCHEDULES: t.Dict[str, t.Dict[str, float]] = {
+    'task': {'initial': 0.5, 'factor': 2.0, 'cap': 9.0},
+    'restore': {'initial': 1.0, 'factor': 2.0, 'cap': 9.0},
+    'snapshot': {'initial': 1.0, 'factor': 2.0, 'cap': 9.0},
+    'mount': {'initial': 0.25, 'factor': 2.0, 'cap': 3.0},
+    'ilm': {'initial': 0.5, 'factor': 1.5, 'cap': 5.0},
+}
+#: Each pause is randomly lengthened or shortened by up to this fraction
+BACKOFF_JITTER: float = 0.2
+
+LONG_POLL_DEFAULT: str = 'false'
+LONG_POLL_ENVVAR: str = 'PII_TOOL_LONG_POLL'
+#: The number of seconds each long-poll request waits server-side for a task
+LONG_POLL_INTERVAL: int = 60
+
+#: The number of hits per request when scanning query results
+SCAN_PAGE_SIZE: int = 1000
+#: How long a scan's point in time is kept open between requests
+SCAN_KEEP_ALIVE: str = '2m'
+
+#: The Elasticsearch default for ``index.max_terms_count``
+MAX_TERMS_COUNT: int = 65536
+
+
+#: Make ``only_expunge_deletes`` merge away every deleted doc, not only those in
+#: segments which are more than 10% deleted
+EXPUNGE_ALL_DELETES: t.Dict[str, float] = {
+    'index.merge.policy.expunge_deletes_allowed': 0.0
+}
+
 
 def forcemerge_schema() -> t.Dict[Optional, t.Union[All, Any, Coerce, Range, Required]]:
     """Define the forcemerge schema"""
@@ -45,36 +144,175 @@ def forcemerge_schema() -> t.Dict[Optional, t.Union[All, Any, Coerce, Range, Req
         Optional('only_expunge_deletes', default=False): Any(
             bool, All(Any(str), Boolean())
         ),
+        # Let the deleted doc ratio and segment counts decide how (or whether) to merge
+        Optional('auto', default=False): Any(bool, All(Any(str), Boolean())),
+        # With auto, do a full merge if at least this percent of docs are deleted...
+        Optional('full_above_deleted_pct', default=20.0): All(
+            Coerce(float), Range(min=0, max=100)
+        ),
+        # ...or if any shard has more than this many segments
+        Optional('max_segments_per_shard', default=10): All(Coerce(int), Range(min=1)),
     }
 
 
-def redactions_schema() -> t.Dict[
-    Optional,
-    t.Dict[
-        t.Union[Required, Optional],
-        t.Union[All, Any, t.Dict, t.Sequence[Any], Optional],
-    ],
-]:
+def pipeline_schema() -> t.Dict[Optional, All]:
+    """Define the pipeline schema. Each key is a stage, and each value is its depth"""
+    return {
+        Optional(stage, default=1): All(Coerce(int), Range(min=1, max=64))
+        for stage in ['prep', 'restore', 'redact', 'snapshot', 'finalize']
+    }
+
+
+def batch_schema() -> t.Dict[Optional, All]:
+    """Define the schema for restoring or snapshotting several indices together"""
+    return {
+        # The most indices in a single restore or snapshot
+        Optional('max_indices', default=25): All(Coerce(int), Range(min=1, max=1000)),
+        # Seconds the first index waits for others to join its restore or snapshot
+        Optional('max_wait', default=30): All(Coerce(float), Range(min=0)),
+    }
+
+
+def adaptive_throttle_schema() -> t.Dict[Optional, All]:
+    """Define the update_by_query adaptive throttle schema"""
+    return {
+        Optional('min_requests_per_second', default=100): All(
+            Coerce(float), Range(min=1)
+        ),
+        Optional('max_requests_per_second', default=10000): All(
+            Coerce(float), Range(min=1)
+        ),
+        # Added to the throttle after each interval without cluster pressure
+        Optional('increase', default=250): All(Coerce(float), Range(min=1)),
+        # The throttle is multiplied by this after each interval with pressure
+        Optional('decrease', default=0.5): All(
+            Coerce(float), Range(min=0.05, max=0.95)
+        ),
+        Optional('interval', default=10): All(Coerce(float), Range(min=1)),
+        # Average indexing time per document, across all nodes
+        Optional('latency_budget_ms', default=5): All(Coerce(float), Range(min=0)),
+        # The longest write or search thread pool queue on any node
+        Optional('max_queue', default=50): All(Coerce(int), Range(min=0)),
+    }
+
+
+def update_by_query_schema() -> t.Dict[Optional, t.Union[All, Any, t.Dict]]:
+    """Define the update_by_query schema"""
+    return {
+        # 'auto' is one slice per primary shard. Not sliced unless set.
+        Optional('slices'): Any('auto', All(Coerce(int), Range(min=1, max=1024))),
+        Optional('scroll_size'): All(Coerce(int), Range(min=1, max=10000)),
+        # -1 means no throttling
+        Optional('requests_per_second', default=-1): All(Coerce(float), Range(min=-1)),
+        Optional('conflicts', default='abort'): Any('abort', 'proceed'),
+        Optional('adaptive'): adaptive_throttle_schema(),
+    }
+
+
+def terms_file_schema() -> t.Dict[t.Union[Required, Optional], t.Union[All, Any]]:
+    """Define the schema for a job built from a file of field values"""
+    return {
+        Required('field'): Any(str),
+        # A file of values, one per line, or comma separated
+        Required('path'): Any(str),
+        # Values per terms query. Never more than the index.max_terms_count setting
+        Optional('chunk_size'): All(Coerce(int), Range(min=1)),
+    }
+
+
+def has_query(config: t.Dict) -> t.Dict:
+    """Ensure a redaction job has either a ``query`` or a ``terms_file``"""
+    if 'query' not in config and 'terms_file' not in config:
+        raise Invalid('Either "query" or "terms_file" is required')
+    return config
+
+
+def redactions_schema() -> t.Dict[Optional, All]:
     """An index pattern to search and redact data from"""
     merge = forcemerge_schema()
+    pipeline = pipeline_schema()
+    ubq = update_by_query_schema()
+    batch = batch_schema()
     return {
-        Optional(Any(str)): {
-            Required('pattern'): Any(str),
-            Required('query'): {Any(str): dict},
-            Required('fields'): [Any(str)],
-            Required('message', default='REDACTED'): Any(str),
-            # The Boolean() here is a capitalized function, not a class. This code
-            # passes without the need for the passed value because of how voluptuous
-            # Schema validation works.
-            # pylint: disable=no-value-for-parameter
-            Optional('delete', default=True): Any(bool, All(Any(str), Boolean())),
-            Required('expected_docs'): All(Coerce(int), Range(min=1, max=32768)),
-            Optional('restore_settings', default=None): Any(dict, None),
-            Optional('forcemerge'): merge,
-        }
+        Optional(Any(str)): All(
+            {
+                Required('pattern'): Any(str),
+                Exclusive('query', 'query'): {Any(str): dict},
+                Exclusive('terms_file', 'query'): terms_file_schema(),
+                Required('fields'): [Any(str)],
+                Required('message', default='REDACTED'): Any(str),
+                # The Boolean() here is a capitalized function, not a class. This code
+                # passes without the need for the passed value because of how voluptuous
+                # Schema validation works.
+                # pylint: disable=no-value-for-parameter
+                Optional('delete', default=True): Any(bool, All(Any(str), Boolean())),
+                Required('expected_docs'): All(Coerce(int), Range(min=1)),
+                Optional('restore_settings', default=None): Any(dict, None),
+                Optional('forcemerge'): merge,
+                Optional('pipeline'): pipeline,
+                Optional('update_by_query'): ubq,
+                Optional('restore_batch'): batch,
+                Optional('snapshot_batch'): batch,
+            },
+            has_query,
+        )
     }
 
 
+#: The id of the stored painless script used to redact fields
+REDACT_SCRIPT_ID: str = 'pii-tool-redact'
+
+
+def redact_script() -> t.Dict:
+    """
+    The stored painless script used by update_by_query to redact fields
+
+    It takes ``fields`` and ``message`` as params, so it is compiled once no matter
+    how many jobs use it. Dotted field names are walked one subkey at a time, and
+    a field is skipped if one of its parent objects is missing.
+    """
+    source = (
+        "for (String field : params.fields) {"
+        "  if (ctx._source.containsKey(field)) {"
+        "    ctx._source[field] = params.message; continue;"
+        "  }"
+        "  String[] keys = field.splitOnToken('.');"
+        "  def parent = ctx._source;"
+        "  for (int i = 0; i < keys.length - 1 && parent != null; i++) {"
+        "    parent = parent instanceof Map ? parent.get(keys[i]) : null;"
+        "  }"
+        "  if (parent instanceof Map) {"
+        "    parent[keys[keys.length - 1]] = params.message;"
+        "  }"
+        "}"
+    )
+    return {'lang': 'painless', 'source': source}
+
+
+def unredacted_script() -> str:
+    """
+    The painless source of a runtime field which is ``true`` if ``params.field`` is
+    in ``_source``, but is not exactly ``params.message``
+
+    The field is looked up the same way :py:func:`redact_script` finds it, so a
+    value is only considered redacted if it is exactly what the redaction wrote.
+    """
+    return (
+        "def value = null;"
+        "if (params._source.containsKey(params.field)) {"
+        "  value = params._source[params.field];"
+        "} else {"
+        "  String[] keys = params.field.splitOnToken('.');"
+        "  def parent = params._source;"
+        "  for (int i = 0; i < keys.length - 1 && parent != null; i++) {"
+        "    parent = parent instanceof Map ? parent.get(keys[i]) : null;"
+        "  }"
+        "  if (parent instanceof Map) { value = parent.get(keys[keys.length - 1]); }"
+        "}"
+        "if (value != null) { emit(!params.message.equals(value)); }"
+    )
+
+
 def index_settings() -> t.Dict:
     """The Elasticsearch index settings for the progress/status tracking index"""
     return {
@@ -88,18 +326,23 @@ def index_settings() -> t.Dict:
 def status_mappings() -> t.Dict:
     """The Elasticsearch index mappings for the progress/status tracking index"""
     return {
+        '_meta': {'schema_version': TRACKING_SCHEMA_VERSION},
         'properties': {
             'job': {'type': 'keyword'},
             'task': {'type': 'keyword'},
-            'join_field': {'type': 'join', 'relations': {'job': 'task'}},
             'cleanup': {'type': 'keyword'},
             'completed': {'type': 'boolean'},
             'end_time': {'type': 'date'},
             'errors': {'type': 'boolean'},
             'dry_run': {'type': 'boolean'},
+            'handles': {'type': 'object', 'enabled': False},
             'index': {'type': 'keyword'},
-            'logs': {'type': 'text'},
+            'line': {'type': 'text', 'index': False},
+            'log_of': {'type': 'keyword'},
+            'logs': {'type': 'text', 'index': False},
+            'seq': {'type': 'long'},
             'start_time': {'type': 'date'},
+            'state': {'type': 'keyword', 'index': False, 'doc_values': False},
         },
         'dynamic_templates': [
             {
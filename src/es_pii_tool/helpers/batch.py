@@ -0,0 +1,328 @@
+"""Restore or snapshot several redaction targets together in a single API call"""
+
+import typing as t
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from time import monotonic
+from es_pii_tool.helpers.snapshot_api import submit_restore, take_snapshot
+from es_pii_tool.helpers.waiter import TIMEOUT_VALUE, wait_for_restore
+
+if t.TYPE_CHECKING:
+    from elasticsearch8 import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=R0902,R0903,R0913,W0718
+
+#: Restored names drop the timestamp of any prior redaction, so an index redacted
+#: again does not collect another timestamp each time
+RENAME_PATTERN = r'(?:redacted-\d{14}-)?(.+)'
+
+
+class Batch:
+    """The members going into one API call
+
+    :param key: What every member of the batch has in common
+    :param name: The name of the batch, e.g. the snapshot name
+    """
+
+    def __init__(self, key: t.Hashable, name: str):
+        self.key = key
+        self.name = name
+        self.members: t.List[str] = []
+        #: Set when no more members may join
+        self.closed = threading.Event()
+        #: Set when the API call has completed or failed
+        self.done = threading.Event()
+        self.error: t.Union[Exception, None] = None
+
+
+class Countdown:
+    """
+    Count down the items which a pool of ``workers`` threads has left to finish, and
+    call ``retire`` each time that leaves one more thread with nothing left to do, so
+    batches stop waiting for it
+
+    :param count: The number of items
+    :param workers: The number of threads working through them
+    :param retire: Called once for each thread which runs out of items
+    """
+
+    def __init__(self, count: int, workers: int, retire: t.Callable[[], None]):
+        self.left = count
+        self.workers = workers
+        self.retire = retire
+        self.lock = threading.Lock()
+
+    def finished(self) -> None:
+        """Record that an item is finished"""
+        with self.lock:
+            self.left -= 1
+            idle = self.left < self.workers
+        if idle:
+            self.retire()
+
+
+class Batcher(ABC):
+    """
+    Group the members of concurrently redacted indices which share a ``key`` into a
+    single API call, rather than making one call per index
+
+    The first member to arrive for a key opens a batch. Other members arriving for the
+    same key join it, until it has ``max_indices`` members, it has been open for
+    ``max_wait`` seconds, or no other member can arrive because every worker is
+    already waiting in this batcher. The first member's thread then calls
+    :py:meth:`submit` for every member in the batch, while the others wait for it.
+
+    :param client: A client connection object
+    :param max_indices: The most members in a single batch
+    :param max_wait: The longest time a batch waits for more members to join
+    :param workers: The most threads which may bring members to this batcher at
+        once. With a single worker, a batch never waits for more members.
+    """
+
+    def __init__(
+        self,
+        client: 'Elasticsearch',
+        max_indices: int = 25,
+        max_wait: float = 30.0,
+        workers: int = 1,
+    ):
+        self.client = client
+        self.max_indices = max_indices
+        self.max_wait = max_wait
+        self.workers = max(1, workers)
+        #: The number of threads presently in :py:meth:`run`
+        self.waiting = 0
+        self.lock = threading.Lock()
+        #: Notified whenever a batch closes, or a member or worker comes or goes
+        self.changed = threading.Condition(self.lock)
+        self.open: t.Dict[t.Hashable, Batch] = {}
+        self.seq = 0
+
+    def batch_name(self) -> str:
+        """:returns: The name of a new batch. Call with the lock held."""
+        self.seq += 1
+        return f'{datetime.now().strftime("%Y%m%d%H%M%S")}-batch{self.seq:03}'
+
+    @abstractmethod
+    def submit(self, batch: Batch) -> None:
+        """Make the API call for every member of ``batch``, and wait for it"""
+
+    def join(self, key: t.Hashable, member: str) -> t.Tuple[Batch, bool]:
+        """
+        Add ``member`` to the open batch for ``key``, opening a new one if there is
+        none
+
+        :returns: The batch, and whether this member opened it
+        """
+        with self.lock:
+            self.waiting += 1
+            self.changed.notify_all()
+            batch = self.open.get(key)
+            leader = batch is None
+            if batch is None:
+                batch = Batch(key, self.batch_name())
+                self.open[key] = batch
+            batch.members.append(member)
+            if len(batch.members) >= self.max_indices:
+                self.close(batch)
+        return batch, leader
+
+    def close(self, batch: Batch) -> None:
+        """Stop any more members from joining ``batch``. Call with the lock held."""
+        if self.open.get(batch.key) is batch:
+            del self.open[batch.key]
+        batch.closed.set()
+        self.changed.notify_all()
+
+    def retire(self) -> None:
+        """
+        Record that a worker will bring no more members, e.g. as there are no indices
+        left for it to start
+        """
+        with self.lock:
+            self.workers -= 1
+            self.changed.notify_all()
+
+    def gather(self, batch: Batch) -> None:
+        """
+        Wait until ``batch`` is full, it has waited ``max_wait`` seconds, or every
+        worker is waiting in this batcher, then close it
+        """
+        deadline = monotonic() + self.max_wait
+        with self.lock:
+            while not batch.closed.is_set() and self.waiting < self.workers:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            self.close(batch)
+
+    def run(
+        self,
+        key: t.Hashable,
+        member: str,
+        on_join: t.Union[t.Callable[[Batch], None], None] = None,
+    ) -> Batch:
+        """
+        Run the API call for ``member`` along with whatever other members join the
+        same batch, and wait for it to complete
+
+        :param key: What the members of a batch have in common
+        :param member: The member to add
+        :param on_join: Called with the batch as soon as ``member`` has joined it
+
+        :returns: The batch which ``member`` joined
+        """
+        batch, leader = self.join(key, member)
+        try:
+            if on_join:
+                on_join(batch)
+            if leader:
+                self.gather(batch)
+                try:
+                    self.submit(batch)
+                except Exception as exc:
+                    batch.error = exc
+                finally:
+                    batch.done.set()
+            else:
+                logger.debug('Waiting on batch %s for %s', batch.name, member)
+                batch.done.wait()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                self.changed.notify_all()
+        if batch.error is not None:
+            raise batch.error
+        return batch
+
+
+class SnapshotBatcher(Batcher):
+    """
+    Take one snapshot of the redaction targets of every index in a batch. The key is
+    the repository name.
+    """
+
+    def batch_name(self) -> str:
+        return f'redacted-{super().batch_name()}'
+
+    def submit(self, batch: Batch) -> None:
+        msg = (
+            f'Taking snapshot {batch.name} of {len(batch.members)} redaction '
+            f'target(s): {batch.members}'
+        )
+        logger.info(msg)
+        take_snapshot(self.client, str(batch.key), batch.name, ','.join(batch.members))
+
+    def snapshot(
+        self,
+        repository: str,
+        target: str,
+        on_submit: t.Union[t.Callable[[str], None], None] = None,
+    ) -> str:
+        """
+        Snapshot ``target`` along with whatever other targets join the same batch,
+        and wait for the snapshot to complete
+
+        :param repository: The repository name
+        :param target: The redaction target index name
+        :param on_submit: Called with the snapshot name as soon as it is known, so
+            it can be persisted
+
+        :returns: The name of the snapshot containing ``target``
+        """
+
+        def on_join(batch: Batch) -> None:
+            if on_submit:
+                on_submit(batch.name)
+
+        return self.run(repository, target, on_join=on_join).name
+
+
+class RestoreBatcher(Batcher):
+    """
+    Restore every index in a batch from their shared source snapshot in a single
+    restore call. The key is the repository and snapshot name.
+
+    Every index in a batch is restored as ``redacted-<batch name>-<index name>``, so a
+    single rename pattern can map each to its own redaction target.
+
+    :param index_settings: Any settings to apply to the restored indices
+    """
+
+    def __init__(
+        self,
+        client: 'Elasticsearch',
+        max_indices: int = 25,
+        max_wait: float = 30.0,
+        workers: int = 1,
+        index_settings: t.Union[t.Dict, None] = None,
+    ):
+        super().__init__(
+            client, max_indices=max_indices, max_wait=max_wait, workers=workers
+        )
+        self.index_settings = index_settings
+
+    @staticmethod
+    def replacement(batch: Batch) -> str:
+        """:returns: The rename replacement for the indices restored by ``batch``"""
+        return f'redacted-{batch.name}-$1'
+
+    def target(self, batch: Batch, index: str) -> str:
+        """:returns: The name ``index`` will be restored as by ``batch``"""
+        match = re.fullmatch(RENAME_PATTERN, index)
+        name = match.group(1) if match else index
+        return self.replacement(batch).replace('$1', name)
+
+    def submit(self, batch: Batch) -> None:
+        repository, snapshot = t.cast(t.Tuple[str, str], batch.key)
+        targets = [self.target(batch, index) for index in batch.members]
+        msg = (
+            f'Restoring {len(batch.members)} index(es) from snapshot {snapshot}: '
+            f'{batch.members} as {targets}'
+        )
+        logger.info(msg)
+        submit_restore(
+            self.client,
+            repository,
+            snapshot,
+            ','.join(batch.members),
+            self.replacement(batch),
+            re_pattern=RENAME_PATTERN,
+            index_settings=self.index_settings,  # type: ignore
+        )
+        logger.info('Checking if restoration completed...')
+        wait_for_restore(self.client, targets, timeout=TIMEOUT_VALUE)
+        logger.info('Restoration of %s complete', targets)
+
+    def restore(
+        self,
+        repository: str,
+        snapshot: str,
+        index: str,
+        on_submit: t.Union[t.Callable[[str], None], None] = None,
+    ) -> str:
+        """
+        Restore ``index`` along with whatever other indices from the same snapshot
+        join the same batch, and wait for all of them to be restored
+
+        :param repository: The repository name
+        :param snapshot: The snapshot name
+        :param index: The index name as it appears in the snapshot metadata
+        :param on_submit: Called with the restored index name as soon as it is
+            known, so it can be persisted
+
+        :returns: The name ``index`` was restored as
+        """
+
+        def on_join(batch: Batch) -> None:
+            if on_submit:
+                on_submit(self.target(batch, index))
+
+        batch = self.run((repository, snapshot), index, on_join=on_join)
+        return self.target(batch, index)
@@ -1,20 +1,17 @@
 """Functions making Elasticsearch API calls"""
 
-from os import getenv
 import typing as t
 import logging
+from functools import partial
 from elasticsearch8.exceptions import (
     ApiError,
     NotFoundError,
     TransportError,
     BadRequestError,
 )
-from es_wait import Index, Restore, Snapshot, Task
 from es_pii_tool.defaults import (
-    PAUSE_DEFAULT,
-    PAUSE_ENVVAR,
-    TIMEOUT_DEFAULT,
-    TIMEOUT_ENVVAR,
+    REDACT_SCRIPT_ID,
+    redact_script,
 )
 from es_pii_tool.exceptions import (
     BadClientResult,
@@ -22,19 +19,16 @@ from es_pii_tool.exceptions import (
     MissingDocument,
     MissingError,
     MissingIndex,
-    ValueMismatch,
 )
-from es_pii_tool.helpers.utils import build_script, check_fields, es_waiter
+from es_pii_tool.helpers.throttle import AdaptiveThrottle
+from es_pii_tool.helpers.utils import build_script
+from es_pii_tool.helpers.waiter import TIMEOUT_VALUE, wait_for_task
 
 if t.TYPE_CHECKING:
     from dotmap import DotMap  # type: ignore
     from elasticsearch8 import Elasticsearch
     from elastic_transport import HeadApiResponse
 
-PAUSE_VALUE = float(getenv(PAUSE_ENVVAR, default=PAUSE_DEFAULT))
-TIMEOUT_VALUE = float(getenv(TIMEOUT_ENVVAR, default=TIMEOUT_DEFAULT))
-WAITKW = {'pause': PAUSE_VALUE, 'timeout': TIMEOUT_VALUE}
-
 logger = logging.getLogger(__name__)
 
 # pylint: disable=R0913,W0707
@@ -54,23 +48,6 @@ def assign_alias(client: 'Elasticsearch', index_name: str, alias_name: str) -> N
         raise BadClientResult(msg, err)
 
 
-def check_index(client: 'Elasticsearch', index_name: str, job_config: t.Dict) -> None:
-    """Check the index"""
-    logger.info('Making a quick check on redacted index docs...')
-    result = do_search(client, index_name, job_config['query'])
-    if result['hits']['total']['value'] == 0:
-        logger.warning(
-            'Query returned no results, assuming it only returns docs '
-            'to be redacted and not already redacted...'
-        )
-        return
-    success = check_fields(result, job_config)
-    if not success:
-        msg = 'One or more fields were not redacted. Check the logs'
-        logger.error(msg)
-        raise ValueMismatch(msg, 'count of fields matching query is not 0', '0')
-
-
 def clear_cache(client: 'Elasticsearch', index_name: str) -> None:
     """Clear the cache for named index
 
@@ -161,44 +138,14 @@ def delete_index(client: 'Elasticsearch', name: str) -> None:
         raise MissingIndex(f'Index "{name}" not found', err, name)
 
 
-def do_search(
-    client: 'Elasticsearch', index_pattern: str, query: t.Dict, size: int = 10
-) -> t.Dict:
-    """Return search result of ``query`` against ``index_pattern``
-
-    :param client: A client connection object
-    :param index_pattern: A single index name, a csv list of indices, or other pattern
-    :param query: An Elasticsearch DSL search query
-    :param size: Maximum number of results to return
-
-    :type client: :py:class:`~.elasticsearch.Elasticsearch`
-    :type index_pattern: str
-    :type query: dict
-    :type size: int
-    """
-    try:
-        response = dict(
-            client.search(
-                index=index_pattern,
-                query=query,
-                size=size,
-                expand_wildcards=['open', 'hidden'],
-            )
-        )
-        logger.debug(response)
-    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
-        msg = f'Attempt to collect search results yielded an exception: {err}'
-        logger.critical(msg)
-        raise BadClientResult(msg, err)
-    return response
-
-
 def forcemerge_index(
     client: 'Elasticsearch',
     index: t.Union[str, None] = None,
     max_num_segments: int = 1,
     only_expunge_deletes: bool = False,
-) -> None:
+    handle: t.Union[str, None] = None,
+    on_submit: t.Union[t.Callable[[str], None], None] = None,
+) -> t.Dict:
     """
     Force Merge an index
 
@@ -208,38 +155,47 @@ def forcemerge_index(
         force merge
     :param only_expunge_deletes: Only expunge deleted docs during force merging.
         If True, ignores max_num_segments.
+    :param handle: The task_id of a forcemerge submitted by a prior run, if any. If
+        that task can be found, wait for it rather than submitting a new one.
+    :param on_submit: Called with the task_id of a newly submitted forcemerge, so it
+        can be persisted before waiting
 
     :type client: :py:class:`~.elasticsearch.Elasticsearch`
     :type index: str
     :type max_num_segments: int
     :type only_expunge_deletes: bool
+    :type handle: str
+    :type on_submit: callable
+
+    :returns: The final status of the forcemerge task
+    :rtype: dict
     """
-    kwargs = {'index': index, 'wait_for_completion': False}
-    if only_expunge_deletes:
-        kwargs.update({'only_expunge_deletes': only_expunge_deletes})
+    if handle and reattachable_task(client, handle):
+        logger.info('Reattaching to forcemerge task %s from a prior run', handle)
+        task_id = handle
     else:
-        kwargs.update({'max_num_segments': max_num_segments})  # type: ignore
-    try:
-        response = dict(client.indices.forcemerge(**kwargs))  # type: ignore
-        logger.debug(response)
-    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
-        logger.error("Index: '%s' not found. Error: %s", index, err)
-        raise MissingIndex(f'Index "{index}" not found', err, index)  # type: ignore
+        kwargs = {'index': index, 'wait_for_completion': False}
+        if only_expunge_deletes:
+            kwargs.update({'only_expunge_deletes': only_expunge_deletes})
+        else:
+            kwargs.update({'max_num_segments': max_num_segments})  # type: ignore
+        try:
+            response = dict(client.indices.forcemerge(**kwargs))  # type: ignore
+            logger.debug(response)
+        except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+            logger.error("Index: '%s' not found. Error: %s", index, err)
+            raise MissingIndex(f'Index "{index}" not found', err, index)  # type: ignore
+        task_id = response['task']
+        if on_submit:
+            on_submit(task_id)
     logger.info('Waiting for forcemerge to complete...')
-    # task_check = Task(
-    #     client,
-    #     action='forcemerge',
-    #     task_id=response['task'],
-    #     pause=PAUSE_VALUE,
-    #     timeout=TIMEOUT_VALUE,
-    # )
     try:
-        # task_check.wait()
-        es_waiter(client, Task, action='forcemerge', task_id=response['task'], **WAITKW)
+        status = wait_for_task(client, task_id, 'forcemerge', timeout=TIMEOUT_VALUE)
     except BadClientResult as exc:
         logger.error('Exception: %s', exc)
         raise FatalError('Failed to forcemerge', exc)
     logger.info('Forcemerge completed.')
+    return status
 
 
 def generic_get(func: t.Callable, **kwargs) -> t.Dict:
@@ -254,23 +210,6 @@ def generic_get(func: t.Callable, **kwargs) -> t.Dict:
     return response
 
 
-def get_hits(client: 'Elasticsearch', index: str, query: t.Dict) -> int:
-    """Return the number of hits matching the query
-
-    :param client: A client connection object
-    :param index: The index or pattern to search
-    :param query: The query to execute
-
-    :type client: :py:class:`~.elasticsearch.Elasticsearch`
-    :type index: str
-    :type query: dict
-
-    :returns: The number of hits matching the query
-    """
-    result = do_search(client, index, query)
-    return result['hits']['total']['value']
-
-
 def get_ilm(client: 'Elasticsearch', index: str) -> t.Dict:
     """Get the ILM lifecycle settings for an index
 
@@ -332,6 +271,50 @@ def get_index(client: 'Elasticsearch', index: str) -> t.Dict:
     return response
 
 
+def get_merge_stats(client: 'Elasticsearch', index: str) -> t.Dict[str, int]:
+    """Get the stats needed to decide how to force merge an index
+
+    The index is refreshed first, so the deleted docs left by a just completed
+    update_by_query are counted.
+
+    :param client: A client connection object
+    :param index: The index name
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+
+    :returns: The count of live and deleted docs in the primary shards, the number
+        of primary shards, and the most segments in any primary shard, as ``docs``,
+        ``deleted``, ``shards``, and ``max_segments``
+    """
+    try:
+        client.indices.refresh(index=index)
+        response = dict(
+            client.indices.stats(
+                index=index, metric=['docs', 'segments'], level='shards'
+            )
+        )
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        logger.error("Index: '%s' not found. Error: %s", index, err)
+        raise MissingIndex(f'Index "{index}" not found', err, index)
+    primaries = response['indices'][index]['primaries']
+    stats = {
+        'docs': primaries['docs']['count'],
+        'deleted': primaries['docs']['deleted'],
+        'shards': 0,
+        'max_segments': 0,
+    }
+    for copies in response['indices'][index]['shards'].values():
+        for shard in copies:
+            if shard['routing']['primary']:
+                stats['shards'] += 1
+                stats['max_segments'] = max(
+                    stats['max_segments'], shard['segments']['count']
+                )
+    return stats
+
+
 def get_phase(client: 'Elasticsearch', index: str) -> t.Union[str, None]:
     """Get the index's ILM phase
 
@@ -491,58 +474,90 @@ def get_settings(client: 'Elasticsearch', index: str) -> t.Dict:
     return response
 
 
-def put_settings(client: 'Elasticsearch', index: str, settings: dict) -> None:
-    """Modify a data_stream using the contents of actions
+def get_task_status(client: 'Elasticsearch', task_id: str) -> t.Dict:
+    """Get the status of a server-side task
 
     :param client: A client connection object
-    :param settings: The index settings to apply
+    :param task_id: The task_id
 
     :type client: :py:class:`~.elasticsearch.Elasticsearch`
-    :type settings: dict
+    :type task_id: str
+
+    :returns: The :py:meth:`~.elasticsearch.Elasticsearch.TasksClient.get` response,
+        or an empty dictionary if the task cannot be found
     """
     try:
-        client.indices.put_settings(index=index, settings=settings)
+        response = dict(client.tasks.get(task_id=task_id))
+        logger.debug(response)
+    except NotFoundError:
+        logger.debug('Task %s not found', task_id)
+        return {}
+    except (ApiError, TransportError, BadRequestError) as err:
+        msg = f'Unable to get status of task {task_id}: {err}'
+        logger.error(msg)
+        raise BadClientResult(msg, err)
+    return response
+
+
+def put_mappings(client: 'Elasticsearch', index: str, mappings: t.Dict) -> None:
+    """Add any new fields in ``mappings`` to the mappings of ``index``
+
+    :param client: A client connection object
+    :param index: The index name
+    :param mappings: The index mappings
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type mappings: dict
+    """
+    try:
+        client.indices.put_mapping(
+            index=index,
+            properties=mappings.get('properties'),
+            dynamic_templates=mappings.get('dynamic_templates'),
+            meta=mappings.get('_meta'),
+        )
     except NotFoundError as exc:
         logger.error("Index '%s' not found: %s", index, exc)
         raise MissingIndex('Index not found', exc, index)
-    except BadRequestError as exc:
-        logger.error("Bad settings: %s. ERROR: %s", settings, exc)
-        raise BadClientResult(f'Invalid settings: {settings}', exc)
+    except (ApiError, TransportError, BadRequestError) as exc:
+        logger.error("Unable to update the mappings of %s: %s", index, exc)
+        raise BadClientResult(f'Unable to update the mappings of {index}', exc)
 
 
-def get_task_doc(
-    client: 'Elasticsearch', index_name: str, job_id: str, task_id: str
-) -> t.Dict:
-    """Get a task tracking doc
+def put_redact_script(client: 'Elasticsearch') -> None:
+    """Store the redaction script. It is safe to do this more than once.
 
     :param client: A client connection object
-    :param index_name: The index name
-    :param job_id: The job_id string for the present redaction run
-    :param task_id: The task_id string of the task we are searching for
 
     :type client: :py:class:`~.elasticsearch.Elasticsearch`
-    :type index_name: str
-    :type job_id: str
-    :type task_id: str
-
-    :returns: The task tracking document from the progress/status tracking index
     """
-    query = {
-        "bool": {
-            "must": {"parent_id": {"type": "task", "id": job_id}},
-            "filter": [{"term": {"task": task_id}}],
-        }
-    }
     try:
-        result = do_search(client, index_pattern=index_name, query=query)
-    except NotFoundError as err:
-        msg = f'Tracking index {index_name} is missing'
+        response = client.put_script(id=REDACT_SCRIPT_ID, script=redact_script())
+        logger.debug(response)
+    except (ApiError, TransportError, BadRequestError) as err:
+        msg = f'Unable to store the redaction script {REDACT_SCRIPT_ID}: {err}'
         logger.critical(msg)
-        raise MissingIndex(msg, err, index_name)
-    if result['hits']['total']['value'] != 1:
-        msg = 'Tracking document for job: {job_id}, task: {task_id} does not exist'
-        raise MissingDocument(msg, Exception(), msg)
-    return result['hits']['hits'][0]
+        raise BadClientResult(msg, err)
+
+
+def put_settings(client: 'Elasticsearch', index: str, settings: dict) -> None:
+    """Modify a data_stream using the contents of actions
+
+    :param client: A client connection object
+    :param settings: The index settings to apply
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type settings: dict
+    """
+    try:
+        client.indices.put_settings(index=index, settings=settings)
+    except NotFoundError as exc:
+        logger.error("Index '%s' not found: %s", index, exc)
+        raise MissingIndex('Index not found', exc, index)
+    except BadRequestError as exc:
+        logger.error("Bad settings: %s. ERROR: %s", settings, exc)
+        raise BadClientResult(f'Invalid settings: {settings}', exc)
 
 
 def get_tracking_doc(client: 'Elasticsearch', index_name: str, job_id: str) -> t.Dict:
@@ -572,6 +587,37 @@ def get_tracking_doc(client: 'Elasticsearch', index_name: str, job_id: str) -> t
     return doc['_source']
 
 
+def get_tracking_version(client: 'Elasticsearch', index_name: str) -> int:
+    """Get the schema version of the progress/status tracking index
+
+    Version 1 predates the ``schema_version`` in the mappings ``_meta``, and is
+    recognized by its ``join_field``.
+
+    :param client: A client connection object
+    :param index_name: The tracking index name, or an alias of it
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index_name: str
+
+    :returns: The schema version of the tracking index
+    """
+    try:
+        response = dict(client.indices.get_mapping(index=index_name))
+    except NotFoundError as err:
+        msg = f'Tracking index {index_name} is missing'
+        logger.critical(msg)
+        raise MissingIndex(msg, err, index_name)
+    except (ApiError, TransportError, BadRequestError) as err:
+        msg = f'Unable to get the mappings of {index_name}: {err}'
+        logger.error(msg)
+        raise BadClientResult(msg, err)
+    # An alias resolves to the concrete index name, so take the only value
+    mappings = list(response.values())[0]['mappings']
+    if 'schema_version' in mappings.get('_meta', {}):
+        return int(mappings['_meta']['schema_version'])
+    return 1 if 'join_field' in mappings.get('properties', {}) else 2
+
+
 def index_exists(client: 'Elasticsearch', index_name: str) -> 'HeadApiResponse':
     """Test whether index ``index_name`` exists
 
@@ -587,6 +633,29 @@ def index_exists(client: 'Elasticsearch', index_name: str) -> 'HeadApiResponse':
     return client.indices.exists(index=index_name, expand_wildcards=['open', 'hidden'])
 
 
+def reattachable_task(client: 'Elasticsearch', task_id: str) -> bool:
+    """Test whether a task submitted by a prior run can be waited on again
+
+    :param client: A client connection object
+    :param task_id: The task_id recorded by the prior run
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type task_id: str
+
+    :returns: ``True`` if the task is still running, or completed without errors
+    """
+    status = get_task_status(client, task_id)
+    if not status:
+        logger.info('Task %s from a prior run was not found', task_id)
+        return False
+    if status.get('completed'):
+        response = status.get('response', {})
+        if 'error' in status or response.get('failures'):
+            logger.warning('Task %s from a prior run had failures', task_id)
+            return False
+    return True
+
+
 def job_exists(
     client: 'Elasticsearch', index_name: str, job_id: str
 ) -> 'HeadApiResponse':
@@ -606,49 +675,30 @@ def job_exists(
     return client.exists(index=index_name, id=job_id)
 
 
-def mount_index(var: 'DotMap') -> None:
-    """Mount index as a searchable snapshot
+def replace_with_alias(client: 'Elasticsearch', index: str, target: str) -> None:
+    """Delete ``index`` and make its name an alias of ``target`` in one atomic call
 
-    :param var: A collection of variables from
-        :py:attr:`~.es_pii_tool.redacters.snapshot.RedactSnapshot.var`
+    If the call fails, ``index`` is left as it was.
 
-    :type var: DotMap
+    :param client: A client connection object
+    :param index: The index to replace
+    :param target: The index the alias points to
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type target: str
     """
-    response = {}
-    msg = (
-        f'Mounting {var.redaction_target} renamed as {var.mount_name} '
-        f'from repository: {var.repository}, snapshot: {var.new_snap_name} '
-        f'with storage={var.storage}'
-    )
-    logger.debug(msg)
+    actions = [
+        {'remove_index': {'index': index}},
+        {'add': {'index': target, 'alias': index}},
+    ]
     try:
-        response = dict(
-            var.client.searchable_snapshots.mount(
-                repository=var.repository,
-                snapshot=var.new_snap_name,
-                index=var.redaction_target,
-                renamed_index=var.mount_name,
-                storage=var.storage,
-            )
-        )
-    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
-        logger.error("Attempt to mount index '%s' failed: %s", var.mount_name, err)
+        response = client.indices.update_aliases(actions=actions)
         logger.debug(response)
-        raise BadClientResult('Error when mount index attempted', err)
-    logger.info('Ensuring searchable snapshot mount is in "green" health state...')
-    try:
-        es_waiter(
-            var.client,
-            Index,
-            action='mount',
-            index=var.mount_name,
-            pause=PAUSE_VALUE,
-            timeout=30.0,
-        )
-    except BadClientResult as exc:
-        logger.error('Exception: %s', exc)
-        raise FatalError('Failed to mount index from snapshot', exc)
-    logger.info("Index '%s' mounted from snapshot succesfully", var.mount_name)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Attempt to replace index "{index}" with an alias of "{target}" failed'
+        logger.critical(msg)
+        raise BadClientResult(msg, err)
 
 
 def resolve_index(client: 'Elasticsearch', index: str) -> t.Dict:
@@ -679,85 +729,13 @@ def resolve_index(client: 'Elasticsearch', index: str) -> t.Dict:
     return response
 
 
-def restore_index(
+def redact_from_index(
     client: 'Elasticsearch',
-    repo_name: str,
-    snap_name: str,
     index_name: str,
-    replacement: str,
-    re_pattern: str = '(.+)',
-    index_settings: t.Union[str, None] = None,
-) -> None:
-    """Restore an index
-
-    :param client: A client connection object
-    :param repo_name: The repository name
-    :param snap_name: The snapshot name
-    :param index_name: The index name as it appears in the snapshot metadata
-    :param replacement: The name or substitution string to use as the restored index
-        name
-    :param re_pattern: The optional rename pattern for use with ``replacement``
-    :param index_settings: Any settings to apply to the restored index, such as
-        _tier_preference
-
-    :type client: :py:class:`~.elasticsearch.Elasticsearch`
-    :type repo_name: str
-    :type snap_name: str
-    :type index_name: str
-    :type replacement: str
-    :type re_pattern: str
-    :type index_settings: dict
-    """
-    msg = (
-        f"repository={repo_name}, snapshot={snap_name}, indices={index_name},"
-        f"include_aliases=False,"
-        f"ignore_index_settings=["
-        f"    'index.lifecycle.name', 'index.lifecycle.rollover_alias',"
-        f"    'index.routing.allocation.include._tier_preference'],"
-        f"index_settings={index_settings},"
-        f"rename_pattern={re_pattern},"
-        f"rename_replacement={replacement},"
-        f"wait_for_completion=False"
-    )
-    logger.debug('RESTORE settings: %s', msg)
-    try:
-        response = client.snapshot.restore(
-            repository=repo_name,
-            snapshot=snap_name,
-            indices=index_name,
-            include_aliases=False,
-            ignore_index_settings=[
-                'index.lifecycle.name',
-                'index.lifecycle.rollover_alias',
-                'index.routing.allocation.include._tier_preference',
-            ],
-            index_settings=index_settings,  # type: ignore
-            rename_pattern=re_pattern,
-            rename_replacement=replacement,
-            wait_for_completion=False,
-        )
-        logger.debug('Response = %s', response)
-        logger.info('Checking if restoration completed...')
-        # restore_check = Restore(
-        #     client, pause=PAUSE_VALUE, timeout=TIMEOUT_VALUE, index_list=[replacement]
-        # )
-        try:
-            es_waiter(client, Restore, index_list=[replacement], **WAITKW)
-        except BadClientResult as exc:
-            logger.error('Exception: %s', exc)
-            raise FatalError('Failed to restore index from snapshot', exc)
-        msg = f'Restoration of index {index_name} as {replacement} complete'
-        logger.info(msg)
-    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
-        msg = (
-            f'Restoration of index {index_name} as {replacement} yielded an error: '
-            f'{err}'
-        )
-        logger.error(msg)
-        raise BadClientResult(msg, err)
-
-
-def redact_from_index(client: 'Elasticsearch', index_name: str, config: t.Dict) -> None:
+    config: t.Dict,
+    handle: t.Union[str, None] = None,
+    on_submit: t.Union[t.Callable[[str], None], None] = None,
+) -> t.Dict:
     """Redact data from an index using a painless script.
 
     Collect the task_id and wait for the reinding job to complete before returning
@@ -765,43 +743,80 @@ def redact_from_index(client: 'Elasticsearch', index_name: str, config: t.Dict)
     :param client: A client connection object
     :param index_name: The index to act on
     :param config: The config block being iterated. Contains ``query``, ``message``,
-        and ``fields``
+        and ``fields``, and optionally ``update_by_query`` settings for ``slices``,
+        ``scroll_size``, ``requests_per_second``, and ``conflicts``
+    :param handle: The task_id of an update_by_query submitted by a prior run, if
+        any. If that task can be found, wait for it rather than submitting a new one.
+    :param on_submit: Called with the task_id of a newly submitted update_by_query, so
+        it can be persisted before waiting
 
     :type client: :py:class:`~.elasticsearch.Elasticsearch`
     :type index_name: str
     :type config: dict
+    :type handle: str
+    :type on_submit: callable
+
+    :returns: The final status of the update_by_query task
+    :rtype: dict
     """
     logger.debug('Begin redaction...')
     logger.info('Before update by query, %s', report_segment_count(client, index_name))
-    logger.debug('Updating and redacting data...')
-    script = build_script(config['message'], config['fields'])
-    response = {}
-    try:
-        response = dict(
-            client.update_by_query(
-                index=index_name,
-                script=script,
-                query=config['query'],
-                wait_for_completion=False,
-                expand_wildcards=['open', 'hidden'],
+    ubqconfig = config.get('update_by_query', {})
+    adaptive = ubqconfig.get('adaptive')
+    if handle and reattachable_task(client, handle):
+        logger.info('Reattaching to update_by_query task %s from a prior run', handle)
+        task_id = handle
+    else:
+        logger.debug('Updating and redacting data...')
+        script = build_script(config['message'], config['fields'])
+        ubqkwargs = dict(ubqconfig)
+        ubqkwargs.pop('adaptive', None)
+        if adaptive and ubqkwargs.get('requests_per_second', -1) == -1:
+            # Start low, and let the adaptive throttle work its way up
+            ubqkwargs['requests_per_second'] = adaptive['min_requests_per_second']
+        logger.debug('update_by_query settings = %s', ubqkwargs)
+        response = {}
+        try:
+            response = dict(
+                client.update_by_query(
+                    index=index_name,
+                    script=script,
+                    query=config['query'],
+                    wait_for_completion=False,
+                    expand_wildcards=['open', 'hidden'],
+                    **ubqkwargs,
+                )
             )
-        )
-    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
-        logger.critical('update_by_query yielded an error: %s', err)
-        raise FatalError('update_by_query API call failed', err)
+        except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+            logger.critical('update_by_query yielded an error: %s', err)
+            raise FatalError('update_by_query API call failed', err)
+        logger.debug('response = %s', response)
+        task_id = response['task']
+        logger.info('Submitted update_by_query task %s', task_id)
+        if on_submit:
+            on_submit(task_id)
     logger.debug('Checking update by query status...')
-    logger.debug('response = %s', response)
-    # task_check = Task(client, action='update_by_query', task_id=response['task'])
     try:
-        # task_check.wait()
-        es_waiter(
-            client, Task, action='update_by_query', task_id=response['task'], **WAITKW
-        )
+        if adaptive:
+            # On reattach, the submitted throttle is unknown, so assume the lowest
+            initial = ubqconfig.get('requests_per_second', -1)
+            if initial == -1:
+                initial = adaptive['min_requests_per_second']
+            rethrottle = partial(rethrottle_update_by_query, client, task_id)
+            with AdaptiveThrottle(client, task_id, adaptive, initial, rethrottle):
+                status = wait_for_task(
+                    client, task_id, 'update_by_query', timeout=TIMEOUT_VALUE
+                )
+        else:
+            status = wait_for_task(
+                client, task_id, 'update_by_query', timeout=TIMEOUT_VALUE
+            )
     except BadClientResult as exc:
         logger.error('Exception: %s', exc)
         raise FatalError('Failed to complete update by query', exc)
     logger.info('After update by query, %s', report_segment_count(client, index_name))
     logger.debug('Update by query completed.')
+    return status
 
 
 def remove_ilm_policy(client: 'Elasticsearch', index: str) -> t.Dict:
@@ -824,94 +839,76 @@ def remove_ilm_policy(client: 'Elasticsearch', index: str) -> t.Dict:
     return response
 
 
-def take_snapshot(
-    client: 'Elasticsearch', repo_name: str, snap_name: str, index_name: str
+def rethrottle_update_by_query(
+    client: 'Elasticsearch', task_id: str, requests_per_second: float
 ) -> None:
-    """
-    Take snapshot of index
+    """Change the throttle of a running update_by_query task
 
     :param client: A client connection object
-    :param repo_name: The repository name
-    :param snap_name: The snapshot name
-    :param index_name: The name of the index to snapshot
+    :param task_id: The task_id
+    :param requests_per_second: The new throttle. ``-1`` means no throttling.
 
     :type client: :py:class:`~.elasticsearch.Elasticsearch`
-    :type repo_name: str
-    :type snap_name: str
-    :type index_name: str
+    :type task_id: str
+    :type requests_per_second: float
     """
-    logger.info('Creating new snapshot...')
-    response = {}
     try:
-        response = dict(
-            client.snapshot.create(
-                repository=repo_name,
-                snapshot=snap_name,
-                indices=index_name,
-                wait_for_completion=False,
-            )
+        response = client.update_by_query_rethrottle(
+            task_id=task_id, requests_per_second=requests_per_second
         )
-        logger.debug('Snapshot response: %s', response)
-    except (ApiError, NotFoundError, TransportError, BadRequestError, KeyError) as err:
-        msg = f'Creation of snapshot "{snap_name}" resulted in an error: {err}'
-        logger.critical(msg)
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Unable to rethrottle task {task_id}: {err}'
+        logger.error(msg)
         raise BadClientResult(msg, err)
-    logger.info('Checking on status of snapshot...')
-    # snapshot_check = Snapshot(
-    #     client, snapshot=snap_name, repository=repo_name, **WAITKW
-    # )
-
-    try:
-        # snapshot_check.wait()
-        es_waiter(client, Snapshot, snapshot=snap_name, repository=repo_name, **WAITKW)
-    except BadClientResult as exc:
-        logger.error('Exception: %s', exc)
-        raise FatalError('Failed to complete index snapshot', exc)
-    msg = (
-        f'{index_name}: Snapshot to repository {repo_name} in snapshot {snap_name} '
-        f'succeeded.'
+    logger.info(
+        'Task %s rethrottled to %s requests per second', task_id, requests_per_second
     )
-    logger.info(msg)
 
 
-def update_doc(
-    client: 'Elasticsearch', index: str, doc_id: str, doc: t.Dict, routing: int = 0
+def bulk_update_docs(
+    client: 'Elasticsearch',
+    index: str,
+    docs: t.Dict[str, t.Dict],
+    refresh: t.Union[bool, str] = False,
 ) -> None:
-    """Upsert a document in ``index`` at ``doc_id`` with the values of ``doc``
+    """Upsert several documents in ``index`` with a single bulk request
 
     :param client: A client connection object
     :param index: The index to write to
-    :param doc_id: The document doc_id to update
-    :param doc: The contents of the document
-    :param routing: Because our tracking doc is using parent/child relationships, we
-        need to route. We use an integer, but the API calls expect a string, so we
-        manually cast this value in the API call as one.
+    :param docs: The contents of each document, keyed by document id
+    :param refresh: ``True``, ``False``, or ``wait_for``
 
     :type client: :py:class:`~.elasticsearch.Elasticsearch`
     :type index: str
-    :type doc_id: str
-    :type doc: dict
-    :type routing: int
+    :type docs: dict
+    :type refresh: bool or str
     """
+    operations: t.List[t.Dict] = []
+    for doc_id, doc in docs.items():
+        operations.append({'update': {'_index': index, '_id': doc_id}})
+        operations.append({'doc': doc, 'doc_as_upsert': True})
     try:
-        if doc_id:
-            _ = client.update(
-                index=index,
-                id=doc_id,
-                doc=doc,
-                doc_as_upsert=True,
-                routing=str(routing),
-                refresh=True,
-            )
-        else:
-            logger.debug('No value for document id. Creating new document.')
-            _ = client.index(
-                index=index, document=doc, routing=str(routing), refresh=True
+        response = dict(
+            client.bulk(
+                operations=operations,
+                refresh=refresh,  # type: ignore
+                filter_path='errors,items.*.error',
             )
+        )
     except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
-        msg = f'Error updating document: {err.args[0]}'
+        msg = f'Error updating documents: {err.args[0]}'
         logger.error(msg)
         raise BadClientResult(msg, err)
+    if response.get('errors'):
+        errors = [
+            item
+            for item in response.get('items', [])
+            if 'error' in item.get('update', {})
+        ]
+        msg = f'Error updating {len(errors)} document(s): {errors}'
+        logger.error(msg)
+        raise BadClientResult(msg, Exception(errors))
 
 
 def verify_index(client: 'Elasticsearch', index: str) -> bool:
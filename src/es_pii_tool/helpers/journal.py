@@ -0,0 +1,193 @@
+"""A local write-ahead journal of tracking doc updates"""
+
+import typing as t
+import json
+import logging
+import os
+import threading
+from es_pii_tool.exceptions import ConfigError, FatalError
+from es_pii_tool.helpers.elastic_api import bulk_update_docs
+
+if t.TYPE_CHECKING:
+    from elasticsearch8 import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Record every tracking doc update in a local, append-only NDJSON file as soon as
+    it is made, before it is written to the tracking index
+
+    Each update is a line with a sequence number, the tracking index name, the doc
+    id, and the (partial) doc, and is fsync'd before :py:meth:`append` returns. The
+    :py:class:`~.es_pii_tool.helpers.tracking.TrackingWriter` of each job calls
+    :py:meth:`synced` once a bulk request has written its updates. A checkpoint line
+    then records that every update before the oldest unsynced one is in
+    Elasticsearch, along with any later updates which are too.
+
+    If a run ends before its updates reach Elasticsearch, e.g. because the cluster
+    became unreachable or the process was killed, :py:meth:`replay` writes them at
+    the start of the next run. Updates already in Elasticsearch are never replayed,
+    so an old update cannot overwrite a newer one.
+
+    :param path: The path to the journal file. It is created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        #: The sequence number of the last update
+        self.seq = 0
+        #: Every update at or before this sequence number is in Elasticsearch
+        self.checkpoint = 0
+        #: The sequence numbers of updates not yet in Elasticsearch
+        self.unsynced: t.Set[int] = set()
+        #: The updates after the checkpoint when the journal was opened
+        self.entries: t.List[t.Dict] = []
+        torn = self.load()
+        try:
+            # pylint: disable=R1732
+            self.file = open(path, 'a', encoding='utf-8')
+            if torn:
+                # Start on a new line, rather than appending to the partial one
+                self.file.write('\n')
+        except OSError as exc:
+            msg = f'Unable to open journal: {path}'
+            logger.critical(msg)
+            raise ConfigError(msg, exc) from exc
+
+    def load(self) -> bool:
+        """
+        Read any updates left after the last checkpoint of a prior run
+
+        :returns: Whether the last line was cut short, e.g. by a crash
+        """
+        torn = False
+        if not os.path.exists(self.path):
+            return torn
+        entries = []
+        # Updates after a checkpoint which were in Elasticsearch already
+        flushed: t.Set[int] = set()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for num, line in enumerate(file, start=1):
+                    torn = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Most likely the last line, cut short by a crash
+                        logger.warning('Skipping line %s of journal %s', num, self.path)
+                        continue
+                    if 'synced' in entry:
+                        self.checkpoint = max(self.checkpoint, entry['synced'])
+                        flushed.update(entry.get('flushed', []))
+                    else:
+                        entries.append(entry)
+                        self.seq = max(self.seq, entry['seq'])
+        except OSError as exc:
+            msg = f'Unable to read journal: {self.path}'
+            logger.critical(msg)
+            raise ConfigError(msg, exc) from exc
+        self.entries = [
+            entry
+            for entry in entries
+            if entry['seq'] > self.checkpoint and entry['seq'] not in flushed
+        ]
+        self.unsynced = {entry['seq'] for entry in self.entries}
+        return torn
+
+    def write(self, entry: t.Dict) -> None:
+        """Append ``entry`` and fsync it. Call with the lock held."""
+        try:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as exc:
+            msg = f'Unable to write to journal: {self.path}'
+            logger.critical(msg)
+            raise FatalError(msg, exc) from exc
+
+    def append(self, index: str, doc_id: str, doc: t.Dict) -> int:
+        """
+        Record an update of ``doc_id`` in ``index``
+
+        :param index: The tracking index name
+        :param doc_id: The tracking doc id
+        :param doc: The (partial) contents of the tracking doc
+
+        :returns: The sequence number of the update
+        """
+        with self.lock:
+            self.seq += 1
+            self.write({'seq': self.seq, 'index': index, 'id': doc_id, 'doc': doc})
+            self.unsynced.add(self.seq)
+            return self.seq
+
+    def synced(self, seqs: t.Iterable[int]) -> None:
+        """
+        Record that the updates ``seqs`` are in Elasticsearch
+
+        :param seqs: The sequence numbers of the updates
+        """
+        with self.lock:
+            seqs = set(seqs) & self.unsynced
+            self.unsynced.difference_update(seqs)
+            checkpoint = min(self.unsynced) - 1 if self.unsynced else self.seq
+            advanced = checkpoint > self.checkpoint
+            self.checkpoint = max(self.checkpoint, checkpoint)
+            # Synced updates which the checkpoint does not cover yet
+            flushed = sorted(seq for seq in seqs if seq > self.checkpoint)
+            if advanced or flushed:
+                entry: t.Dict[str, t.Any] = {'synced': self.checkpoint}
+                if flushed:
+                    entry['flushed'] = flushed
+                self.write(entry)
+
+    def replay(self, client: 'Elasticsearch') -> int:
+        """
+        Write the updates left after the last checkpoint of a prior run to
+        Elasticsearch, in the order they were made
+
+        Updates of the same doc are merged first, so each doc is written once.
+
+        :param client: A client connection object
+
+        :returns: The number of docs written
+        """
+        if not self.entries:
+            return 0
+        docs: t.Dict[str, t.Dict[str, t.Dict]] = {}
+        for entry in self.entries:
+            pending = docs.setdefault(entry['index'], {})
+            pending[entry['id']] = {**pending.get(entry['id'], {}), **entry['doc']}
+        count = 0
+        for index, batch in docs.items():
+            bulk_update_docs(client, index, batch)
+            count += len(batch)
+        logger.info(
+            'Replayed %s tracking doc update(s) from journal %s',
+            len(self.entries),
+            self.path,
+        )
+        self.synced(entry['seq'] for entry in self.entries)
+        self.entries = []
+        return count
+
+    def close(self) -> None:
+        """Close the journal, emptying it if every update is in Elasticsearch"""
+        with self.lock:
+            self.file.close()
+            if self.unsynced:
+                logger.warning(
+                    '%s tracking doc update(s) will be replayed from journal %s by '
+                    'the next run',
+                    len(self.unsynced),
+                    self.path,
+                )
+                return
+            try:
+                with open(self.path, 'w', encoding='utf-8'):
+                    pass  # Every update was synced. Start the next run empty.
+            except OSError as exc:
+                logger.warning('Unable to empty journal %s: %s', self.path, exc)
@@ -0,0 +1,433 @@
+"""Functions making Elasticsearch search, count, and scan API calls"""
+
+import typing as t
+import logging
+from elasticsearch8.exceptions import (
+    ApiError,
+    NotFoundError,
+    TransportError,
+    BadRequestError,
+)
+from es_pii_tool.defaults import (
+    MAX_TERMS_COUNT,
+    SCAN_KEEP_ALIVE,
+    SCAN_PAGE_SIZE,
+    unredacted_script,
+)
+from es_pii_tool.exceptions import BadClientResult, MissingIndex, ValueMismatch
+
+if t.TYPE_CHECKING:
+    from elasticsearch8 import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=R0913,W0707
+
+
+def check_index(client: 'Elasticsearch', index_name: str, job_config: t.Dict) -> None:
+    """Check that no doc matching the query still has an unredacted field
+
+    Every matching doc is covered with a single ``size=0`` search. A field is
+    unredacted if it exists in ``_source``, but is not exactly ``message``. This is
+    checked with a runtime field per field, so it works the same for ``keyword`` and
+    ``text`` fields, and a value which merely contains ``message`` is not counted as
+    redacted.
+
+    :param client: A client connection object
+    :param index_name: The index to check
+    :param job_config: The configuration settings for this job
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index_name: str
+    :type job_config: dict
+    """
+    logger.info('Counting redacted index docs with unredacted fields...')
+    runtime: t.Dict[str, t.Dict] = {}
+    leftovers: t.Dict[str, t.Dict] = {}
+    for num, field in enumerate(job_config['fields']):
+        name = f'pii_tool_unredacted_{num}'
+        runtime[name] = {
+            'type': 'boolean',
+            'script': {
+                'source': unredacted_script(),
+                'params': {'field': field, 'message': job_config['message']},
+            },
+        }
+        leftovers[field] = {'term': {name: True}}
+    aggs: t.Dict[str, t.Dict] = {
+        'each': {'filters': {'filters': leftovers}},
+        'any': {
+            'filter': {
+                'bool': {'should': list(leftovers.values()), 'minimum_should_match': 1}
+            }
+        },
+    }
+    try:
+        result = dict(
+            client.search(
+                index=index_name,
+                query=job_config['query'],
+                size=0,
+                aggs=aggs,
+                runtime_mappings=runtime,
+                track_total_hits=True,
+                expand_wildcards=['open', 'hidden'],
+                filter_path='hits.total,aggregations',
+            )
+        )
+        logger.debug(result)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Attempt to count unredacted docs yielded an exception: {err}'
+        logger.critical(msg)
+        raise BadClientResult(msg, err)
+    if result['hits']['total']['value'] == 0:
+        logger.warning(
+            'Query returned no results, assuming it only returns docs '
+            'to be redacted and not already redacted...'
+        )
+        return
+    buckets = result['aggregations']['each']['buckets']
+    for field in job_config['fields']:
+        count = buckets[field]['doc_count']
+        if count:
+            logger.error('Field %s is not redacted in %s doc(s)', field, count)
+        else:
+            logger.info('Field %s is redacted correctly', field)
+    unredacted = result['aggregations']['any']['doc_count']
+    if unredacted:
+        msg = (
+            f'{unredacted} doc(s) have one or more fields not redacted. Check the logs'
+        )
+        logger.error(msg)
+        raise ValueMismatch(msg, f'count of unredacted docs is {unredacted}', '0')
+
+
+def close_point_in_time(client: 'Elasticsearch', pit_id: str) -> None:
+    """Close a point in time. Failure is logged, but not raised, as the point in time
+    will expire on its own.
+
+    :param client: A client connection object
+    :param pit_id: The point in time id
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type pit_id: str
+    """
+    try:
+        response = client.close_point_in_time(id=pit_id)
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        logger.warning('Unable to close point in time: %s', err)
+
+
+def count_docs(client: 'Elasticsearch', index: str) -> int:
+    """Count every document in ``index``
+
+    :param client: A client connection object
+    :param index: The index name
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+
+    :returns: The document count, after refreshing ``index``
+    """
+    try:
+        client.indices.refresh(index=index)
+        return int(client.count(index=index)['count'])
+    except NotFoundError as err:
+        raise MissingIndex(f'Index "{index}" not found', err, index)
+    except (ApiError, TransportError, BadRequestError) as err:
+        msg = f'Unable to count the documents in {index}: {err}'
+        logger.error(msg)
+        raise BadClientResult(msg, err)
+
+
+def get_field_counts(
+    client: 'Elasticsearch', index: str, query: t.Dict, fields: t.Sequence[str]
+) -> t.Dict[str, int]:
+    """Count the docs matching the query which have each of ``fields``, and which
+    have all of them, in a single ``size=0`` search
+
+    Only counts are returned, so the cost does not depend on the number of hits.
+
+    :param client: A client connection object
+    :param index: The index or pattern to search
+    :param query: The query to execute
+    :param fields: The field names
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type query: dict
+    :type fields: list
+
+    :returns: A dictionary of each field name and its count of matching docs, plus
+        the count of matching docs with every field as ``_all``
+    """
+    exists = {field: {'exists': {'field': field}} for field in fields}
+    aggs: t.Dict[str, t.Dict] = {
+        'each': {'filters': {'filters': exists}},
+        'every': {'filter': {'bool': {'filter': list(exists.values())}}},
+    }
+    try:
+        response = dict(
+            client.search(
+                index=index,
+                query=query,
+                size=0,
+                aggs=aggs,
+                expand_wildcards=['open', 'hidden'],
+                filter_path='aggregations',
+            )
+        )
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Attempt to count field matches yielded an exception: {err}'
+        logger.critical(msg)
+        raise BadClientResult(msg, err)
+    aggregations = response['aggregations']
+    buckets = aggregations['each']['buckets']
+    counts = {field: buckets[field]['doc_count'] for field in fields}
+    counts['_all'] = aggregations['every']['doc_count']
+    return counts
+
+
+def get_hits(
+    client: 'Elasticsearch',
+    index: str,
+    query: t.Dict,
+    pre_filter_shard_size: t.Union[int, None] = None,
+) -> int:
+    """Return the exact number of hits matching the query
+
+    By default, the :py:meth:`~.elasticsearch.Elasticsearch.count` API is used, which
+    returns no documents and is not limited to 10,000 hits. If
+    ``pre_filter_shard_size`` is set, a ``size=0`` search with ``track_total_hits``
+    is used instead, so that shards which cannot match the query (e.g. frozen
+    indices outside of a time range) are skipped by the pre-filter round.
+
+    :param client: A client connection object
+    :param index: The index or pattern to search
+    :param query: The query to execute
+    :param pre_filter_shard_size: Pre-filter when a search expands to more than
+        this many shards
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type query: dict
+    :type pre_filter_shard_size: int
+
+    :returns: The number of hits matching the query
+    """
+    try:
+        if pre_filter_shard_size is None:
+            response = dict(
+                client.count(
+                    index=index, query=query, expand_wildcards=['open', 'hidden']
+                )
+            )
+            logger.debug(response)
+            return response['count']
+        response = dict(
+            client.search(
+                index=index,
+                query=query,
+                size=0,
+                track_total_hits=True,
+                pre_filter_shard_size=pre_filter_shard_size,
+                expand_wildcards=['open', 'hidden'],
+                filter_path='hits.total',
+            )
+        )
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Attempt to count hits yielded an exception: {err}'
+        logger.critical(msg)
+        raise BadClientResult(msg, err)
+    return response['hits']['total']['value']
+
+
+def get_hits_per_index(
+    client: 'Elasticsearch', index: str, query: t.Dict, indices: t.Sequence[str]
+) -> t.Dict[str, int]:
+    """Return the number of hits matching the query in each index, using a single
+    ``size=0`` search with a ``terms`` aggregation on ``_index``
+
+    :param client: A client connection object
+    :param index: The index or pattern to search
+    :param query: The query to execute
+    :param indices: The indices which ``index`` expands to
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type query: dict
+    :type indices: list
+
+    :returns: A dictionary of index names and their hit counts. Indices without any
+        hits are not included.
+    """
+    aggs = {'per_index': {'terms': {'field': '_index', 'size': max(1, len(indices))}}}
+    try:
+        response = dict(
+            client.search(
+                index=index,
+                query=query,
+                size=0,
+                aggs=aggs,
+                expand_wildcards=['open', 'hidden'],
+                filter_path='aggregations',
+            )
+        )
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Attempt to count hits per index yielded an exception: {err}'
+        logger.critical(msg)
+        raise BadClientResult(msg, err)
+    buckets = response.get('aggregations', {}).get('per_index', {}).get('buckets', [])
+    return {bucket['key']: bucket['doc_count'] for bucket in buckets}
+
+
+def get_max_terms_count(client: 'Elasticsearch', index: str) -> int:
+    """Get the lowest ``index.max_terms_count`` of the indices matching ``index``
+
+    :param client: A client connection object
+    :param index: The index, csv indices, or index pattern
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+
+    :returns: The most values a ``terms`` query may have for every one of the indices
+    """
+    name = 'index.max_terms_count'
+    try:
+        response = dict(
+            client.indices.get_settings(
+                index=index,
+                name=name,
+                include_defaults=True,
+                flat_settings=True,
+                expand_wildcards=['open', 'hidden'],
+            )
+        )
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        logger.error("Index: '%s' not found. Error: %s", index, err)
+        raise MissingIndex(f'Index "{index}" not found', err, index)
+    values = []
+    for settings in response.values():
+        value = settings.get('settings', {}).get(name)
+        if value is None:
+            value = settings.get('defaults', {}).get(name, MAX_TERMS_COUNT)
+        values.append(int(value))
+    return min(values, default=MAX_TERMS_COUNT)
+
+
+def open_point_in_time(
+    client: 'Elasticsearch', index: str, keep_alive: str = SCAN_KEEP_ALIVE
+) -> str:
+    """Open a point in time on ``index``
+
+    :param client: A client connection object
+    :param index: The index or pattern
+    :param keep_alive: How long to keep the point in time between requests
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type keep_alive: str
+
+    :returns: The point in time id
+    """
+    try:
+        response = dict(
+            client.open_point_in_time(
+                index=index,
+                keep_alive=keep_alive,
+                expand_wildcards=['open', 'hidden'],
+            )
+        )
+        logger.debug(response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = f'Unable to open a point in time on {index}: {err}'
+        logger.critical(msg)
+        raise BadClientResult(msg, err)
+    return response['id']
+
+
+def scan_pages(
+    client: 'Elasticsearch',
+    pit_id: str,
+    query: t.Dict,
+    fields: t.Union[t.Sequence[str], None] = None,
+    page_size: int = SCAN_PAGE_SIZE,
+    keep_alive: str = SCAN_KEEP_ALIVE,
+) -> t.Iterator[t.Tuple[str, t.List[t.Dict]]]:
+    """Page through the hits of ``query`` in a point in time, using ``search_after``
+
+    The point in time id can change between requests, so each page comes with the
+    id returned along with it. Only the latest id needs to be closed.
+
+    :param client: A client connection object
+    :param pit_id: The point in time id
+    :param query: An Elasticsearch DSL search query
+    :param fields: Only these fields will be returned in each hit's ``_source``
+    :param page_size: The number of hits per request
+    :param keep_alive: How long to keep the point in time between requests
+
+    :returns: An iterator of ``(pit_id, hits)`` pages
+    """
+    kwargs: t.Dict[str, t.Any] = {
+        'query': query,
+        'size': page_size,
+        'sort': ['_shard_doc'],
+        'track_total_hits': False,
+    }
+    if fields is not None:
+        kwargs['source_includes'] = list(fields)
+    while True:
+        kwargs['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+        try:
+            response = dict(client.search(**kwargs))
+        except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+            msg = f'Attempt to scan search results yielded an exception: {err}'
+            logger.critical(msg)
+            raise BadClientResult(msg, err)
+        hits = response['hits']['hits']
+        if not hits:
+            return
+        pit_id = response.get('pit_id', pit_id)
+        yield pit_id, hits
+        kwargs['search_after'] = hits[-1]['sort']
+
+
+def scan_hits(
+    client: 'Elasticsearch',
+    index: str,
+    query: t.Dict,
+    fields: t.Union[t.Sequence[str], None] = None,
+    page_size: int = SCAN_PAGE_SIZE,
+) -> t.Generator[t.Dict, None, None]:
+    """Lazily yield every hit of ``query`` against ``index``
+
+    A point in time with ``search_after`` is used, so there is no 10,000 hit limit,
+    and only one page of hits is held in memory.
+
+    The point in time is closed when the iterator is exhausted or closed.
+
+    :param client: A client connection object
+    :param index: The index or pattern
+    :param query: An Elasticsearch DSL search query
+    :param fields: Only these fields will be returned in each hit's ``_source``
+    :param page_size: The number of hits per request
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type index: str
+    :type query: dict
+    :type fields: list
+    :type page_size: int
+
+    :returns: An iterator of hits
+    """
+    pit_id = open_point_in_time(client, index)
+    try:
+        for pit_id, hits in scan_pages(client, pit_id, query, fields, page_size):
+            yield from hits
+    finally:
+        close_point_in_time(client, pit_id)
@@ -0,0 +1,316 @@
+"""Functions making Elasticsearch snapshot, restore, and mount API calls"""
+
+import typing as t
+import logging
+from elasticsearch8.exceptions import (
+    ApiError,
+    NotFoundError,
+    TransportError,
+    BadRequestError,
+)
+from es_wait import Index
+from es_pii_tool.exceptions import BadClientResult, FatalError
+from es_pii_tool.helpers.elastic_api import index_exists
+from es_pii_tool.helpers.utils import es_waiter
+from es_pii_tool.helpers.waiter import (
+    PAUSE_VALUE,
+    TIMEOUT_VALUE,
+    wait_for_restore,
+    wait_for_snapshot,
+)
+
+if t.TYPE_CHECKING:
+    from dotmap import DotMap  # type: ignore
+    from elasticsearch8 import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=R0913,W0707
+
+
+def get_snapshot_state(
+    client: 'Elasticsearch', repo_name: str, snap_name: str
+) -> t.Union[str, None]:
+    """Get the state of a snapshot
+
+    :param client: A client connection object
+    :param repo_name: The repository name
+    :param snap_name: The snapshot name
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type repo_name: str
+    :type snap_name: str
+
+    :returns: The snapshot state, e.g. ``IN_PROGRESS`` or ``SUCCESS``, or ``None`` if
+        the snapshot does not exist
+    """
+    try:
+        response = dict(client.snapshot.get(repository=repo_name, snapshot=snap_name))
+        logger.debug(response)
+    except NotFoundError:
+        logger.debug('Snapshot %s not found in repository %s', snap_name, repo_name)
+        return None
+    except (ApiError, TransportError, BadRequestError) as err:
+        msg = f'Unable to get state of snapshot {snap_name}: {err}'
+        logger.error(msg)
+        raise BadClientResult(msg, err)
+    try:
+        return response['snapshots'][0]['state']
+    except (IndexError, KeyError):
+        return None
+
+
+def mount_index(var: 'DotMap') -> None:
+    """Mount index as a searchable snapshot
+
+    :param var: A collection of variables from
+        :py:attr:`~.es_pii_tool.redacters.snapshot.RedactSnapshot.var`
+
+    :type var: DotMap
+    """
+    response = {}
+    msg = (
+        f'Mounting {var.redaction_target} renamed as {var.mount_name} '
+        f'from repository: {var.repository}, snapshot: {var.new_snap_name} '
+        f'with storage={var.storage}'
+    )
+    logger.debug(msg)
+    try:
+        response = dict(
+            var.client.searchable_snapshots.mount(
+                repository=var.repository,
+                snapshot=var.new_snap_name,
+                index=var.redaction_target,
+                renamed_index=var.mount_name,
+                storage=var.storage,
+            )
+        )
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        logger.error("Attempt to mount index '%s' failed: %s", var.mount_name, err)
+        logger.debug(response)
+        raise BadClientResult('Error when mount index attempted', err)
+    logger.info('Ensuring searchable snapshot mount is in "green" health state...')
+    try:
+        es_waiter(
+            var.client,
+            Index,
+            kind='mount',
+            action='mount',
+            index=var.mount_name,
+            pause=PAUSE_VALUE,
+            timeout=30.0,
+        )
+    except BadClientResult as exc:
+        logger.error('Exception: %s', exc)
+        raise FatalError('Failed to mount index from snapshot', exc)
+    logger.info("Index '%s' mounted from snapshot succesfully", var.mount_name)
+
+
+def restore_index(
+    client: 'Elasticsearch',
+    repo_name: str,
+    snap_name: str,
+    index_name: str,
+    replacement: str,
+    re_pattern: str = '(.+)',
+    index_settings: t.Union[str, None] = None,
+    handle: t.Union[str, None] = None,
+    on_submit: t.Union[t.Callable[[str], None], None] = None,
+) -> None:
+    """Restore an index
+
+    :param client: A client connection object
+    :param repo_name: The repository name
+    :param snap_name: The snapshot name
+    :param index_name: The index name as it appears in the snapshot metadata
+    :param replacement: The name or substitution string to use as the restored index
+        name
+    :param re_pattern: The optional rename pattern for use with ``replacement``
+    :param index_settings: Any settings to apply to the restored index, such as
+        _tier_preference
+    :param handle: The restored index name recorded by a prior run, if any. If it
+        matches ``replacement`` and the index exists, wait for its recovery rather than
+        restoring again.
+    :param on_submit: Called with ``replacement`` once the restore is submitted, so it
+        can be persisted before waiting
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type repo_name: str
+    :type snap_name: str
+    :type index_name: str
+    :type replacement: str
+    :type re_pattern: str
+    :type index_settings: dict
+    :type handle: str
+    :type on_submit: callable
+    """
+    if handle == replacement and index_exists(client, replacement):
+        logger.info('Reattaching to restore of %s from a prior run', replacement)
+    else:
+        submit_restore(
+            client,
+            repo_name,
+            snap_name,
+            index_name,
+            replacement,
+            re_pattern=re_pattern,
+            index_settings=index_settings,
+        )
+        if on_submit:
+            on_submit(replacement)
+    logger.info('Checking if restoration completed...')
+    try:
+        wait_for_restore(client, [replacement], timeout=TIMEOUT_VALUE)
+    except BadClientResult as exc:
+        logger.error('Exception: %s', exc)
+        raise FatalError('Failed to restore index from snapshot', exc)
+    msg = f'Restoration of index {index_name} as {replacement} complete'
+    logger.info(msg)
+
+
+def submit_restore(
+    client: 'Elasticsearch',
+    repo_name: str,
+    snap_name: str,
+    index_name: str,
+    replacement: str,
+    re_pattern: str = '(.+)',
+    index_settings: t.Union[str, None] = None,
+) -> None:
+    """Submit the restore of an index without waiting for it to complete
+
+    :param client: A client connection object
+    :param repo_name: The repository name
+    :param snap_name: The snapshot name
+    :param index_name: The index name as it appears in the snapshot metadata
+    :param replacement: The name or substitution string to use as the restored index
+        name
+    :param re_pattern: The optional rename pattern for use with ``replacement``
+    :param index_settings: Any settings to apply to the restored index, such as
+        _tier_preference
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type repo_name: str
+    :type snap_name: str
+    :type index_name: str
+    :type replacement: str
+    :type re_pattern: str
+    :type index_settings: dict
+    """
+    msg = (
+        f"repository={repo_name}, snapshot={snap_name}, indices={index_name},"
+        f"include_aliases=False,"
+        f"ignore_index_settings=["
+        f"    'index.lifecycle.name', 'index.lifecycle.rollover_alias',"
+        f"    'index.routing.allocation.include._tier_preference'],"
+        f"index_settings={index_settings},"
+        f"rename_pattern={re_pattern},"
+        f"rename_replacement={replacement},"
+        f"wait_for_completion=False"
+    )
+    logger.debug('RESTORE settings: %s', msg)
+    try:
+        response = client.snapshot.restore(
+            repository=repo_name,
+            snapshot=snap_name,
+            indices=index_name,
+            include_aliases=False,
+            ignore_index_settings=[
+                'index.lifecycle.name',
+                'index.lifecycle.rollover_alias',
+                'index.routing.allocation.include._tier_preference',
+            ],
+            index_settings=index_settings,  # type: ignore
+            rename_pattern=re_pattern,
+            rename_replacement=replacement,
+            wait_for_completion=False,
+        )
+        logger.debug('Response = %s', response)
+    except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+        msg = (
+            f'Restoration of index {index_name} as {replacement} yielded an error: '
+            f'{err}'
+        )
+        logger.error(msg)
+        raise BadClientResult(msg, err)
+
+
+def take_snapshot(
+    client: 'Elasticsearch',
+    repo_name: str,
+    snap_name: str,
+    index_name: str,
+    handle: t.Union[str, None] = None,
+    on_submit: t.Union[t.Callable[[str], None], None] = None,
+) -> None:
+    """
+    Take snapshot of index
+
+    :param client: A client connection object
+    :param repo_name: The repository name
+    :param snap_name: The snapshot name
+    :param index_name: The name of the index to snapshot
+    :param handle: The snapshot name recorded by a prior run, if any. If it matches
+        ``snap_name`` and that snapshot is in progress or succeeded, wait for it
+        rather than taking a new one.
+    :param on_submit: Called with ``snap_name`` once the snapshot is submitted, so it
+        can be persisted before waiting
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type repo_name: str
+    :type snap_name: str
+    :type index_name: str
+    :type handle: str
+    :type on_submit: callable
+    """
+    state = None
+    if handle == snap_name:
+        state = get_snapshot_state(client, repo_name, snap_name)
+    if state in ('IN_PROGRESS', 'SUCCESS'):
+        logger.info('Reattaching to snapshot %s from a prior run', snap_name)
+    else:
+        if state is not None:
+            logger.warning(
+                'Deleting snapshot %s with state %s from a prior run', snap_name, state
+            )
+            try:
+                client.snapshot.delete(repository=repo_name, snapshot=snap_name)
+            except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+                msg = f'Unable to delete snapshot "{snap_name}": {err}'
+                logger.critical(msg)
+                raise BadClientResult(msg, err)
+        logger.info('Creating new snapshot...')
+        response = {}
+        try:
+            response = dict(
+                client.snapshot.create(
+                    repository=repo_name,
+                    snapshot=snap_name,
+                    indices=index_name,
+                    wait_for_completion=False,
+                )
+            )
+            logger.debug('Snapshot response: %s', response)
+        except (
+            ApiError,
+            NotFoundError,
+            TransportError,
+            BadRequestError,
+            KeyError,
+        ) as err:
+            msg = f'Creation of snapshot "{snap_name}" resulted in an error: {err}'
+            logger.critical(msg)
+            raise BadClientResult(msg, err)
+        if on_submit:
+            on_submit(snap_name)
+    logger.info('Checking on status of snapshot...')
+    try:
+        wait_for_snapshot(client, repo_name, snap_name, timeout=TIMEOUT_VALUE)
+    except BadClientResult as exc:
+        logger.error('Exception: %s', exc)
+        raise FatalError('Failed to complete index snapshot', exc)
+    msg = (
+        f'{index_name}: Snapshot to repository {repo_name} in snapshot {snap_name} '
+        f'succeeded.'
+    )
+    logger.info(msg)
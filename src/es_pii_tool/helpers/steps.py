@@ -1,15 +1,14 @@
 """Each function is a single step in PII redaction"""
 
-from os import getenv
+from functools import partial
 import typing as t
 import logging
 from dotmap import DotMap  # type: ignore
 from es_wait import IlmPhase, IlmStep
+from voluptuous import Schema
 from es_pii_tool.defaults import (
-    PAUSE_DEFAULT,
-    PAUSE_ENVVAR,
-    TIMEOUT_DEFAULT,
-    TIMEOUT_ENVVAR,
+    EXPUNGE_ALL_DELETES,
+    forcemerge_schema,
 )
 from es_pii_tool.exceptions import (
     BadClientResult,
@@ -20,19 +19,20 @@ from es_pii_tool.exceptions import (
     ValueMismatch,
 )
 from es_pii_tool.helpers import elastic_api as api
+from es_pii_tool.helpers import search_api, snapshot_api
 from es_pii_tool.helpers.utils import (
+    choose_forcemerge,
     configure_ilm_policy,
     get_alias_actions,
     strip_ilm_name,
     es_waiter,
 )
+from es_pii_tool.helpers.waiter import PAUSE_VALUE, TIMEOUT_VALUE, summarize_task
 
 if t.TYPE_CHECKING:
+    from es_pii_tool.helpers.batch import RestoreBatcher, SnapshotBatcher
     from es_pii_tool.task import Task
 
-PAUSE_VALUE = float(getenv(PAUSE_ENVVAR, default=PAUSE_DEFAULT))
-TIMEOUT_VALUE = float(getenv(TIMEOUT_ENVVAR, default=TIMEOUT_DEFAULT))
-
 logger = logging.getLogger(__name__)
 
 
@@ -92,32 +92,68 @@ def missing_data(stepname, kwargs) -> None:
         raise MissingArgument(msg, what, names)
 
 
+def reattach_kwargs(task: 'Task', key: str) -> t.Dict[str, t.Any]:
+    """
+    Keyword arguments for API calls which submit a long running server-side operation
+
+    The handle recorded by a prior run (if any) is passed so the API call can reattach
+    to the operation, and ``on_submit`` records the handle of a newly submitted one.
+
+    :param task: The task which tracks the handles
+    :param key: The step function name to track the handle under
+    """
+    return {'handle': task.get_handle(key), 'on_submit': partial(task.set_handle, key)}
+
+
+def log_task_status(task: 'Task', stepname: str, status: t.Dict) -> None:
+    """Add the final status of a server-side task to the Task log"""
+    msg = f'{stepname} final task status: {summarize_task(status)}'
+    logger.info(msg)
+    task.add_log(msg)
+
+
 def fmwrapper(task: 'Task', stepname: str, var: DotMap) -> None:
     """Do some task logging around the forcemerge api call"""
     index = var.redaction_target
     msg = f'{stepname} Before forcemerge, {api.report_segment_count(var.client, index)}'
     logger.info(msg)
     task.add_log(msg)
-    fmkwargs = {}
-    if 'forcemerge' in task.job.config:
-        fmkwargs = task.job.config['forcemerge']
-    fmkwargs['index'] = index
-    if 'only_expunge_deletes' in fmkwargs and fmkwargs['only_expunge_deletes']:
+    # Validating fills in defaults for anything not configured
+    settings = Schema(forcemerge_schema())(dict(task.job.config.get('forcemerge', {})))
+    fmkwargs = {'index': index}
+    expunge = settings['only_expunge_deletes']
+    if settings['auto']:
+        choice, reason = choose_forcemerge(
+            api.get_merge_stats(var.client, index), settings
+        )
+        msg = f'{stepname} Auto forcemerge: {reason}'
+        logger.info(msg)
+        task.add_log(msg)
+        if choice == 'skip':
+            return
+        expunge = choice == 'expunge'
+    if expunge:
+        fmkwargs['only_expunge_deletes'] = True
+        # By default, segments with up to 10% deleted docs are left alone, and their
+        # deleted docs still hold the unredacted values
+        api.put_settings(var.client, index, EXPUNGE_ALL_DELETES)
         msg = 'Forcemerge will only expunge deleted docs!'
         logger.info(msg)
         task.add_log(msg)
     else:
-        mns = 1  # default value
-        if 'max_num_segments' in fmkwargs and isinstance(
-            fmkwargs['max_num_segments'], int
-        ):
-            mns = fmkwargs['max_num_segments']
-        msg = f'Proceeding to forcemerge to {mns} segments per shard'
+        fmkwargs['max_num_segments'] = settings['max_num_segments']
+        msg = (
+            f'Proceeding to forcemerge to {settings["max_num_segments"]} segments '
+            f'per shard'
+        )
         logger.info(msg)
         task.add_log(msg)
     logger.debug('forcemerge kwargs = %s', fmkwargs)
     # Do the actual forcemerging
-    api.forcemerge_index(var.client, **fmkwargs)
+    status = api.forcemerge_index(
+        var.client, **fmkwargs, **reattach_kwargs(task, 'forcemerge_index')
+    )
+    log_task_status(task, stepname, status)
     msg = f'After forcemerge, {api.report_segment_count(var.client, index)}'
     logger.info(msg)
     task.add_log(msg)
@@ -143,37 +179,92 @@ def resolve_index(task: 'Task', stepname: str, var: DotMap, **kwargs) -> None:
 def pre_delete(task: 'Task', stepname: str, var: DotMap, **kwargs) -> None:
     """
     Pre-delete the redacted index to ensure no collisions. Ignore if not present
+
+    If a prior run submitted the restore of var.redaction_target and the index exists,
+    it is not deleted, so :py:func:`restore_index` can reattach to the recovery. With
+    ``restore_batch``, the restore handle names the index a prior batch restored,
+    which is kept the same way for :py:func:`batch_restore`. A restored index which
+    cannot be reused is deleted along with var.redaction_target.
     """
     missing_data(stepname, kwargs)
     log_step(task, stepname, 'start')
     if not task.job.dry_run:
-        try:
-            api.delete_index(var.client, var.redaction_target)
-        except MissingIndex:
-            logger.debug(
-                '%s: Pre-delete did not find index "%s"',
-                stepname,
-                var.redaction_target,
-            )
-            # No problem. This is expected.
+        handle = task.get_handle('restore_index')
+        batched = task.job.restore_batcher is not None
+        reusable = handle == var.redaction_target or batched
+        if handle and reusable and api.index_exists(var.client, handle):
+            msg = f'{stepname}: Keeping {handle}, restored by a prior run'
+            logger.info(msg)
+            task.add_log(msg)
+        else:
+            stale = [var.redaction_target]
+            if handle and handle != var.redaction_target:
+                stale.append(handle)
+            for index in stale:
+                try:
+                    api.delete_index(var.client, index)
+                except MissingIndex:
+                    logger.debug(
+                        '%s: Pre-delete did not find index "%s"', stepname, index
+                    )
+                    # No problem. This is expected.
+            # Any handles from a prior run refer to an index which is now gone
+            task.clear_handles()
     else:
         log_step(task, stepname, 'dry-run')
     log_step(task, stepname, 'end')
 
 
+def batch_restore(task: 'Task', var: DotMap, batcher: 'RestoreBatcher') -> None:
+    """
+    Restore var.ss_idx together with other indices from the same source snapshot,
+    and point var.redaction_target at the name it was restored as
+    """
+    handle = task.get_handle('restore_index')
+    if (
+        handle
+        and handle != var.redaction_target
+        and api.index_exists(var.client, handle)
+    ):
+        # A prior run restored it in a batch. Wait for that restore to complete.
+        snapshot_api.restore_index(
+            var.client,
+            var.repository,
+            var.ss_snap,
+            var.ss_idx,
+            handle,
+            handle=handle,
+        )
+        target = handle
+    else:
+        target = batcher.restore(
+            var.repository,
+            var.ss_snap,
+            var.ss_idx,
+            on_submit=partial(task.set_handle, 'restore_index'),
+        )
+    var.redaction_target = target
+    var.new_snap_name = f'{target}-snap'
+
+
 def restore_index(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     """Restore index from snapshot"""
     missing_data(stepname, kwargs)
+    batcher = task.job.restore_batcher
+    if batcher is not None:
+        metastep(task, stepname, batch_restore, task, var, batcher)
+        return
     metastep(
         task,
         stepname,
-        api.restore_index,
+        snapshot_api.restore_index,
         var.client,
         var.repository,
         var.ss_snap,
         var.ss_idx,
         var.redaction_target,
         index_settings=var.restore_settings.toDict(),
+        **reattach_kwargs(task, 'restore_index'),
     )
 
 
@@ -315,17 +406,37 @@ def un_ilm_the_restored_index(task: 'Task', stepname, var: DotMap, **kwargs) ->
     metastep(task, stepname, api.remove_ilm_policy, var.client, var.redaction_target)
 
 
+def ubqwrapper(task: 'Task', stepname: str, var: DotMap) -> None:
+    """Log the final status of the update_by_query api call for each query"""
+    for num, config in enumerate(task.job.query_configs):
+        # Each query of a terms_file job has its own handle
+        key = 'redact_from_index' if num == 0 else f'redact_from_index_{num}'
+        status = api.redact_from_index(
+            var.client,
+            var.redaction_target,
+            config,
+            **reattach_kwargs(task, key),
+        )
+        log_task_status(task, stepname, status)
+
+
 def redact_from_index(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     """Run update by query on new restored index"""
     missing_data(stepname, kwargs)
-    metastep(
-        task,
-        stepname,
-        api.redact_from_index,
-        var.client,
-        var.redaction_target,
-        task.job.config,
-    )
+    metastep(task, stepname, ubqwrapper, task, stepname, var)
+
+
+def redact_for_riders(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
+    """
+    Run the update by query of every rider job on the same restored index, logging
+    to each rider's own task
+    """
+    missing_data(stepname, kwargs)
+    for rider in kwargs.get('riders', []):
+        msg = f'{stepname}: Redacting {var.redaction_target} for job {rider.job.name}'
+        logger.info(msg)
+        task.add_log(msg)
+        metastep(rider, stepname, ubqwrapper, rider, stepname, var)
 
 
 def forcemerge_index(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
@@ -340,30 +451,69 @@ def clear_cache(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     metastep(task, stepname, api.clear_cache, var.client, var.redaction_target)
 
 
+def check_queries(task: 'Task', var: DotMap) -> None:
+    """Check var.redaction_target was redacted for each query of the task's job"""
+    for config in task.job.query_configs:
+        search_api.check_index(var.client, var.redaction_target, config)
+
+
 def confirm_redaction(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     """Check update by query did its job"""
     missing_data(stepname, kwargs)
-    metastep(
-        task,
-        stepname,
-        api.check_index,
-        var.client,
+    metastep(task, stepname, check_queries, task, var)
+
+
+def confirm_for_riders(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
+    """Check the update by query of every rider job did its job"""
+    missing_data(stepname, kwargs)
+    for rider in kwargs.get('riders', []):
+        msg = f'{stepname}: Confirming redaction for job {rider.job.name}'
+        logger.info(msg)
+        task.add_log(msg)
+        metastep(rider, stepname, check_queries, rider, var)
+
+
+def batch_snapshot(task: 'Task', var: DotMap, batcher: 'SnapshotBatcher') -> None:
+    """
+    Snapshot var.redaction_target together with the redaction targets of other
+    indices, and point var.new_snap_name at the shared snapshot so it is mounted
+    from there
+    """
+    handle = task.get_handle('snapshot_index')
+    if handle and handle != var.new_snap_name:
+        # A prior run joined a batch. Reattach to it if it is still usable.
+        if snapshot_api.get_snapshot_state(var.client, var.repository, handle) in (
+            'IN_PROGRESS',
+            'SUCCESS',
+        ):
+            snapshot_api.take_snapshot(
+                var.client, var.repository, handle, var.redaction_target, handle=handle
+            )
+            var.new_snap_name = handle
+            return
+    var.new_snap_name = batcher.snapshot(
+        var.repository,
         var.redaction_target,
-        task.job.config,
+        on_submit=partial(task.set_handle, 'snapshot_index'),
     )
 
 
 def snapshot_index(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     """Create a new snapshot for mounting our redacted index"""
     missing_data(stepname, kwargs)
+    batcher = task.job.snapshot_batcher
+    if batcher is not None:
+        metastep(task, stepname, batch_snapshot, task, var, batcher)
+        return
     metastep(
         task,
         stepname,
-        api.take_snapshot,
+        snapshot_api.take_snapshot,
         var.client,
         var.repository,
         var.new_snap_name,
         var.redaction_target,
+        **reattach_kwargs(task, 'snapshot_index'),
     )
 
 
@@ -372,7 +522,7 @@ def mount_snapshot(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     Mount the index as a searchable snapshot to make the redacted index available
     """
     missing_data(stepname, kwargs)
-    metastep(task, stepname, api.mount_index, var)
+    metastep(task, stepname, snapshot_api.mount_index, var)
 
 
 def apply_ilm_policy(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
@@ -400,7 +550,11 @@ def confirm_ilm_phase(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     missing_data(stepname, kwargs)
     log_step(task, stepname, 'start')
     # Wait for phase to be "new"
-    waitkw = {'pause': PAUSE_VALUE, 'timeout': TIMEOUT_VALUE}
+    waitkw: t.Dict[str, t.Any] = {
+        'kind': 'ilm',
+        'pause': PAUSE_VALUE,
+        'timeout': TIMEOUT_VALUE,
+    }
     try:
         es_waiter(var.client, IlmPhase, name=var.mount_name, phase='new', **waitkw)
         es_waiter(var.client, IlmStep, name=var.mount_name, **waitkw)
@@ -563,5 +717,5 @@ def record_it(task: 'Task', stepname, var: DotMap, **kwargs) -> None:
     """Record the now-deletable snapshot in the job's tracking index."""
     missing_data(stepname, kwargs)
     log_step(task, stepname, 'start')
-    task.job.cleanup.append(var.ss_snap)
+    task.job.add_cleanup(var.ss_snap)
     log_step(task, stepname, 'end')
@@ -0,0 +1,172 @@
+"""Adapt the throttle of a running update_by_query to cluster pressure"""
+
+import typing as t
+import logging
+import threading
+from elasticsearch8.exceptions import (
+    ApiError,
+    NotFoundError,
+    TransportError,
+    BadRequestError,
+)
+from es_pii_tool.exceptions import BadClientResult
+
+if t.TYPE_CHECKING:
+    from elasticsearch8 import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+#: Only the node stats the throttle needs
+STATS_FILTER = [
+    'nodes.*.thread_pool.write.queue',
+    'nodes.*.thread_pool.write.rejected',
+    'nodes.*.thread_pool.search.queue',
+    'nodes.*.thread_pool.search.rejected',
+    'nodes.*.indices.indexing.index_total',
+    'nodes.*.indices.indexing.index_time_in_millis',
+]
+
+# pylint: disable=R0902
+
+
+class Pressure(t.NamedTuple):
+    """Cluster pressure sampled from node stats"""
+
+    queue: int
+    rejected: int
+    index_total: int
+    index_time: int
+
+
+class AdaptiveThrottle:
+    """
+    Rethrottle an update_by_query task while it runs, in the manner of additive
+    increase, multiplicative decrease (AIMD)
+
+    Every ``interval`` seconds, the write and search thread pools and indexing stats
+    of every node are sampled. If any thread pool queue is longer than ``max_queue``,
+    there are new rejections, or the average indexing time per document since the
+    last sample is over ``latency_budget_ms``, the throttle is multiplied by
+    ``decrease``. Otherwise, ``increase`` is added to it. The throttle always stays
+    between ``min_requests_per_second`` and ``max_requests_per_second``.
+
+    Use it as a context manager around the wait for the task.
+
+    :param client: A client connection object
+    :param task_id: The update_by_query task_id
+    :param settings: The ``adaptive`` settings from the job's ``update_by_query``
+        configuration
+    :param initial: The throttle the task was submitted with
+    :param rethrottle: Called with each new throttle value
+    """
+
+    def __init__(
+        self,
+        client: 'Elasticsearch',
+        task_id: str,
+        settings: t.Dict,
+        initial: float,
+        rethrottle: t.Callable[[float], None],
+    ):
+        self.client = client
+        self.task_id = task_id
+        self.settings = settings
+        self.rethrottle = rethrottle
+        self.lowest = settings['min_requests_per_second']
+        self.highest = settings['max_requests_per_second']
+        self.rps = initial
+        self.changes = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(
+            target=self.loop, name='pii-tool-throttle', daemon=True
+        )
+        self.last: t.Union[Pressure, None] = None
+
+    def __enter__(self) -> 'AdaptiveThrottle':
+        try:
+            self.last = self.sample()
+        except BadClientResult:
+            self.last = None  # The first interval's sample becomes the baseline
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop.set()
+        self.thread.join()
+        logger.info(
+            'Adaptive throttle for task %s ended at %.0f requests per second after '
+            '%s change(s)',
+            self.task_id,
+            self.rps,
+            self.changes,
+        )
+
+    def sample(self) -> Pressure:
+        """
+        :returns: The longest thread pool queue, and the totals of rejections,
+            documents indexed and time spent indexing across all nodes
+        """
+        try:
+            response = dict(
+                self.client.nodes.stats(
+                    metric=['thread_pool', 'indices'],
+                    index_metric='indexing',
+                    filter_path=STATS_FILTER,
+                )
+            )
+        except (ApiError, NotFoundError, TransportError, BadRequestError) as err:
+            msg = f'Unable to get node stats: {err}'
+            logger.warning(msg)
+            raise BadClientResult(msg, err) from err
+        queue = rejected = index_total = index_time = 0
+        for node in response.get('nodes', {}).values():
+            pools = node.get('thread_pool', {})
+            for pool in ('write', 'search'):
+                queue = max(queue, pools.get(pool, {}).get('queue', 0))
+                rejected += pools.get(pool, {}).get('rejected', 0)
+            indexing = node.get('indices', {}).get('indexing', {})
+            index_total += indexing.get('index_total', 0)
+            index_time += indexing.get('index_time_in_millis', 0)
+        return Pressure(queue, rejected, index_total, index_time)
+
+    def pressured(self, now: Pressure) -> bool:
+        """Is the cluster under pressure, compared to the last sample?"""
+        last = self.last if self.last is not None else now
+        if now.queue > self.settings['max_queue']:
+            logger.debug('Thread pool queue of %s is too long', now.queue)
+            return True
+        if now.rejected > last.rejected:
+            logger.debug('%s new rejections', now.rejected - last.rejected)
+            return True
+        docs = now.index_total - last.index_total
+        if docs > 0:
+            latency = (now.index_time - last.index_time) / docs
+            if latency > self.settings['latency_budget_ms']:
+                logger.debug('Indexing latency of %.2fms is over budget', latency)
+                return True
+        return False
+
+    def adjust(self, pressured: bool) -> float:
+        """
+        :returns: The next throttle value
+        """
+        if pressured:
+            target = self.rps * self.settings['decrease']
+        else:
+            target = self.rps + self.settings['increase']
+        return min(self.highest, max(self.lowest, target))
+
+    def loop(self) -> None:
+        """Sample and rethrottle every interval until stopped"""
+        while not self.stop.wait(self.settings['interval']):
+            try:
+                now = self.sample()
+                target = self.adjust(self.pressured(now))
+                self.last = now
+                if target != self.rps:
+                    self.rethrottle(target)
+                    self.rps = target
+                    self.changes += 1
+            except BadClientResult:
+                # The task may have just completed. Keep trying until stopped.
+                continue
@@ -0,0 +1,357 @@
+"""Read the progress/status tracking docs in one go, and write them in bulk"""
+
+import typing as t
+import logging
+import threading
+import time
+from es_pii_tool.defaults import (
+    TRACKING_FLUSH_INTERVAL,
+    TRACKING_SCHEMA_VERSION,
+    index_settings,
+    status_mappings,
+)
+from es_pii_tool.exceptions import BadClientResult, FatalError
+from es_pii_tool.helpers.elastic_api import (
+    bulk_update_docs,
+    create_index,
+    get_tracking_version,
+    put_mappings,
+    replace_with_alias,
+)
+from es_pii_tool.helpers.journal import Journal
+from es_pii_tool.helpers.search_api import count_docs, scan_hits
+
+if t.TYPE_CHECKING:
+    from elasticsearch8 import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+#: The number of docs in each bulk request of :py:func:`migrate_tracking`
+MIGRATE_BATCH_SIZE = 500
+
+
+def task_doc_id(job: str, task_id: str) -> str:
+    """:returns: The tracking doc id of task ``task_id`` of job ``job``"""
+    return f'{job}::{task_id}'
+
+
+def open_tracking_index(client: 'Elasticsearch', index: str) -> None:
+    """
+    Create the tracking index if it does not exist, and ensure an existing one has
+    the current schema
+
+    :param client: A client connection object
+    :param index: The tracking index name
+    """
+    # If the index is already existent, this function will log that fact and
+    # return cleanly
+    kwargs = {'settings': index_settings(), 'mappings': status_mappings()}
+    create_index(client, index, **kwargs)  # type: ignore
+    version = get_tracking_version(client, index)
+    if version < TRACKING_SCHEMA_VERSION:
+        msg = (
+            f'Tracking index {index} has schema version {version}, but version '
+            f'{TRACKING_SCHEMA_VERSION} is required. Run "pii-tool migrate-tracking '
+            f'--tracking-index {index}" first.'
+        )
+        logger.critical(msg)
+        raise FatalError(msg, Exception(version))
+    # Fields may have been added to the current schema version since the index was
+    # created
+    put_mappings(client, index, status_mappings())
+
+
+def convert_doc(hit: t.Dict) -> t.Tuple[str, t.Dict]:
+    """
+    Convert a schema version 1 tracking doc to the current schema
+
+    :param hit: The search hit of the version 1 doc
+
+    :returns: The new doc id, and the doc
+    """
+    source = dict(hit['_source'])
+    source.pop('join_field', None)
+    if 'task' in source:
+        return task_doc_id(source['job'], source['task']), source
+    return source.get('job', hit['_id']), source
+
+
+def read_logs(client: 'Elasticsearch', index: str, owner: str) -> t.List[str]:
+    """
+    :param client: A client connection object
+    :param index: The tracking index name
+    :param owner: The id of the job or task doc the lines were logged for
+
+    :returns: Every log line recorded for ``owner``, oldest first
+    """
+    hits = scan_hits(client, index, {'term': {'log_of': owner}}, fields=['line', 'seq'])
+    return [
+        hit['_source']['line']
+        for hit in sorted(hits, key=lambda hit: hit['_source']['seq'])
+    ]
+
+
+def migrate_tracking(
+    client: 'Elasticsearch', index: str, keep_source: bool = False
+) -> int:
+    """
+    Copy every doc of a schema version 1 tracking index into a new index with the
+    current schema
+
+    The new index is named ``<index>-v<version>``. Unless ``keep_source`` is set,
+    ``index`` is then replaced by an alias of the new index in a single atomic call,
+    so the tracking index name does not change, and the old index is never gone
+    before the alias exists. Docs are upserted at their new ids, so
+    an interrupted migration can simply be run again.
+
+    :param client: A client connection object
+    :param index: The tracking index name
+    :param keep_source: Keep ``index``, rather than replacing it with an alias
+
+    :returns: The number of docs copied
+    """
+    version = get_tracking_version(client, index)
+    if version >= TRACKING_SCHEMA_VERSION:
+        logger.info('Tracking index %s is already schema version %s', index, version)
+        return 0
+    target = f'{index}-v{TRACKING_SCHEMA_VERSION}'
+    kwargs = {'settings': index_settings(), 'mappings': status_mappings()}
+    create_index(client, target, **kwargs)  # type: ignore
+    logger.info('Copying tracking docs from %s to %s', index, target)
+    count = 0
+    doc_ids: t.Set[str] = set()
+    batch: t.Dict[str, t.Dict] = {}
+    for hit in scan_hits(client, index, {'match_all': {}}):
+        doc_id, doc = convert_doc(hit)
+        if doc_id in batch:
+            # Version 1 could record the same task more than once. Write the first
+            # doc, so the later one is merged into it rather than replacing it.
+            bulk_update_docs(client, target, batch)
+            batch = {}
+        batch[doc_id] = doc
+        doc_ids.add(doc_id)
+        count += 1
+        if len(batch) >= MIGRATE_BATCH_SIZE:
+            bulk_update_docs(client, target, batch)
+            batch = {}
+    if batch:
+        bulk_update_docs(client, target, batch)
+    copied = count_docs(client, target)
+    if copied < len(doc_ids):
+        msg = f'{target} has only {copied} of the {len(doc_ids)} docs copied to it'
+        logger.critical(msg)
+        raise FatalError(msg, Exception(copied))
+    if count > len(doc_ids):
+        logger.warning('Merged %s duplicate task doc(s)', count - len(doc_ids))
+    logger.info('Copied %s tracking doc(s) from %s to %s', count, index, target)
+    if not keep_source:
+        replace_with_alias(client, index, target)
+        logger.info('Replaced %s with an alias of %s', index, target)
+    return count
+
+
+# The locks, stop event, and counters of the background flush thread are only used
+# by the writer itself, so they stay on it
+class TrackingWriter:  # pylint: disable=R0902
+    """
+    Coalesce the Job and Task tracking doc updates of a job in memory, and write them
+    with a single bulk request
+
+    Updates to the same doc between flushes are merged, so only the latest values are
+    written. Log lines are each written as a small doc of their own by :py:meth:`log`,
+    so writing a line never means rewriting every line before it. Pending updates are
+    flushed every ``interval`` seconds by a background thread, and whenever
+    :py:meth:`flush` is called, e.g. at the end of each stage or before an irreversible
+    step. Flushes do not refresh the tracking index, as tracking docs with known ids
+    are read with realtime GET requests.
+
+    With a ``journal``, every update is also recorded locally before :py:meth:`update`
+    returns, so no update is lost if the process dies before the next flush.
+
+    :param client: A client connection object
+    :param index: The tracking index name
+    :param interval: Seconds between background flushes
+    :param journal: A local write-ahead journal of every update
+    """
+
+    def __init__(
+        self,
+        client: 'Elasticsearch',
+        index: str,
+        interval: float = TRACKING_FLUSH_INTERVAL,
+        journal: t.Union[Journal, None] = None,
+    ):
+        self.client = client
+        self.index = index
+        self.interval = interval
+        self.journal = journal
+        self.pending: t.Dict[str, t.Dict] = {}
+        #: The journal sequence numbers of the updates in :py:attr:`pending`
+        self.pending_seqs: t.List[int] = []
+        #: Guards :py:attr:`pending` and :py:attr:`pending_seqs`
+        self.lock = threading.Lock()
+        #: Held for the duration of a flush, so flushes never overtake each other
+        self.flush_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread: t.Union[threading.Thread, None] = None
+        #: The count of bulk requests and of doc updates they carried
+        self.flushes = 0
+        self.writes = 0
+        #: The sequence number of the last log line. Nanoseconds since the epoch, so
+        #: lines logged by a later run sort after those of an earlier one.
+        self.seq = 0
+
+    def update(self, doc_id: str, doc: t.Dict) -> None:
+        """
+        Queue an update of ``doc_id`` with the values of ``doc``
+
+        :param doc_id: The tracking doc id
+        :param doc: The (partial) contents of the tracking doc
+        """
+        with self.lock:
+            if self.journal is not None:
+                self.pending_seqs.append(self.journal.append(self.index, doc_id, doc))
+            self.pending[doc_id] = {**self.pending.get(doc_id, {}), **doc}
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.loop, name='pii-tool-tracking', daemon=True
+                )
+                self.thread.start()
+
+    def log(self, job: str, owner: str, line: str) -> None:
+        """
+        Queue a log line, to be written as a new doc rather than appended to the
+        ``logs`` of its owner
+
+        :param job: The job name
+        :param owner: The id of the job or task doc the line is logged for
+        :param line: The log line
+        """
+        with self.lock:
+            self.seq = max(self.seq + 1, time.time_ns())
+            seq = self.seq
+        doc = {'job': job, 'log_of': owner, 'line': line, 'seq': seq}
+        self.update(f'{owner}::log::{seq}', doc)
+
+    def flush(self) -> None:
+        """Write every pending update with a single bulk request"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                seqs, self.pending_seqs = self.pending_seqs, []
+            if not batch:
+                return
+            try:
+                bulk_update_docs(self.client, self.index, batch)
+            except BadClientResult:
+                with self.lock:
+                    # Keep them for the next flush, beneath any newer values
+                    for doc_id, doc in batch.items():
+                        self.pending[doc_id] = {**doc, **self.pending.get(doc_id, {})}
+                    self.pending_seqs = seqs + self.pending_seqs
+                raise
+            if self.journal is not None:
+                self.journal.synced(seqs)
+            self.flushes += 1
+            self.writes += len(batch)
+            logger.debug('Flushed %s tracking doc update(s)', len(batch))
+
+    def loop(self) -> None:
+        """Flush every interval until stopped"""
+        while not self.stop.wait(self.interval):
+            try:
+                self.flush()
+            except BadClientResult as exc:
+                logger.warning('Unable to flush tracking docs. Will retry: %s', exc)
+
+    def close(self) -> None:
+        """Stop the background thread and flush anything still pending"""
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.stop.clear()
+        self.flush()
+        logger.debug(
+            '%s tracking doc update(s) written in %s bulk request(s)',
+            self.writes,
+            self.flushes,
+        )
+
+
+class TrackingCache:
+    """
+    An in-memory table of the tracking docs of every job in a run
+
+    :py:meth:`load` reads every job and task doc, and every log line, of the named
+    jobs with a single scan, so :py:class:`~.es_pii_tool.job.Job` and
+    :py:class:`~.es_pii_tool.task.Task` can look up their history here rather than each
+    making their own requests. Every write is recorded here as well, so the table
+    stays current for the whole run.
+    """
+
+    def __init__(self) -> None:
+        #: Job doc ``_source``, keyed by job name
+        self.jobs: t.Dict[str, t.Dict] = {}
+        #: Task doc ``_id`` and ``_source``, keyed by job name and task_id
+        self.tasks: t.Dict[t.Tuple[str, str], t.Dict] = {}
+        self.lock = threading.Lock()
+
+    def load(self, client: 'Elasticsearch', index: str, names: t.Sequence[str]) -> None:
+        """
+        Open the tracking index with :py:func:`open_tracking_index`, then read every
+        job and task doc of the jobs in ``names``
+
+        :param client: A client connection object
+        :param index: The tracking index name
+        :param names: The job names
+        """
+        open_tracking_index(client, index)
+        count = 0
+        lines: t.Dict[str, t.List[t.Tuple[int, str]]] = {}
+        for hit in scan_hits(client, index, {'terms': {'job': list(names)}}):
+            source = hit['_source']
+            if 'log_of' in source:
+                lines.setdefault(source['log_of'], []).append(
+                    (source['seq'], source['line'])
+                )
+            elif 'task' in source:
+                self.tasks[(source['job'], source['task'])] = {
+                    '_id': hit['_id'],
+                    '_source': source,
+                }
+            else:
+                self.jobs[source['job']] = source
+            count += 1
+        owners = {task['_id']: task['_source'] for task in self.tasks.values()}
+        owners.update(self.jobs)
+        for owner, logged in lines.items():
+            if owner in owners:
+                # Any lines from before log lines had docs of their own come first
+                owners[owner]['logs'] = list(owners[owner].get('logs') or []) + [
+                    line for _, line in sorted(logged)
+                ]
+        logger.info(
+            'Loaded %s tracking doc(s) for %s job(s) from %s', count, len(names), index
+        )
+
+    def get_job(self, name: str) -> t.Union[t.Dict, None]:
+        """:returns: The job doc ``_source`` for job ``name``, if any"""
+        with self.lock:
+            return self.jobs.get(name)
+
+    def get_task(self, name: str, task_id: str) -> t.Union[t.Dict, None]:
+        """:returns: The ``_id`` and ``_source`` of the task doc, if any"""
+        with self.lock:
+            return self.tasks.get((name, task_id))
+
+    def put_job(self, name: str, doc: t.Dict) -> None:
+        """Record a write to the job doc for job ``name``"""
+        with self.lock:
+            self.jobs[name] = {**self.jobs.get(name, {}), **doc}
+
+    def put_task(self, name: str, task_id: str, doc_id: str, doc: t.Dict) -> None:
+        """Record a write to the task doc ``doc_id``"""
+        with self.lock:
+            prior = self.tasks.get((name, task_id), {}).get('_source', {})
+            self.tasks[(name, task_id)] = {'_id': doc_id, '_source': {**prior, **doc}}
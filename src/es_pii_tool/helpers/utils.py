@@ -3,16 +3,25 @@
 import typing as t
 import logging
 import json
+import random
+import threading
 from inspect import stack
 from datetime import datetime, timezone
 import re
+from time import sleep
 from elasticsearch8.exceptions import NotFoundError
 from es_client.exceptions import ConfigurationError as esc_ConfigError
 from es_client.helpers.schemacheck import SchemaCheck
 from es_client.helpers.utils import get_yaml
 from es_wait.exceptions import IlmWaitError
 import es_pii_tool.exceptions as e
-from es_pii_tool.defaults import PHASES, redaction_schema
+from es_pii_tool.defaults import (
+    BACKOFF_JITTER,
+    BACKOFF_SCHEDULES,
+    PHASES,
+    REDACT_SCRIPT_ID,
+    redaction_schema,
+)
 
 if t.TYPE_CHECKING:
     from dotmap import DotMap  # type: ignore
@@ -23,10 +32,13 @@ if t.TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+#: The time each thread has spent waiting, for per-step reporting
+_WAITED = threading.local()
 
-def build_script(message: str, fields: t.Sequence[str]) -> t.Dict[str, str]:
+
+def build_script(message: str, fields: t.Sequence[str]) -> t.Dict[str, t.Any]:
     """
-    Build a painless script for redacting fields by way of an update_by_query operation
+    Build a reference to the stored redaction script for an update_by_query operation
 
     :param message: The text to put in place of whatever is in a field
     :param fields: The list of field names to act on
@@ -35,83 +47,16 @@ def build_script(message: str, fields: t.Sequence[str]) -> t.Dict[str, str]:
     :type fields: list
 
     :rtype: dict
-    :returns: A dictionary of ``{"source": (assembled message), "lang": "painless"}``
+    :returns: A dictionary of ``{"id": REDACT_SCRIPT_ID, "params": {...}}``
     """
-    msg = ""
-    for field in fields:
-        msg += f"ctx._source.{field} = '{message}'; "
-    script = {"source": msg, "lang": "painless"}
+    script = {
+        'id': REDACT_SCRIPT_ID,
+        'params': {'fields': list(fields), 'message': message},
+    }
     logger.debug('script = %s', script)
     return script
 
 
-def check_dotted_fields(result: t.Dict, field: str, message: str) -> bool:
-    """Iterate through dotted fields to ensure success
-
-    :param result: The search result object
-    :param field: The field with dotted notation
-
-    :type result: dict
-    :type field: str
-
-    :returns: Success (``True``) or Failure (``False``)
-    :rtype: bool
-    """
-    success = False
-    logger.debug('Dotted field detected: (%s) ...', field)
-    fielder = result['hits']['hits'][0]['_source']
-    iterations = len(field.split('.'))
-    counter = 1
-    for key in field.split('.'):
-        # This should recursively look for each subkey
-        if key in fielder:
-            fielder = fielder[key]
-        else:
-            break
-        if counter == iterations:
-            if fielder == message:
-                success = True
-        counter += 1
-    return success
-
-
-def check_fields(result: t.Dict, job_config: t.Dict) -> bool:
-    """Check document fields in result to ensure success
-
-    :param result: The search result object
-    :param job_config: The configuration settings for this job
-
-    :type result: dict
-    :type job_config: dict
-
-    :returns: Success (``True``) or Failure (``False``)
-    :rtype: bool
-    """
-    complete = True
-    hit = result['hits']['hits'][0]['_source']
-    for field in job_config['fields']:
-        success = False
-        if len(field.split('.')) > 1:
-            success = check_dotted_fields(result, field, job_config['message'])
-
-        elif field in hit:
-            if hit[field] == job_config['message']:
-                success = True
-
-        else:
-            logger.warning("Field %s not present in document", field)
-            # Don't need to report the expected fail 2x, so we break the loop here
-            break
-
-        if success:
-            logger.info("Field %s is redacted correctly", field)
-        else:
-            # A single failure is enough to make it a complete failure.
-            complete = False
-            logger.error("Field %s is not redacted correctly", field)
-    return complete
-
-
 def chunk_index_list(indices: t.Sequence[str]) -> t.Sequence[t.Sequence[str]]:
     """
     This utility chunks very large index lists into 3KB chunks.
@@ -140,6 +85,29 @@ def chunk_index_list(indices: t.Sequence[str]) -> t.Sequence[t.Sequence[str]]:
     return chunks
 
 
+def chunk_terms_queries(
+    field: str, values: t.Sequence[str], size: int
+) -> t.List[t.Dict]:
+    """
+    Split ``values`` into ``terms`` queries of at most ``size`` values each
+
+    :param field: The field name
+    :param values: The values of ``field`` to match
+    :param size: The most values in a single ``terms`` query
+
+    :type field: str
+    :type values: list
+    :type size: int
+
+    :returns: A list of ``terms`` queries
+    :rtype: list
+    """
+    return [
+        {'terms': {field: list(values[start : start + size])}}
+        for start in range(0, len(values), size)
+    ]
+
+
 def configure_ilm_policy(task: 'Task', data: 'DotMap') -> None:
     """
     Prune phases we've already passed.
@@ -176,6 +144,26 @@ def configure_ilm_policy(task: 'Task', data: 'DotMap') -> None:
             ].actions.searchable_snapshot.force_merge_index = fmerge
 
 
+def dump_state(var: 'DotMap', data: 'DotMap') -> str:
+    """
+    Serialize ``var`` and ``data`` from
+    :py:class:`~.es_pii_tool.redacters.steps.RedactionSteps` for a step checkpoint
+
+    The client connection object in ``var`` cannot be serialized, and is omitted.
+
+    :param var: The variables from RedactSnapshot
+    :param data: The data collected by the redaction steps
+
+    :returns: The JSON encoded state
+    :rtype: str
+    """
+    state = {
+        'var': {key: val for key, val in var.toDict().items() if key != 'client'},
+        'data': data.toDict(),
+    }
+    return json.dumps(state, default=str)
+
+
 def end_it(obj: t.Union['Job', 'Task'], success: bool) -> None:
     """Close out the object here to avoid code repetition"""
     # Record task success or fail here for THIS task_id
@@ -230,39 +218,40 @@ def get_alias_actions(oldidx: str, newidx: str, aliases: t.Dict) -> t.Sequence:
     return actions
 
 
-def get_field_matches(config: t.Dict, result: t.Dict) -> int:
-    """Count docs which have the expected fields
+def choose_forcemerge(stats: t.Dict, settings: t.Dict) -> t.Tuple[str, str]:
+    """
+    Choose how to force merge an index in ``auto`` mode
 
-    :param config: The config from the YAML file
-    :param result: The query result dict
+    The merge is only skipped if no docs are deleted. Deleted docs are the
+    pre-redaction versions of redacted docs, so they still contain the PII, and would
+    otherwise go into the snapshot.
 
-    :type config: dict
-    :type result: dict
+    :param stats: The output of
+        :py:func:`~.es_pii_tool.helpers.elastic_api.get_merge_stats`
+    :param settings: The ``forcemerge`` settings of the job
 
-    :returns: The count of docs in ``result`` which have the identified fields
-    :rtype: int
-    """
+    :type stats: dict
+    :type settings: dict
 
-    logger.debug('Extracting doc hit count from result')
-    doc_count = result['hits']['total']['value']
-    for element in range(0, result['hits']['total']['value']):
-        for field in config['fields']:
-            if len(field.split('.')) > 1:
-                logger.debug('Dotted field "%s" detected...', field)
-                fielder = result['hits']['hits'][element]['_source']
-                for key in field.split('.'):
-                    # This should recursively look for each subkey
-                    if key in fielder:
-                        fielder = fielder[key]
-                    else:
-                        doc_count -= 1
-                        break
-            elif field not in list(result['hits']['hits'][element]['_source'].keys()):
-                logger.debug('Fieldname "%s" NOT detected...', field)
-                doc_count -= 1
-            else:
-                logger.debug('Root-level fieldname "%s" detected...', field)
-    return doc_count
+    :returns: One of ``skip``, ``expunge``, or ``full``, and the reason why
+    :rtype: tuple
+    """
+    total = stats['docs'] + stats['deleted']
+    pct = 100.0 * stats['deleted'] / total if total else 0.0
+    facts = (
+        f'{stats["deleted"]} of {total} docs ({pct:.2f}%) are deleted, and the most '
+        f'segments in a shard is {stats["max_segments"]}'
+    )
+    too_many = stats['max_segments'] > settings['max_segments_per_shard']
+    if pct >= settings['full_above_deleted_pct'] or too_many:
+        limit = (
+            f'at least {settings["full_above_deleted_pct"]}% deleted, or more than '
+            f'{settings["max_segments_per_shard"]} segments in a shard'
+        )
+        return 'full', f'{facts}. Full merge, as there are {limit}'
+    if not stats['deleted']:
+        return 'skip', f'{facts}. Skipping, as no docs are deleted'
+    return 'expunge', f'{facts}. Only expunging deletes'
 
 
 def get_fname() -> str:
@@ -320,6 +309,19 @@ def get_redactions(file: str = '', data: t.Union[t.Dict, None] = None) -> 'Schem
     ).result()
 
 
+def load_state(value: str) -> t.Tuple[t.Dict, t.Dict]:
+    """
+    Deserialize a step checkpoint state made by :py:func:`dump_state`
+
+    :param value: The JSON encoded state
+
+    :returns: A tuple of the ``var`` and ``data`` dictionaries
+    :rtype: tuple
+    """
+    state = json.loads(value)
+    return state['var'], state['data']
+
+
 def now_iso8601() -> str:
     """
     :returns: An ISO8601 timestamp based on datetime.now
@@ -356,11 +358,17 @@ def config_fieldmap(
     key: t.Literal[
         'pattern',
         'query',
+        'terms_file',
         'fields',
         'message',
         'expected_docs',
         'restore_settings',
         'delete',
+        'pipeline',
+        'update_by_query',
+        'restore_batch',
+        'snapshot_batch',
+        'forcemerge',
     ],
 ) -> t.Union[str, int, object]:
     """
@@ -370,20 +378,32 @@ def config_fieldmap(
         'read': {
             'pattern': json.loads,
             'query': json.loads,
+            'terms_file': json.loads,
             'fields': json.loads,
             'message': str,
             'expected_docs': int,
             'restore_settings': json.loads,
             'delete': str,
+            'pipeline': json.loads,
+            'update_by_query': json.loads,
+            'restore_batch': json.loads,
+            'snapshot_batch': json.loads,
+            'forcemerge': json.loads,
         },
         'write': {
             'pattern': json.dumps,
             'query': json.dumps,
+            'terms_file': json.dumps,
             'fields': json.dumps,
             'message': str,
             'expected_docs': int,
             'restore_settings': json.dumps,
             'delete': str,
+            'pipeline': json.dumps,
+            'update_by_query': json.dumps,
+            'restore_batch': json.dumps,
+            'snapshot_batch': json.dumps,
+            'forcemerge': json.dumps,
         },
     }
     return which[rw_val][key]
@@ -407,11 +427,17 @@ def parse_job_config(config: t.Dict, behavior: t.Literal['read', 'write']) -> t.
     fields = [
         'pattern',
         'query',
+        'terms_file',
         'fields',
         'message',
         'expected_docs',
         'restore_settings',
         'delete',
+        'pipeline',
+        'update_by_query',
+        'restore_batch',
+        'snapshot_batch',
+        'forcemerge',
     ]
     doc = {}
     for field in fields:
@@ -421,6 +447,20 @@ def parse_job_config(config: t.Dict, behavior: t.Literal['read', 'write']) -> t.
     return doc
 
 
+def is_mounted(name: str) -> bool:
+    """
+    Is ``name`` the name of a mounted searchable snapshot index? This only checks for
+    the ``restored-`` and ``partial-`` prefixes given to mounted indices by ILM.
+
+    :param name: The index name
+
+    :type name: str
+
+    :rtype: bool
+    """
+    return name.startswith(('restored-', 'partial-'))
+
+
 def strip_ilm_name(name: str) -> str:
     """
     Strip leading ``pii-tool-``, and trailing ``---v000`` from ``name``
@@ -440,6 +480,33 @@ def strip_ilm_name(name: str) -> str:
     return retval
 
 
+def read_terms_file(path: str) -> t.List[str]:
+    """
+    Read the values for a ``terms_file`` job. Values may be one per line, comma
+    separated, or both. Blank values and duplicates are dropped.
+
+    :param path: The path to the file
+
+    :type path: str
+
+    :returns: The unique values, in the order they first appear
+    :rtype: list
+    """
+    values: t.Dict[str, None] = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                for value in line.split(','):
+                    value = value.strip().strip('"\'')
+                    if value:
+                        values[value] = None
+    except OSError as exc:
+        msg = f'Unable to read terms_file: {path}'
+        logger.critical(msg)
+        raise e.ConfigError(msg, exc)
+    return list(values)
+
+
 def strip_index_name(name: str) -> str:
     """
     Strip ``partial-``, ``restored-``, ``redacted-``, and trailing ``---v000`` from
@@ -462,11 +529,81 @@ def strip_index_name(name: str) -> str:
     return retval
 
 
-def es_waiter(client: 'Elasticsearch', cls, **kwargs) -> None:
-    """Wait for ILM Phase & Step to be reached"""
+def backoff(kind: str, cap: t.Union[float, None] = None) -> t.Iterator[float]:
+    """
+    Generate the pauses between checks for a wait of type ``kind``
+
+    Pauses start at the ``initial`` value of the schedule for ``kind`` in
+    :py:const:`~.es_pii_tool.defaults.BACKOFF_SCHEDULES`, and grow exponentially until
+    they reach its ``cap``. Each pause is jittered by up to
+    :py:const:`~.es_pii_tool.defaults.BACKOFF_JITTER` so that concurrent waits do not
+    poll the cluster in lockstep.
+
+    :param kind: A key of :py:const:`~.es_pii_tool.defaults.BACKOFF_SCHEDULES`
+    :param cap: An upper limit for the pause, overriding the schedule if lower
+
+    :type kind: str
+    :type cap: float
+
+    :returns: An endless iterator of pauses, in seconds
+    """
+    schedule = BACKOFF_SCHEDULES.get(kind, BACKOFF_SCHEDULES['task'])
+    limit = schedule['cap'] if cap is None else min(cap, schedule['cap'])
+    pause = min(schedule['initial'], limit)
+    while True:
+        jitter = random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER)
+        yield min(limit, pause * jitter)
+        pause = min(pause * schedule['factor'], limit)
+
+
+def add_wait_time(seconds: float) -> None:
+    """Add ``seconds`` to the time the current thread has spent waiting"""
+    _WAITED.seconds = getattr(_WAITED, 'seconds', 0.0) + seconds
+
+
+def pop_wait_time() -> float:
+    """
+    :returns: The time the current thread has spent waiting since the last call
+    :rtype: float
+    """
+    seconds = getattr(_WAITED, 'seconds', 0.0)
+    _WAITED.seconds = 0.0
+    return seconds
+
+
+def es_waiter(client: 'Elasticsearch', cls, kind: str = 'task', **kwargs) -> float:
+    """
+    Wait for the ``check`` of es_wait class ``cls`` to succeed
+
+    Rather than the fixed pause of ``cls.wait()``, checks are made on the
+    :py:func:`backoff` schedule for ``kind``. A ``pause`` in ``kwargs`` caps the
+    schedule, and a ``timeout`` of ``-1`` means no timeout.
+
+    :param client: A client connection object
+    :param cls: The es_wait class
+    :param kind: A key of :py:const:`~.es_pii_tool.defaults.BACKOFF_SCHEDULES`
+
+    :type client: :py:class:`~.elasticsearch.Elasticsearch`
+    :type kind: str
+
+    :returns: The number of seconds spent waiting
+    :rtype: float
+    """
+    pauses = backoff(kind, cap=kwargs.get('pause'))
+    timeout = kwargs.get('timeout', -1)
+    start = datetime.now(timezone.utc)
+    elapsed = 0.0
     try:
         waiter = cls(client, **kwargs)
-        waiter.wait()
+        while not waiter.check:
+            elapsed = (datetime.now(timezone.utc) - start).total_seconds()
+            if timeout != -1 and elapsed >= timeout:
+                msg = f'The wait {waiter.waitstr} did not complete in {timeout}s'
+                raise TimeoutError(msg)
+            pause = next(pauses)
+            if timeout != -1:
+                pause = min(pause, timeout - elapsed)
+            sleep(pause)
     except (
         KeyError,
         ValueError,
@@ -476,3 +613,8 @@ def es_waiter(client: 'Elasticsearch', cls, **kwargs) -> None:
     ) as wait_err:
         msg = f'{cls.__name__}: wait for completion failed: {kwargs}'
         raise e.BadClientResult(msg, wait_err)
+    finally:
+        elapsed = (datetime.now(timezone.utc) - start).total_seconds()
+        add_wait_time(elapsed)
+    logger.debug('%s: wait completed in %.2fs', cls.__name__, elapsed)
+    return elapsed
@@ -0,0 +1,546 @@
+"""Wait for many server-side operations at once with a shared poller"""
+
+import typing as t
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from os import getenv
+from time import monotonic
+from elasticsearch8.exceptions import (
+    ApiError,
+    ConnectionTimeout,
+    NotFoundError,
+    TransportError,
+    BadRequestError,
+)
+from es_pii_tool.defaults import (
+    LONG_POLL_DEFAULT,
+    LONG_POLL_ENVVAR,
+    LONG_POLL_INTERVAL,
+    PAUSE_DEFAULT,
+    PAUSE_ENVVAR,
+    TIMEOUT_DEFAULT,
+    TIMEOUT_ENVVAR,
+)
+from es_pii_tool.exceptions import BadClientResult
+from es_pii_tool.helpers.utils import add_wait_time, backoff, chunk_index_list
+
+if t.TYPE_CHECKING:
+    from elasticsearch8 import Elasticsearch
+
+#: Seconds between status checks, and the longest wait, unless the environment
+#: overrides them
+PAUSE_VALUE = float(getenv(PAUSE_ENVVAR, default=PAUSE_DEFAULT))
+TIMEOUT_VALUE = float(getenv(TIMEOUT_ENVVAR, default=TIMEOUT_DEFAULT))
+LONG_POLL = getenv(LONG_POLL_ENVVAR, default=LONG_POLL_DEFAULT).lower() in (
+    'true',
+    '1',
+    'yes',
+)
+
+#: Task action name patterns for :py:meth:`~.elasticsearch.Elasticsearch.tasks.list`
+TASK_ACTIONS = {
+    'forcemerge': '*forcemerge*',
+    'reindex': '*reindex*',
+    'update_by_query': '*byquery*',
+}
+
+#: Counters from a completed task's response worth reporting
+TASK_COUNTERS = ('total', 'created', 'updated', 'deleted', 'noops', 'version_conflicts')
+
+#: Error types of a long-poll request which timed out while its task still runs
+TASK_WAIT_TIMEOUTS = (
+    'elasticsearch_timeout_exception',
+    'receive_timeout_transport_exception',
+)
+
+#: Snapshot states which mean the snapshot is finished, but failed
+SNAPSHOT_FAILED = ('FAILED', 'PARTIAL', 'ABORTED', 'INCOMPATIBLE')
+
+#: The result of the wait for a snapshot which is not in its repository
+SNAPSHOT_MISSING = 'MISSING'
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=R0902,W0718
+
+
+class Handle:
+    """An outstanding server-side operation, and the future its waiter blocks on
+
+    Each handle is checked on its own :py:func:`~.es_pii_tool.helpers.utils.backoff`
+    schedule, so a short operation is noticed quickly without long operations being
+    polled just as often.
+
+    :param what: A description of the operation, for logging
+    :param kind: The backoff schedule to use
+    :param timeout: The number of seconds before giving up. -1 means no timeout.
+    :param pause: The longest pause between checks
+    """
+
+    def __init__(
+        self,
+        what: str,
+        kind: str,
+        timeout: float = TIMEOUT_VALUE,
+        pause: float = PAUSE_VALUE,
+    ):
+        self.what = what
+        self.start = datetime.now(timezone.utc)
+        self.timeout = timeout
+        self.future: Future = Future()
+        self.pauses = backoff(kind, cap=pause)
+        self.due = 0.0
+        self.reschedule()
+
+    @property
+    def elapsed(self) -> float:
+        """The number of seconds since this handle was registered"""
+        return (datetime.now(timezone.utc) - self.start).total_seconds()
+
+    @property
+    def expired(self) -> bool:
+        """Has :py:attr:`timeout` been reached?"""
+        return self.timeout != -1 and self.elapsed >= self.timeout
+
+    @property
+    def is_due(self) -> bool:
+        """Is it time to check this operation again?"""
+        return monotonic() >= self.due
+
+    def reschedule(self) -> None:
+        """Schedule the next check after the next pause in the backoff schedule"""
+        self.due = monotonic() + next(self.pauses)
+
+
+class WaitHub:
+    """
+    Poll all registered server-side operations for completion from a single thread
+
+    Rather than a separate polling loop per operation, each round makes one
+    :py:meth:`tasks.list <elasticsearch.client.TasksClient.list>` request for all
+    tasks, one :py:meth:`recovery <elasticsearch.client.IndicesClient.recovery>`
+    request for all restoring indices, and one :py:meth:`snapshot.status
+    <elasticsearch.client.SnapshotClient.status>` request per repository for all
+    snapshots. Waiters block on a
+    :py:class:`~concurrent.futures.Future` which is resolved when their operation
+    completes, fails, or times out.
+
+    The polling thread only runs while there are outstanding operations.
+
+    Each round only checks the operations which are due according to their own
+    backoff schedule, and the thread sleeps until the next one is due.
+
+    :param client: A client connection object
+    :param pause: The longest pause between checks of any one operation
+    """
+
+    def __init__(self, client: 'Elasticsearch', pause: float = PAUSE_VALUE):
+        self.client = client
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread: t.Union[threading.Thread, None] = None
+        self.tasks: t.Dict[str, t.Tuple[str, Handle]] = {}
+        self.restores: t.Dict[str, Handle] = {}
+        self.snapshots: t.Dict[t.Tuple[str, str], Handle] = {}
+
+    @property
+    def outstanding(self) -> int:
+        """The number of operations not yet completed"""
+        return len(self.tasks) + len(self.restores) + len(self.snapshots)
+
+    def register(self, registry: t.Dict, key: t.Any, value: t.Any) -> t.Any:
+        """
+        Add ``value`` to ``registry`` at ``key`` and make sure the poller runs
+
+        If something is already waiting on ``key``, e.g. several indices reattaching
+        to the same batch snapshot, ``value`` is discarded, and every waiter shares
+        the registered handle and its future.
+
+        :returns: The value registered at ``key``
+        """
+        with self.lock:
+            value = registry.setdefault(key, value)
+            self.wakeup.set()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.loop, name='pii-tool-waithub', daemon=True
+                )
+                self.thread.start()
+        return value
+
+    def add_task(
+        self, task_id: str, action: str, timeout: float = TIMEOUT_VALUE
+    ) -> Future:
+        """
+        :param task_id: The task_id
+        :param action: One of the keys of :py:const:`TASK_ACTIONS`
+        :param timeout: The number of seconds before giving up
+
+        :returns: A future which resolves to the :py:meth:`tasks.get
+            <elasticsearch.client.TasksClient.get>` response of the completed task
+        """
+        what = f'the "{action}" task {task_id}'
+        handle = Handle(what, 'task', timeout=timeout, pause=self.pause)
+        _, handle = self.register(self.tasks, task_id, (action, handle))
+        return handle.future
+
+    def add_restore(self, index: str, timeout: float = TIMEOUT_VALUE) -> Future:
+        """
+        :param index: The name of the index being restored
+        :param timeout: The number of seconds before giving up
+
+        :returns: A future which resolves when all shards of ``index`` are recovered
+        """
+        what = f'the restore of {index}'
+        handle = Handle(what, 'restore', timeout=timeout, pause=self.pause)
+        return self.register(self.restores, index, handle).future
+
+    def add_snapshot(
+        self, repository: str, snapshot: str, timeout: float = TIMEOUT_VALUE
+    ) -> Future:
+        """
+        :param repository: The repository name
+        :param snapshot: The snapshot name
+        :param timeout: The number of seconds before giving up
+
+        :returns: A future which resolves to ``SUCCESS`` when ``snapshot`` has
+            succeeded, or to :py:const:`SNAPSHOT_MISSING` if it does not exist
+        """
+        what = f'snapshot {snapshot}'
+        handle = Handle(what, 'snapshot', timeout=timeout, pause=self.pause)
+        return self.register(self.snapshots, (repository, snapshot), handle).future
+
+    def loop(self) -> None:
+        """Poll until there is nothing outstanding"""
+        while True:
+            with self.lock:
+                if not self.outstanding:
+                    self.thread = None
+                    return
+            self.poll()
+            # A newly registered operation wakes the thread early
+            self.wakeup.wait(self.until_due())
+            self.wakeup.clear()
+
+    def until_due(self) -> float:
+        """The number of seconds until the next operation is due to be checked"""
+        with self.lock:
+            handles = [
+                value[1] if isinstance(value, tuple) else value
+                for registry in (self.tasks, self.restores, self.snapshots)
+                for value in registry.values()
+            ]
+        if not handles:
+            return 0.0
+        return max(0.0, min(handle.due for handle in handles) - monotonic())
+
+    def due(self, registry: t.Dict) -> t.Dict:
+        """
+        :returns: The entries of ``registry`` which are due to be checked. They are
+            rescheduled now, so any which do not complete are checked again later.
+        """
+        with self.lock:
+            entries = {}
+            for key, value in registry.items():
+                handle = value[1] if isinstance(value, tuple) else value
+                if handle.is_due:
+                    handle.reschedule()
+                    entries[key] = value
+        return entries
+
+    def poll(self) -> None:
+        """Make one round of checks for every kind of outstanding operation"""
+        for check in (self.check_tasks, self.check_restores, self.check_snapshots):
+            try:
+                check()
+            except (ApiError, TransportError, BadRequestError) as err:
+                # Transient trouble should not fail the waiters. Try again next round.
+                logger.warning('%s failed: %s', check.__name__, err)
+            except Exception as err:
+                logger.error('%s failed unexpectedly: %s', check.__name__, err)
+        self.check_timeouts()
+
+    def resolve(
+        self,
+        registry: t.Dict,
+        key: t.Any,
+        result: t.Any = None,
+        error: t.Union[Exception, None] = None,
+    ) -> None:
+        """Remove ``key`` from ``registry`` and resolve its future"""
+        with self.lock:
+            value = registry.pop(key, None)
+        if value is None:
+            return
+        handle = value[1] if isinstance(value, tuple) else value
+        if error is not None:
+            logger.error('The wait for %s failed: %s', handle.what, error)
+            handle.future.set_exception(error)
+        else:
+            logger.debug(
+                'The wait for %s is over after %.2fs', handle.what, handle.elapsed
+            )
+            handle.future.set_result(result)
+
+    def check_tasks(self) -> None:
+        """
+        List all running tasks of the registered actions in a single request. Only
+        tasks which no longer appear need an individual :py:meth:`tasks.get
+        <elasticsearch.client.TasksClient.get>` call to collect their final status.
+        """
+        pending = self.due(self.tasks)
+        if not pending:
+            return
+        actions = sorted({TASK_ACTIONS[action] for action, _ in pending.values()})
+        response = dict(
+            self.client.tasks.list(actions=actions, group_by='parents', detailed=False)
+        )
+        running = set(response.get('tasks', {}).keys())
+        for task_id in pending:
+            if task_id in running:
+                continue
+            try:
+                status = dict(self.client.tasks.get(task_id=task_id))
+            except NotFoundError as err:
+                self.resolve(self.tasks, task_id, error=ValueError(str(err)))
+                continue
+            if not status.get('completed'):
+                continue  # It must have only just started
+            failure = task_failure(task_id, status)
+            if failure:
+                self.resolve(self.tasks, task_id, error=ValueError(failure))
+            else:
+                self.resolve(self.tasks, task_id, result=status)
+
+    def check_restores(self) -> None:
+        """Check the recovery of all restoring indices in as few requests as possible"""
+        pending = list(self.due(self.restores))
+        if not pending:
+            return
+        response: t.Dict = {}
+        for chunk in chunk_index_list(pending):
+            response.update(
+                dict(
+                    self.client.indices.recovery(
+                        index=','.join(chunk), active_only=False
+                    )
+                )
+            )
+        for index in pending:
+            if index not in response:
+                continue  # Recovery has not yet started
+            shards = response[index]['shards']
+            if shards and all(shard['stage'] == 'DONE' for shard in shards):
+                self.resolve(self.restores, index)
+
+    def check_snapshots(self) -> None:
+        """Check the status of all outstanding snapshots with one request per repo"""
+        pending = list(self.due(self.snapshots))
+        repos: t.Dict[str, t.List[str]] = {}
+        for repository, snapshot in pending:
+            repos.setdefault(repository, []).append(snapshot)
+        for repository, names in repos.items():
+            response = dict(
+                self.client.snapshot.status(
+                    repository=repository, snapshot=names, ignore_unavailable=True
+                )
+            )
+            found = set()
+            for snap in response.get('snapshots', []):
+                key = (repository, snap['snapshot'])
+                found.add(snap['snapshot'])
+                if snap['state'] == 'SUCCESS':
+                    self.resolve(self.snapshots, key, result=snap['state'])
+                elif snap['state'] in SNAPSHOT_FAILED:
+                    msg = f'Snapshot {snap["snapshot"]} ended in state {snap["state"]}'
+                    self.resolve(self.snapshots, key, error=ValueError(msg))
+            # ignore_unavailable leaves missing snapshots out of the response
+            for name in names:
+                if name not in found:
+                    key = (repository, name)
+                    self.resolve(self.snapshots, key, result=SNAPSHOT_MISSING)
+
+    def check_timeouts(self) -> None:
+        """Fail the waiters of any operation which has run out of time"""
+        with self.lock:
+            registries: t.List[t.Dict] = [self.tasks, self.restores, self.snapshots]
+            expired = []
+            for registry in registries:
+                for key, value in registry.items():
+                    handle = value[1] if isinstance(value, tuple) else value
+                    if handle.expired:
+                        expired.append((registry, key, handle))
+        for registry, key, handle in expired:
+            msg = f'The wait for {handle.what} did not complete in {handle.timeout}s'
+            self.resolve(registry, key, error=TimeoutError(msg))
+
+
+_HUBS: t.Dict[int, WaitHub] = {}
+_HUBS_LOCK = threading.Lock()
+
+
+def task_failure(task_id: str, status: t.Dict) -> t.Union[str, None]:
+    """
+    :param task_id: The task_id
+    :param status: The :py:meth:`tasks.get <elasticsearch.client.TasksClient.get>`
+        response of a completed task
+
+    :returns: A description of the task's errors or failures, or ``None``
+    """
+    failures = status.get('response', {}).get('failures')
+    if 'error' in status or failures:
+        error = status.get('error', failures)
+        return f'Task {task_id} completed with failures: {error}'
+    return None
+
+
+def summarize_task(status: t.Dict) -> str:
+    """
+    :param status: The :py:meth:`tasks.get <elasticsearch.client.TasksClient.get>`
+        response of a completed task
+
+    :returns: A one line summary of the final status of the task
+    """
+    response = status.get('response', {})
+    parts = [f'{key}: {response[key]}' for key in TASK_COUNTERS if key in response]
+    if 'failures' in response:
+        parts.append(f'failures: {len(response["failures"])}')
+    nanos = status.get('task', {}).get('running_time_in_nanos')
+    if nanos is not None:
+        parts.append(f'running time: {nanos / 1e9:.2f}s')
+    return ', '.join(parts)
+
+
+def get_hub(client: 'Elasticsearch') -> WaitHub:
+    """
+    :param client: A client connection object
+
+    :returns: The shared :py:class:`WaitHub` for ``client``
+    """
+    with _HUBS_LOCK:
+        if id(client) not in _HUBS:
+            _HUBS[id(client)] = WaitHub(client)
+        return _HUBS[id(client)]
+
+
+def await_future(future: Future, what: str) -> t.Any:
+    """Block until ``future`` resolves, raising BadClientResult on failure"""
+    start = monotonic()
+    try:
+        return future.result()
+    except (ValueError, TimeoutError) as err:
+        msg = f'Wait for completion of {what} failed: {err}'
+        raise BadClientResult(msg, err) from err
+    finally:
+        add_wait_time(monotonic() - start)
+
+
+def long_poll_task(
+    client: 'Elasticsearch', task_id: str, timeout: float = TIMEOUT_VALUE
+) -> t.Dict:
+    """
+    Block server-side until a task completes, by repeatedly calling
+    :py:meth:`tasks.get <elasticsearch.client.TasksClient.get>` with
+    ``wait_for_completion=True``. Each request waits up to
+    :py:const:`~.es_pii_tool.defaults.LONG_POLL_INTERVAL` seconds, so completion is
+    noticed right away, with only one request per interval while the task runs.
+
+    :param client: A client connection object
+    :param task_id: The task_id
+    :param timeout: The number of seconds before giving up. -1 means no timeout.
+
+    :returns: The :py:meth:`tasks.get <elasticsearch.client.TasksClient.get>`
+        response of the completed task
+    """
+    start = monotonic()
+    while True:
+        elapsed = monotonic() - start
+        if timeout != -1 and elapsed >= timeout:
+            raise TimeoutError(f'Task {task_id} did not complete in {timeout}s')
+        # Elasticsearch rejects fractional time values, so wait whole seconds
+        interval = LONG_POLL_INTERVAL
+        if timeout != -1:
+            interval = max(1, min(interval, int(timeout - elapsed)))
+        # The client must not give up before the server does
+        poller = client.options(request_timeout=interval + 30)
+        try:
+            status = dict(
+                poller.tasks.get(
+                    task_id=task_id, wait_for_completion=True, timeout=f'{interval}s'
+                )
+            )
+        except NotFoundError as err:
+            raise ValueError(str(err)) from err
+        except ConnectionTimeout:
+            continue
+        except ApiError as err:
+            if err.meta.status == 408 or err.message in TASK_WAIT_TIMEOUTS:
+                continue  # Still running
+            raise
+        if status.get('completed'):
+            failure = task_failure(task_id, status)
+            if failure:
+                raise ValueError(failure)
+            return status
+
+
+def wait_for_task(
+    client: 'Elasticsearch',
+    task_id: str,
+    action: str,
+    timeout: float = TIMEOUT_VALUE,
+    long_poll: bool = LONG_POLL,
+) -> t.Dict:
+    """
+    Wait for a server-side task to complete
+
+    :param client: A client connection object
+    :param task_id: The task_id
+    :param action: One of the keys of :py:const:`TASK_ACTIONS`
+    :param timeout: The number of seconds before giving up. -1 means no timeout.
+    :param long_poll: Block server-side with :py:func:`long_poll_task` rather than
+        polling through the :py:class:`WaitHub`. The default is set by the
+        ``PII_TOOL_LONG_POLL`` environment variable.
+
+    :returns: The :py:meth:`tasks.get <elasticsearch.client.TasksClient.get>`
+        response of the completed task
+    """
+    what = f'{action} task {task_id}'
+    if not long_poll:
+        return await_future(get_hub(client).add_task(task_id, action, timeout), what)
+    start = monotonic()
+    try:
+        return long_poll_task(client, task_id, timeout=timeout)
+    except (ValueError, TimeoutError, ApiError, TransportError) as err:
+        msg = f'Wait for completion of {what} failed: {err}'
+        raise BadClientResult(msg, err) from err
+    finally:
+        add_wait_time(monotonic() - start)
+
+
+def wait_for_restore(
+    client: 'Elasticsearch', index_list: t.Sequence[str], timeout: float = TIMEOUT_VALUE
+) -> None:
+    """Wait for all indices in ``index_list`` to be restored"""
+    hub = get_hub(client)
+    futures = [hub.add_restore(index, timeout=timeout) for index in index_list]
+    for index, future in zip(index_list, futures):
+        await_future(future, f'restore of {index}')
+
+
+def wait_for_snapshot(
+    client: 'Elasticsearch',
+    repository: str,
+    snapshot: str,
+    timeout: float = TIMEOUT_VALUE,
+) -> None:
+    """Wait for ``snapshot`` in ``repository`` to succeed"""
+    future = get_hub(client).add_snapshot(repository, snapshot, timeout=timeout)
+    what = f'snapshot {snapshot}'
+    if await_future(future, what) == SNAPSHOT_MISSING:
+        err = ValueError(f'Snapshot {snapshot} not found in {repository}')
+        logger.error('The wait for %s failed: %s', what, err)
+        raise BadClientResult(f'Wait for completion of {what} failed: {err}', err)
@@ -2,20 +2,31 @@
 
 import typing as t
 import logging
-from es_pii_tool.defaults import index_settings, status_mappings
+import threading
+from collections import deque
+from es_pii_tool.defaults import TRACKING_LOG_LINES
 from es_pii_tool.exceptions import (
     BadClientResult,
     FatalError,
     MissingDocument,
     MissingIndex,
 )
-from es_pii_tool.helpers.elastic_api import (
-    create_index,
-    get_index,
-    get_tracking_doc,
-    update_doc,
+from es_pii_tool.helpers.batch import RestoreBatcher, SnapshotBatcher
+from es_pii_tool.helpers.elastic_api import get_index, get_tracking_doc
+from es_pii_tool.helpers.journal import Journal
+from es_pii_tool.helpers.search_api import get_max_terms_count
+from es_pii_tool.helpers.tracking import (
+    TrackingCache,
+    TrackingWriter,
+    open_tracking_index,
+    read_logs,
+)
+from es_pii_tool.helpers.utils import (
+    chunk_terms_queries,
+    now_iso8601,
+    parse_job_config,
+    read_terms_file,
 )
-from es_pii_tool.helpers.utils import now_iso8601, parse_job_config
 
 if t.TYPE_CHECKING:
     from elasticsearch8 import Elasticsearch
@@ -37,6 +48,8 @@ class Job:
         name: str,
         config: t.Dict,
         dry_run: bool = False,
+        cache: t.Union[TrackingCache, None] = None,
+        journal: t.Union[Journal, None] = None,
     ):
         self.client = client
         self.index = index
@@ -45,12 +58,31 @@ class Job:
         self.dry_run = dry_run
         self.prev_dry_run = False
         self.cleanup: list[str] = []
+        #: The count of indices processed so far. Only change via
+        #: :py:meth:`increment_counter`
+        self.counter = 0
+        #: Guards :py:attr:`counter`, :py:attr:`cleanup`, and :py:attr:`logs` when
+        #: indices are redacted concurrently
+        self.lock = threading.RLock()
+        self._restore_batcher: t.Union[RestoreBatcher, None] = None
+        self._snapshot_batcher: t.Union[SnapshotBatcher, None] = None
+        #: The most threads which may restore or snapshot indices of this job at
+        #: once. Set before the indices are redacted, and lowered by
+        #: :py:meth:`retire_worker`.
+        self.workers = {'restore': 1, 'snapshot': 1}
+        self._query_configs: t.Union[t.List[t.Dict], None] = None
+        #: The configuration as last written to the tracking doc
+        self.recorded_config: t.Union[t.Dict, None] = None
+        #: Buffers the tracking doc updates of this job and its tasks
+        self.writer = TrackingWriter(client, index, journal=journal)
+        #: The tracking docs prefetched for the run, if any
+        self.cache = cache
+        if cache is not None:
+            # The cache was loaded from the index, so it already exists
+            self.get_history()
+            return
         try:
-            # If the index is already existent, this function will log that fact and
-            # return cleanly
-            args = (client, index)
-            kwargs = {'settings': index_settings(), 'mappings': status_mappings()}
-            create_index(*args, **kwargs)  # type: ignore
+            open_tracking_index(client, index)
         except BadClientResult as exc:
             logger.critical(exc.message)
             raise FatalError(
@@ -71,6 +103,115 @@ class Job:
     def config(self, value: t.Dict) -> None:
         self._config = value
 
+    @property
+    def query_configs(self) -> t.List[t.Dict]:
+        """
+        :getter: Get a copy of :py:attr:`config` for each query to run. For a job with
+            a ``query``, that is just :py:attr:`config`. For a job with a
+            ``terms_file``, the values in the file are split into ``terms`` queries no
+            larger than the lowest ``index.max_terms_count`` of the job's indices (or
+            its ``chunk_size``, if smaller), and there is one copy per query.
+        :type: list
+        """
+        with self.lock:
+            if self._query_configs is None:
+                self._query_configs = self.compile_queries()
+            return self._query_configs
+
+    @property
+    def query(self) -> t.Dict:
+        """
+        :getter: Get a single query matching every doc matched by any query of
+            :py:attr:`query_configs`. The ``terms`` queries of a ``terms_file`` job
+            are combined in a ``bool`` query, so each query stays within
+            ``index.max_terms_count``, and docs matching more than one are only
+            counted once.
+        :type: dict
+        """
+        configs = self.query_configs
+        if len(configs) == 1:
+            return configs[0]['query']
+        return {
+            'bool': {
+                'should': [config['query'] for config in configs],
+                'minimum_should_match': 1,
+            }
+        }
+
+    def compile_queries(self) -> t.List[t.Dict]:
+        """Build :py:attr:`query_configs`"""
+        if 'terms_file' not in self.config:
+            return [self.config]
+        spec = self.config['terms_file']
+        values = read_terms_file(spec['path'])
+        size = get_max_terms_count(self.client, self.config['pattern'])
+        if spec.get('chunk_size'):
+            size = min(size, spec['chunk_size'])
+        queries = chunk_terms_queries(spec['field'], values, size)
+        msg = (
+            f'Split {len(values)} values of {spec["field"]} from {spec["path"]} into '
+            f'{len(queries)} terms queries of up to {size} values'
+        )
+        logger.info(msg)
+        self.add_log(msg)
+        return [{**self.config, 'query': query} for query in queries]
+
+    @property
+    def restore_batcher(self) -> t.Union[RestoreBatcher, None]:
+        """
+        :getter: Get the batcher shared by every index in this job, if the job is
+            configured with ``restore_batch``. Otherwise, ``None``.
+        :type: :py:class:`~.es_pii_tool.helpers.batch.RestoreBatcher`
+        """
+        settings = self.config.get('restore_batch')
+        if settings is None:
+            return None
+        with self.lock:
+            if self._restore_batcher is None:
+                self._restore_batcher = RestoreBatcher(
+                    self.client,
+                    workers=self.workers['restore'],
+                    index_settings=self.config.get('restore_settings'),
+                    **settings,
+                )
+            return self._restore_batcher
+
+    @property
+    def snapshot_batcher(self) -> t.Union[SnapshotBatcher, None]:
+        """
+        :getter: Get the batcher shared by every index in this job, if the job is
+            configured with ``snapshot_batch``. Otherwise, ``None``.
+        :type: :py:class:`~.es_pii_tool.helpers.batch.SnapshotBatcher`
+        """
+        settings = self.config.get('snapshot_batch')
+        if settings is None:
+            return None
+        with self.lock:
+            if self._snapshot_batcher is None:
+                self._snapshot_batcher = SnapshotBatcher(
+                    self.client, workers=self.workers['snapshot'], **settings
+                )
+            return self._snapshot_batcher
+
+    def retire_worker(self, stage: t.Union[str, None] = None) -> None:
+        """
+        Record that a worker will restore or snapshot no more indices of this job, so
+        batches stop waiting for it
+
+        :param stage: Either ``restore`` or ``snapshot``. Both if ``None``.
+        """
+        stages = [stage] if stage else list(self.workers)
+        with self.lock:
+            batchers = {
+                'restore': self._restore_batcher,
+                'snapshot': self._snapshot_batcher,
+            }
+            for name in stages:
+                self.workers[name] -= 1
+                batcher = batchers[name]
+                if batcher is not None:
+                    batcher.retire()
+
     @property
     def indices(self) -> t.Sequence[str]:
         """
@@ -165,25 +306,37 @@ class Job:
     @property
     def logs(self) -> t.Sequence[str]:
         """
-        :getter: Get job logs
+        :getter: Get the most recent job logs. Only the last
+            :py:data:`~.es_pii_tool.defaults.TRACKING_LOG_LINES` are kept.
         :setter: Set job logs
         :type: list
         """
         return self._logs
 
     @logs.setter
-    def logs(self, value: t.Sequence[str]) -> None:
-        self._logs = value
+    def logs(self, value: t.Union[t.Sequence[str], None]) -> None:
+        self._logs = deque(value or [], maxlen=TRACKING_LOG_LINES)
 
     def add_log(self, value: str) -> None:
-        """Append another entry to :py:attr:`logs`"""
-        if self.logs is None:
-            _ = []
-            _.append(f'{now_iso8601()} {value}')
-        else:
-            _ = self.logs
-            _.append(f'{now_iso8601()} {value}')
-        self.logs = _
+        """Append another entry to :py:attr:`logs`, and queue it to be written"""
+        line = f'{now_iso8601()} {value}'
+        with self.lock:
+            self._logs.append(line)
+        self.writer.log(self.name, self.name, line)
+
+    def add_cleanup(self, value: str) -> None:
+        """Append a now-deletable snapshot name to :py:attr:`cleanup`"""
+        with self.lock:
+            self.cleanup.append(value)
+
+    def increment_counter(self) -> int:
+        """Increment :py:attr:`counter` by one
+
+        :returns: The new value of :py:attr:`counter`
+        """
+        with self.lock:
+            self.counter += 1
+            return self.counter
 
     def get_status(self, data: t.Dict) -> t.Dict:
         """Read the status keys from the data
@@ -200,10 +353,9 @@ class Job:
                 result[key] = None
         if not result:
             logger.info('No execution status for job %s', self.name)
-        if 'dry_run' in result:
-            if result['dry_run']:
-                logger.info('Prior record of job %s was a dry-run', self.name)
-                self.prev_dry_run = True
+        if data.get('dry_run'):
+            logger.info('Prior record of job %s was a dry-run', self.name)
+            self.prev_dry_run = True
         return result
 
     def update_status(self) -> None:
@@ -221,11 +373,12 @@ class Job:
         doc = {}
         self.update_status()
         for key in self.ATTRLIST:
-            doc[key] = self.status[key]
+            # Log lines are written on their own by add_log
+            if key != 'logs':
+                doc[key] = self.status[key]
         if 'config' not in doc:
             doc['config'] = {}
         doc['job'] = self.name
-        doc['join_field'] = 'job'
         doc['config'] = parse_job_config(self.config, 'write')
         doc['dry_run'] = self.dry_run
         if not self.dry_run:
@@ -241,7 +394,15 @@ class Job:
         """
         result = {}
         try:
-            result = get_tracking_doc(self.client, self.index, self.name)
+            if self.cache is not None:
+                result = self.cache.get_job(self.name) or {}
+                if not result:
+                    raise MissingDocument('Not in cache', Exception(), self.name)
+            else:
+                result = get_tracking_doc(self.client, self.index, self.name)
+                result['logs'] = list(result.get('logs') or []) + read_logs(
+                    self.client, self.index, self.name
+                )
         except MissingDocument:
             logger.debug('Job tracking doc does not yet exist.')
             self.config = {}
@@ -329,7 +490,7 @@ class Job:
             logger.warning('%s encountered errors.', prefix)
             if self.logs:
                 # Only report the log if a error is True
-                logger.warning('%s had log(s): %s', prefix, self.logs)
+                logger.warning('%s had log(s): %s', prefix, list(self.logs))
 
     def begin(self) -> None:
         """Begin the job and record the current status"""
@@ -363,6 +524,7 @@ class Job:
         if logmsg:
             self.add_log(logmsg)
         self.record()
+        self.flush()
         logger.info('Job: %s ended. Completed: %s', self.name, completed)
 
     def record(self) -> None:
@@ -371,9 +533,29 @@ class Job:
         :rtype: None
         :returns: No return value
         """
-        doc = self.build_doc()
+        with self.lock:
+            doc = self.build_doc()
+            if self.cache is not None:
+                self.cache.put_job(self.name, {**doc, 'logs': list(self.logs)})
+            if doc['config'] == self.recorded_config:
+                # The configuration rarely changes, so only write it when it does
+                del doc['config']
+            else:
+                self.recorded_config = doc['config']
+        self.writer.update(self.name, doc)
+
+    def flush(self) -> None:
+        """Write any buffered tracking doc updates of this job and its tasks"""
+        try:
+            self.writer.flush()
+        except Exception as exc:
+            logger.critical(exc.args[0])  # First arg is always message
+            raise FatalError('Unable to update document', exc) from exc
+
+    def close(self) -> None:
+        """Stop buffering tracking doc updates, and write any still pending"""
         try:
-            update_doc(self.client, self.index, self.name, doc)
+            self.writer.close()
         except Exception as exc:
             logger.critical(exc.args[0])  # First arg is always message
             raise FatalError('Unable to update document', exc) from exc
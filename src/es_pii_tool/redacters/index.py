@@ -9,12 +9,12 @@ from es_pii_tool.exceptions import (
     MissingIndex,
 )
 from es_pii_tool.task import Task
-from es_pii_tool.helpers.utils import (
-    exception_msgmaker,
-    get_field_matches,
-)
+from es_pii_tool.helpers.utils import exception_msgmaker
 from es_pii_tool.helpers import elastic_api as api
+from es_pii_tool.helpers import search_api
+from es_pii_tool.helpers.waiter import summarize_task
 from es_pii_tool.redacters.snapshot import RedactSnapshot
+from es_pii_tool.redacters.steps import RedactionSteps
 
 if t.TYPE_CHECKING:
     from es_pii_tool.job import Job
@@ -25,11 +25,11 @@ logger = logging.getLogger(__name__)
 class RedactIndex:
     """Redact index per settings"""
 
-    def __init__(self, index: str, job: 'Job', counter: int):
+    def __init__(self, index: str, job: 'Job'):
         self.task = Task(job, index=index, id_suffix='REDACT-INDEX')
         self.index = index
-        self.counter = counter
         self.data = DotMap()
+        self.snapshot: t.Union[RedactSnapshot, None] = None
         self.verify_index()
 
     @property
@@ -73,24 +73,16 @@ class RedactIndex:
             raise ValueError(msg, 'index not found as expected', self.index)
 
     def run_query(self):
-        """Run the query"""
-        self.data.result = DotMap(
-            dict(
-                api.do_search(
-                    self.task.job.client,
-                    self.index,
-                    self.task.job.config['query'],
-                    size=10000,
-                )
-            )
+        """Count the docs matching the query"""
+        self.data.hits = search_api.get_hits(
+            self.task.job.client, self.index, self.task.job.query
         )
-        self.data.hits = self.data.result.hits.total.value
         logger.debug('Checking document fields on index: %s...', self.index)
         if self.data.hits == 0:
-            self.counter += 1
+            counter = self.task.job.increment_counter()
             msg = f'Documents matching redaction query not found on index: {self.index}'
             logger.debug(msg)
-            msg = f'Index {self.counter} of {self.task.job.total} processed...'
+            msg = f'Index {counter} of {self.task.job.total} processed...'
             logger.info(msg)
             # Record success for this task but send msg to the log field
             # An index could be in the pattern but have no matches.
@@ -99,7 +91,17 @@ class RedactIndex:
 
     def verify_fields(self):
         """Verify the fields in the query results match what we expect"""
-        if not get_field_matches(self.task.job.config, self.data.result.toDict()) > 0:
+        config = self.task.job.config
+        try:
+            counts = search_api.get_field_counts(
+                self.task.job.client, self.index, self.task.job.query, config['fields']
+            )
+        except BadClientResult as exc:
+            kwargs = {'completed': False, 'errors': True, 'logmsg': 'replaceme'}
+            self.end_in_failure(exc, reraise=True, func=self.task.end, kwargs=kwargs)
+        each = ', '.join(f'{field}: {counts[field]}' for field in config['fields'])
+        self.task.add_log(f'Hits with each field: {each}')
+        if not counts['_all'] > 0:
             msg = f'Fields required for redaction not found on index: {self.index}'
             logger.warning(msg)
             self.task.end(completed=True, logmsg=msg)
@@ -128,60 +130,120 @@ class RedactIndex:
             msg = f'Redacting data from {self.index}'
             logger.info(msg)
             self.task.add_log(msg)
-            try:
-                api.redact_from_index(
-                    self.task.job.client, self.index, self.task.job.config
-                )
-            except (MissingIndex, BadClientResult) as exc:
-                kwargs = {'completed': False, 'errors': True, 'logmsg': 'replaceme'}
-                self.end_in_failure(
-                    exc, reraise=False, func=self.task.end, kwargs=kwargs
-                )
+            for config in self.task.job.query_configs:
+                try:
+                    status = api.redact_from_index(
+                        self.task.job.client, self.index, config
+                    )
+                except (MissingIndex, BadClientResult) as exc:
+                    kwargs = {'completed': False, 'errors': True, 'logmsg': 'replaceme'}
+                    self.end_in_failure(
+                        exc, reraise=False, func=self.task.end, kwargs=kwargs
+                    )
+                    break
+                msg = f'Final update_by_query status: {summarize_task(status)}'
+                logger.info(msg)
+                self.task.add_log(msg)
         else:
             msg = f'DRY-RUN: Will not redact data from {self.index}'
             logger.info(msg)
             self.task.add_log(msg)
 
-    def snapshot_redact(self):
-        """Redact data from searchable snapshot-backed index"""
+    def snapshot_setup(self, riders: t.Union[t.Sequence[Task], None] = None) -> bool:
+        """
+        Build :py:attr:`snapshot` to redact data from a searchable snapshot-backed
+        index
+
+        :param riders: The REDACT-INDEX tasks of other jobs to redact from the same
+            restored index
+
+        :returns: ``True`` if the stages of :py:attr:`snapshot` still need to be run
+        """
         msg = 'Initiating redaction of data from mounted searchable snapshot...'
         logger.info(msg)
         self.task.add_log(msg)
         try:
-            snp = RedactSnapshot(self.index, self.task.job, self.data.phase)
+            self.snapshot = RedactSnapshot(
+                self.index, self.task.job, self.data.phase, riders=riders
+            )
         except Exception as exc:
             logger.critical('Unable to build RedactSnapshot object. Exception: %s', exc)
             raise
+        return self.snapshot.setup()
+
+    def snapshot_stage(self, stage: str) -> None:
+        """
+        Run one stage of the searchable snapshot redaction. When the last stage has
+        been run, the redaction of this index is complete.
+
+        :param stage: One of :py:attr:`RedactionSteps.STAGES
+            <es_pii_tool.redacters.steps.RedactionSteps.STAGES>`
+        """
         try:
-            snp.run()
+            self.snapshot.run_stage(stage)  # type: ignore
         except Exception as exc:
             logger.critical('Unable to run RedactSnapshot object. Exception: %s', exc)
             raise
+        if stage == RedactionSteps.STAGES[-1]:
+            self.snapshot.end()  # type: ignore
+            self.finish()
+
+    def snapshot_redact(self, riders: t.Union[t.Sequence[Task], None] = None):
+        """Redact data from searchable snapshot-backed index
+
+        :param riders: The REDACT-INDEX tasks of other jobs to redact from the same
+            restored index
+        """
+        if self.snapshot_setup(riders=riders):
+            for stage in RedactionSteps.STAGES:
+                self.snapshot_stage(stage)
+        else:
+            self.finish()
 
-    def run(self):
-        """Do the actual run"""
+    @property
+    def is_snapshot(self) -> bool:
+        """Is the index a searchable snapshot mount in the cold or frozen tier?"""
+        return self.data.phase in ('cold', 'frozen')
+
+    def prepare(self) -> bool:
+        """
+        Do everything up to the point of redaction
+
+        :returns: ``True`` if there are documents to redact from the index, or
+            ``False`` if the task is already complete.
+        """
         if self.task.finished():
             self.success = True
-            return
+            return False
         # Log task start time
         self.task.begin()
         self.run_query()
         if self.task.completed:
             self.success = True
-            return
+            return False
         self.verify_fields()
         if self.task.completed:
             self.success = True
-            return
+            return False
         self.get_phase()
-        if self.data.phase in ('cold', 'frozen'):
-            self.snapshot_redact()
-        else:
-            self.normal_redact()
+        return True
+
+    def finish(self):
+        """Record the redaction of this index as complete"""
         # If we have reached this point, we've succeeded.
-        self.counter += 1
-        msg = f'Index {self.counter} of {self.task.job.total} processed...'
+        counter = self.task.job.increment_counter()
+        msg = f'Index {counter} of {self.task.job.total} processed...'
         logger.info(msg)
         self.task.add_log(msg)
         self.task.end(completed=True, logmsg='DONE')
         self.success = True
+
+    def run(self):
+        """Do the actual run"""
+        if not self.prepare():
+            return
+        if self.is_snapshot:
+            self.snapshot_redact()
+        else:
+            self.normal_redact()
+            self.finish()
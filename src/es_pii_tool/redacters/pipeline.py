@@ -0,0 +1,107 @@
+"""Overlap the stages of searchable snapshot redaction across several indices"""
+
+import typing as t
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from es_pii_tool.redacters.steps import RedactionSteps
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=R0903,W0718
+
+
+class RedactionPipeline:
+    """
+    Run items through each of :py:attr:`RedactionSteps.STAGES
+    <es_pii_tool.redacters.steps.RedactionSteps.STAGES>` in order, while allowing
+    different items to be in different stages at the same time.
+
+    Each stage has its own depth, which is the number of items allowed to run that
+    stage at once. An item which has finished a stage waits for a free slot in the
+    next one. An item will not start a stage if as many items as the next stage's
+    depth are already waiting on it, so a slow snapshot stage will not let restored
+    indices pile up on the cluster.
+
+    :param depths: The depth of each stage, e.g. ``{'restore': 2, 'snapshot': 2}``.
+        Any stage not named has a depth of ``1``.
+    """
+
+    def __init__(self, depths: t.Union[t.Dict[str, int], None] = None):
+        if depths is None:
+            depths = {}
+        self.stages = list(RedactionSteps.STAGES)
+        self.depths = {stage: max(1, depths.get(stage, 1)) for stage in self.stages}
+
+    def admissible(
+        self, pos: int, waiting: t.Dict[int, t.Deque], running: t.List[int]
+    ) -> bool:
+        """
+        Can another item start the stage at position ``pos``?
+
+        :param pos: The position of the stage in :py:attr:`stages`
+        :param waiting: Items which are waiting to start each stage
+        :param running: The number of items presently running each stage
+        """
+        if running[pos] >= self.depths[self.stages[pos]]:
+            return False
+        if pos + 1 < len(self.stages):
+            # Apply back-pressure from the next stage
+            return len(waiting[pos + 1]) < self.depths[self.stages[pos + 1]]
+        return True
+
+    def run(self, items: t.Sequence, func: t.Callable[[t.Any, str], None]) -> None:
+        """
+        Run ``func(item, stage)`` for every stage of every item
+
+        If any call raises an exception, no new items will be started, but items that
+        have already started will be run through all remaining stages before the first
+        exception is re-raised. This avoids leaving restored indices behind.
+
+        :param items: The items to run through the pipeline
+        :param func: The callable which runs a single stage for a single item
+        """
+        last = len(self.stages) - 1
+        waiting: t.Dict[int, t.Deque] = {pos: deque() for pos in range(last + 1)}
+        waiting[0].extend(items)
+        running = [0] * (last + 1)
+        in_flight: t.Dict[Future, t.Tuple[t.Any, int]] = {}
+        failure: t.Union[BaseException, None] = None
+        pools = [
+            ThreadPoolExecutor(
+                max_workers=self.depths[stage], thread_name_prefix=f'pii-{stage}'
+            )
+            for stage in self.stages
+        ]
+        logger.info('Redaction pipeline stage depths: %s', self.depths)
+        try:
+            while True:
+                if failure is not None:
+                    waiting[0].clear()  # Do not start any new items
+                # Start with the last stage so items are pulled through to completion
+                for pos in range(last, -1, -1):
+                    while waiting[pos] and self.admissible(pos, waiting, running):
+                        item = waiting[pos].popleft()
+                        future = pools[pos].submit(func, item, self.stages[pos])
+                        in_flight[future] = (item, pos)
+                        running[pos] += 1
+                if not in_flight:
+                    break
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, pos = in_flight.pop(future)
+                    running[pos] -= 1
+                    exc = future.exception()
+                    if exc is not None:
+                        logger.critical(
+                            'Pipeline stage %s failed: %s', self.stages[pos], exc
+                        )
+                        if failure is None:
+                            failure = exc
+                    elif pos < last:
+                        waiting[pos + 1].append(item)
+        finally:
+            for pool in pools:
+                pool.shutdown(wait=True)
+        if failure is not None:
+            raise failure
@@ -22,13 +22,21 @@ logger = logging.getLogger(__name__)
 class RedactSnapshot:
     """Redact PII from indices mounted as searchable snapshots"""
 
-    def __init__(self, index: str, job: 'Job', phase: str):
+    def __init__(
+        self,
+        index: str,
+        job: 'Job',
+        phase: str,
+        riders: t.Union[t.Sequence[Task], None] = None,
+    ):
         self.index = index
         self.phase = phase
+        self.riders = riders
         self.task = Task(job, index=index, id_suffix='REDACT-SNAPSHOT')
         # self.var = self.ConfigAttrs(job.client, index, phase)
         self.var = DotMap()
         self._buildvar(job.client, index, phase)
+        self.steps: t.Union[RedactionSteps, None] = None
 
     def _buildvar(self, client: 'Elasticsearch', index: str, phase: str):
         """Populate :py:attr:`var` with the values we need to start with"""
@@ -86,21 +94,31 @@ class RedactSnapshot:
     def success(self, value: bool) -> None:
         self._success = value
 
-    def run(self):
-        """Do the actual run"""
+    def setup(self) -> bool:
+        """
+        Begin the task, collect the searchable snapshot details, and prepare the
+        :py:class:`~.es_pii_tool.redacters.steps.RedactionSteps`
+
+        :returns: ``True`` if the stages in :py:attr:`steps` still need to be run, or
+            ``False`` if a prior run already completed this task.
+        """
         if self.task.finished():
             self.success = True
-            return
+            return False
         # Log task start time
         self.task.begin()
         logger.info("Getting index info: %s", self.index)
         self.var.restore_settings = DotMap(self.task.job.config['restore_settings'])
-        # self.var.get_index_deets()
         self.get_index_deets()
+        self.steps = RedactionSteps(self.task, self.var, riders=self.riders)
+        return True
 
-        steps = RedactionSteps(self.task, self.var)
-        steps.run()
+    def run_stage(self, stage: str) -> None:
+        """Run a single stage of :py:attr:`steps`"""
+        self.steps.run_stage(stage)  # type: ignore
 
+    def end(self) -> None:
+        """Record the end of the task once every stage has been run"""
         if not self.task.job.dry_run:
             msg = f'Index {self.index} has completed all steps.'
             logger.info(msg)
@@ -109,6 +127,12 @@ class RedactSnapshot:
             self.success = True
             return
         # Implied else (meaning it is a dry run)
-        _ = f'DRY-RUN || {self.task.logs}'
         self.success = False
-        self.task.logs = _
+        self.task.add_log(f'DRY-RUN || {list(self.task.logs)}')
+
+    def run(self):
+        """Do the actual run"""
+        if not self.setup():
+            return
+        self.steps.run()  # type: ignore
+        self.end()
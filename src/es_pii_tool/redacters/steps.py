@@ -4,7 +4,9 @@ import typing as t
 import logging
 from dotmap import DotMap  # type: ignore
 from es_pii_tool.task import Task
+from es_pii_tool.helpers import elastic_api as api
 from es_pii_tool.helpers import steps as s
+from es_pii_tool.helpers.utils import dump_state, load_state, pop_wait_time
 
 logger = logging.getLogger(__name__)
 
@@ -12,20 +14,50 @@ logger = logging.getLogger(__name__)
 
 
 class RedactionSteps:
-    """All of the redaction steps for the final flow"""
+    """All of the redaction steps for the final flow
 
-    def __init__(self, task: Task, var: DotMap):
+    The steps are grouped into :py:attr:`STAGES`, which are always run in order for
+    a single index. Grouping them this way allows
+    :py:class:`~.es_pii_tool.redacters.pipeline.RedactionPipeline` to overlap the
+    stages of several indices.
+
+    Each completed step is recorded as its own checkpoint Task in the tracking index,
+    along with the :py:attr:`var` and :py:attr:`data` state it produced. When a prior
+    run was interrupted, the checkpointed steps are skipped, their state is restored,
+    and execution continues from the first step with no checkpoint.
+
+    :param task: The task for the index being redacted
+    :param var: The variables from RedactSnapshot
+    :param riders: The REDACT-INDEX tasks of other jobs which redact the same index.
+        Their update_by_query is run against the same restored index, so the index is
+        restored, snapshotted, and mounted only once for all of them.
+    """
+
+    #: The stages of a redaction, in order of execution
+    STAGES: t.Sequence[str] = ['prep', 'restore', 'redact', 'snapshot', 'finalize']
+
+    #: Steps which cannot be undone. Tracking is flushed before and after each.
+    IRREVERSIBLE: t.Sequence[t.Callable] = [
+        s.delete_redaction_target,
+        s.close_old_index,
+        s.delete_old_index,
+    ]
+
+    def __init__(
+        self, task: Task, var: DotMap, riders: t.Union[t.Sequence[Task], None] = None
+    ):
         self.task = task
         self.var = var  # These are the variables from RedactSnapshot
+        self.riders = riders or []
         self.counter = 1  # Counter will track the step number for us
-        self.steps: t.Sequence = []  # Steps to execute will be ordered here
         self.data = DotMap()
+        self.checkpoints: t.Dict[str, Task] = {}
+        #: Becomes ``True`` at the first step with no checkpoint from a prior run
+        self.resumed = False
 
-    def prep_steps(self):
-        """Execute the preparatory steps for all indices"""
-        # PREPARATORY STEPS
-        # All indices will do these steps
-        prepsteps = [
+    def prep_steps(self) -> t.Sequence:
+        """The preparatory steps. All indices will do these steps"""
+        return [
             s.resolve_index,  # Resolve whether an index or data_stream
             s.get_index_lifecycle_data,  # Get INDEX lifecycle from settings, if any
             s.get_ilm_explain_data,  # Get ILM explain data, if any
@@ -33,92 +65,209 @@ class RedactionSteps:
             s.clone_ilm_policy,  # If an ILM policy exists for index, clone it.
         ]
 
-        for func in prepsteps:
-            stepname = f'step{str(self.counter).zfill(2)}_{func.__name__}'
-            logger.debug('Attempting %s', stepname)
-            func(self.task, stepname, self.var, data=self.data)
-            self.counter += 1
-
-    def first_steps(self):
-        """
-        Append the first steps to :py:attr:`steps`
-        """
-        self.steps = [
+    def restore_steps(self) -> t.Sequence:
+        """The steps to restore the index to var.redaction_target"""
+        return [
             s.pre_delete,  # Force delete var.redaction_target, just in case
             s.restore_index,  # Restore to var.redaction_target
             s.un_ilm_the_restored_index,  # Remove ILM from var.redaction_target
-            s.redact_from_index,  # Redact specified docs from var.redaction_target
-            s.forcemerge_index,  # Force merge, if configured to do so
-            s.clear_cache,  # Clear the index cache for var.redaction_target
-            s.confirm_redaction,  # Confirm the docs were redacted
+        ]
+
+    def redact_steps(self) -> t.Sequence:
+        """The steps to redact and verify var.redaction_target"""
+        steps = [s.redact_from_index]  # Redact specified docs from var.redaction_target
+        if self.riders:
+            steps.append(s.redact_for_riders)  # Redact docs for each rider job
+        steps.extend(
+            [
+                s.forcemerge_index,  # Force merge, if configured to do so
+                s.clear_cache,  # Clear the index cache for var.redaction_target
+                s.confirm_redaction,  # Confirm the docs were redacted
+            ]
+        )
+        if self.riders:
+            steps.append(s.confirm_for_riders)  # Confirm for each rider job
+        return steps
+
+    def snapshot_steps(self) -> t.Sequence:
+        """The steps to snapshot var.redaction_target and mount it as var.mount_name"""
+        return [
             s.snapshot_index,  # Snapshot var.redaction_target
             s.mount_snapshot,  # Mount the snapshotted index as var.mount_name
         ]
 
-    def ilm_steps(self):
+    def ilm_steps(self) -> t.Sequence:
         """
-        Append ILM specific steps only if there is a new ILM lifecycle name
+        ILM specific steps, only if there is a new ILM lifecycle name
         """
         # After the prep steps, this value should be known
         if bool(self.data.new.ilmname):
-            self.steps.append(s.apply_ilm_policy)  # Apply the cloned ILM policy
-            self.steps.append(s.confirm_ilm_phase)
-            # Confirm we're in the expected phase and steps are "completed"
+            return [
+                s.apply_ilm_policy,  # Apply the cloned ILM policy
+                s.confirm_ilm_phase,
+                # Confirm we're in the expected phase and steps are "completed"
+            ]
+        return []
 
-    def delete_original(self):
+    def delete_original(self) -> t.Sequence:
         """
-        Append steps to delete the original index
+        Steps to delete the original index
         """
-        self.steps.append(s.un_ilm_the_original_index)  # Remove ILM as a precaution
-        self.steps.append(s.close_old_index)  # Close it - Also precautionary
-        self.steps.append(s.delete_old_index)  # Delete it
+        return [
+            s.un_ilm_the_original_index,  # Remove ILM as a precaution
+            s.close_old_index,  # Close it - Also precautionary
+            s.delete_old_index,  # Delete it
+        ]
 
-    def get_steps(self):
+    def finalize_steps(self) -> t.Sequence:
         """
-        Meta-step to populate :py:attr:`steps`
-        """
-        # Do preparatory steps on all indices
-        self.prep_steps()
-
-        # Set the first steps in self.steps
-        self.first_steps()
+        The configuration dependent steps to swap var.mount_name in for var.index
 
+        These depend on the data collected by :py:meth:`prep_steps`, so this can
+        only be called after those have run.
+        """
         # Add configuration dependent steps
-        self.ilm_steps()
+        steps = list(self.ilm_steps())
 
-        self.steps.append(s.delete_redaction_target)  # Delete var.redaction_target
+        steps.append(s.delete_redaction_target)  # Delete var.redaction_target
 
         # After the prep steps, these values should be known
         is_data_stream = bool(self.data.data_stream)
 
         # Only if original index was not a data_stream
         if not is_data_stream:
-            self.steps.append(s.fix_aliases)  # Collect and fix aliases to apply
+            steps.append(s.fix_aliases)  # Collect and fix aliases to apply
 
         # Remove original index
-        self.delete_original()
+        steps.extend(self.delete_original())
 
         # Reassociate as needed
         if is_data_stream:
-            self.steps.append(s.reassociate_index_with_ds)  # Reassociate with ds
+            steps.append(s.reassociate_index_with_ds)  # Reassociate with ds
         else:
-            self.steps.append(s.assign_aliases)  # Reassociate with aliases
+            steps.append(s.assign_aliases)  # Reassociate with aliases
 
         # Final step
-        self.steps.append(s.record_it)
+        steps.append(s.record_it)
+        return steps
 
-    def run(self) -> None:
+    def get_checkpoint(self, func: t.Callable) -> Task:
+        """
+        :param func: The step function
+
+        :returns: The checkpoint Task for step ``func``
+        """
+        name = func.__name__
+        if name not in self.checkpoints:
+            self.checkpoints[name] = Task(
+                self.task.job, index=self.var.index, id_suffix=f'CHECKPOINT---{name}'
+            )
+        return self.checkpoints[name]
+
+    def restore_validated(self) -> bool:
         """
-        Run the steps in sequence
+        Is :py:attr:`var.redaction_target` a completed restore from a prior run?
+
+        It must have a restore_index checkpoint, and it must either still exist, or
+        have been deleted by the delete_redaction_target step after being mounted.
+        This is what keeps :py:func:`~.es_pii_tool.helpers.steps.pre_delete` from
+        wiping out a completed restore on resume.
+        """
+        if not self.get_checkpoint(s.restore_index).finished():
+            return False
+        if self.get_checkpoint(s.delete_redaction_target).finished():
+            return True
+        if api.index_exists(self.var.client, self.var.redaction_target):
+            return True
+        msg = (
+            f'Checkpointed restore of {self.var.redaction_target} not found. '
+            f'Resuming from the restore.'
+        )
+        logger.warning(msg)
+        self.task.add_log(msg)
+        return False
+
+    def skip_step(self, func: t.Callable, stepname: str) -> bool:
+        """
+        Determine if step ``func`` was completed by a prior run. If so, restore the
+        :py:attr:`var` and :py:attr:`data` state recorded at its checkpoint.
+
+        Once any step is found without a checkpoint, every step after it is run.
+
+        :returns: ``True`` if the step should be skipped
+        """
+        if self.resumed:
+            return False
+        if func is s.pre_delete:
+            # pre_delete is never checkpointed. It only needs to run if the restore
+            # that follows it needs to run.
+            skip = self.restore_validated()
+        else:
+            checkpoint = self.get_checkpoint(func)
+            skip = checkpoint.finished()
+            if skip and checkpoint.state:
+                var, data = load_state(checkpoint.state)
+                for key, value in DotMap(var).items():
+                    self.var[key] = value
+                self.data = DotMap(data)
+        if skip:
+            msg = f'{stepname} was completed in a prior run. Skipping.'
+            logger.info(msg)
+            self.task.add_log(msg)
+        else:
+            self.resumed = True
+        return skip
+
+    def record_checkpoint(self, func: t.Callable, stepname: str) -> None:
+        """
+        Record the completion of step ``func`` and the state it produced
+
+        Nothing is recorded in a dry run, as the step did not actually run. A
+        checkpoint from a dry run would make a later real run skip the step.
+        """
+        if func is s.pre_delete or self.task.job.dry_run:
+            return
+        checkpoint = self.get_checkpoint(func)
+        checkpoint.state = dump_state(self.var, self.data)
+        checkpoint.end(True, errors=False, logmsg=f'{stepname} completed')
+
+    def report_wait(self, stepname: str) -> None:
+        """Log how long step ``stepname`` spent waiting for the cluster, if at all"""
+        waited = pop_wait_time()
+        if waited:
+            msg = f'{stepname} spent {waited:.2f}s waiting for completion'
+            logger.info(msg)
+            self.task.add_log(msg)
+
+    def run_stage(self, stage: str) -> None:
+        """
+        Run the steps of a single stage in sequence, skipping any which were
+        checkpointed by a prior run
 
         Step numbers are calculated by :py:attr:`counter`, which makes it easier
         to number steps if they are changed or reordered.
-        """
-        self.get_steps()
 
-        # Now we finish the steps
-        for func in self.steps:
+        :param stage: One of :py:attr:`STAGES`
+        """
+        for func in getattr(self, f'{stage}_steps')():
             stepname = f'step{str(self.counter).zfill(2)}_{func.__name__}'
-            logger.debug('Attempting %s', stepname)
-            func(self.task, stepname, self.var, data=self.data)
+            if not self.skip_step(func, stepname):
+                logger.debug('Attempting %s', stepname)
+                if func in self.IRREVERSIBLE:
+                    self.task.job.flush()
+                pop_wait_time()  # Reset, so only this step's waits are counted
+                func(self.task, stepname, self.var, data=self.data, riders=self.riders)
+                self.report_wait(stepname)
+                self.record_checkpoint(func, stepname)
+                if func in self.IRREVERSIBLE:
+                    self.task.job.flush()
             self.counter += 1
+        self.task.record()
+        self.task.job.flush()  # Every stage ends with its tracking written
+
+    def run(self) -> None:
+        """
+        Run every stage in sequence
+        """
+        for stage in self.STAGES:
+            self.run_stage(stage)
@@ -2,8 +2,11 @@
 
 import typing as t
 import logging
+from collections import deque
+from es_pii_tool.defaults import TRACKING_LOG_LINES
 from es_pii_tool.exceptions import FatalError, MissingArgument, MissingDocument
-from es_pii_tool.helpers.elastic_api import get_task_doc, update_doc
+from es_pii_tool.helpers.elastic_api import get_tracking_doc
+from es_pii_tool.helpers.tracking import read_logs, task_doc_id
 from es_pii_tool.helpers.utils import now_iso8601
 
 if t.TYPE_CHECKING:
@@ -17,7 +20,15 @@ MOD = __name__
 class Task:
     """An individual task item, tracked in Elasticsearch"""
 
-    ATTRLIST = ['start_time', 'completed', 'end_time', 'errors', 'logs']
+    ATTRLIST = [
+        'start_time',
+        'completed',
+        'end_time',
+        'errors',
+        'logs',
+        'state',
+        'handles',
+    ]
 
     def __init__(
         self,
@@ -44,7 +55,8 @@ class Task:
         else:
             self.task_id = f'{index}---{id_suffix}'
         self.index = index
-        self.doc_id = None
+        #: The tracking doc id, which is derived from the job name and task_id
+        self.doc_id = task_doc_id(job.name, self.task_id)
         self.get_history()
 
     @property
@@ -96,27 +108,82 @@ class Task:
 
     @property
     def logs(self) -> t.Sequence[str]:
-        """The list of log lines collected during this task"""
+        """
+        The most recent log lines collected during this task. Only the last
+        :py:data:`~.es_pii_tool.defaults.TRACKING_LOG_LINES` are kept.
+        """
         return self._logs
 
     @logs.setter
-    def logs(self, value: t.Sequence[str]) -> None:
-        self._logs = value
+    def logs(self, value: t.Union[t.Sequence[str], None]) -> None:
+        self._logs = deque(value or [], maxlen=TRACKING_LOG_LINES)
+
+    @property
+    def state(self) -> t.Union[str, None]:
+        """
+        The JSON encoded redaction state recorded with a step checkpoint, if any
+        """
+        return self._state
+
+    @state.setter
+    def state(self, value: t.Union[str, None]) -> None:
+        self._state = value
+
+    @property
+    def handles(self) -> t.Dict[str, str]:
+        """
+        The handles (task_id, snapshot name, or restored index name) of server-side
+        operations submitted by this task, keyed by step name
+        """
+        return self._handles
+
+    @handles.setter
+    def handles(self, value: t.Dict[str, str]) -> None:
+        self._handles = value
+
+    def get_handle(self, key: str) -> t.Union[str, None]:
+        """
+        :param key: The step name
+
+        :returns: The handle recorded for ``key``, if any
+        """
+        if not self.handles:
+            return None
+        return self.handles.get(key)
+
+    def set_handle(self, key: str, value: str) -> None:
+        """
+        Record the handle of a server-side operation immediately, so a later run can
+        reattach to it
+
+        :param key: The step name
+        :param value: The handle
+        """
+        _ = dict(self.handles) if self.handles else {}
+        _[key] = value
+        self.handles = _
+        self.record(flush=True)
+
+    def clear_handles(self) -> None:
+        """Forget all handles, e.g. because the index they operated on is gone"""
+        if self.handles:
+            # Partial document updates merge objects, so blank each key rather than
+            # sending an empty object
+            self.handles = {key: '' for key in self.handles}
+            self.record(flush=True)
 
     def add_log(self, value: str) -> None:
-        """Append another entry to self.logs"""
-        if not self.logs:
-            _ = []
-            _.append(f'{now_iso8601()} {value}')
-        else:
-            _ = self.logs
-            _.append(f'{now_iso8601()} {value}')
-        self.logs = _
+        """Append another entry to self.logs, and queue it to be written"""
+        line = f'{now_iso8601()} {value}'
+        self._logs.append(line)
+        self.job.writer.log(self.job.name, self.doc_id, line)
 
     def load_status(self) -> None:
         """Load prior status values (or not)"""
+        # A task doc written by a dry run records nothing that was actually done
+        prev_dry_run = self.job.prev_dry_run or bool(self.status.get('dry_run'))
         for key in self.ATTRLIST:
-            if self.job.prev_dry_run:
+            if prev_dry_run:
                 # If our last run was a dry run, set each other attribute to None
                 setattr(self, key, None)
             else:
@@ -132,9 +199,16 @@ class Task:
         """
         retval = {}
         try:
-            retval = get_task_doc(
-                self.job.client, self.job.index, self.job.name, self.task_id
-            )
+            if self.job.cache is not None:
+                cached = self.job.cache.get_task(self.job.name, self.task_id) or {}
+                if not cached:
+                    raise MissingDocument('Not in cache', Exception(), self.task_id)
+                retval = cached['_source']
+            else:
+                retval = get_tracking_doc(self.job.client, self.job.index, self.doc_id)
+                retval['logs'] = list(retval.get('logs') or []) + read_logs(
+                    self.job.client, self.job.index, self.doc_id
+                )
         except MissingDocument:
             self.logger.debug(
                 'Doc tracking job: %s, task: %s does not exist yet',
@@ -146,8 +220,7 @@ class Task:
             msg = f'Fatal error encountered: {exc.args[0]}'
             self.logger.critical(msg)
             raise FatalError(msg, exc)
-        self.doc_id = retval['_id']
-        return retval['_source']
+        return retval
 
     def get_history(self) -> None:
         """
@@ -182,7 +255,7 @@ class Task:
             self.logger.warning('%s encountered errors.', prefix)
             if self.logs:
                 # Only report the log if a error is True
-                self.logger.warning('%s had log(s): %s', prefix, self.logs)
+                self.logger.warning('%s had log(s): %s', prefix, list(self.logs))
 
     def begin(self) -> None:
         """Begin the task and record the current status"""
@@ -194,10 +267,6 @@ class Task:
         self.start_time = now_iso8601()
         self.completed = False
         self.record()
-        if not self.doc_id:
-            self.get_task()
-            self.load_status()
-            self.logger.debug('self.doc_id = %s', self.doc_id)
 
     def end(
         self,
@@ -242,25 +311,36 @@ class Task:
         doc = {}
         self.update_status()
         for key in self.ATTRLIST:
-            if key in self.status:
+            # Log lines are written on their own by add_log
+            if key in self.status and key != 'logs':
                 doc[key] = self.status[key]
         if self.index:
             # For the PRE check, there is no value here, so let's not add a null field.
             doc['index'] = self.index
         doc['job'] = self.job.name
         doc['task'] = self.task_id
-        doc['join_field'] = {'name': 'task', 'parent': self.job.name}
         doc['dry_run'] = self.job.dry_run
         # self.logger.debug('Updated task doc: %s', doc)
         return doc
 
-    def record(self) -> None:
-        """Record the current status of the task"""
+    def record(self, flush: bool = False) -> None:
+        """Record the current status of the task
+
+        The update is buffered by the job's
+        :py:class:`~.es_pii_tool.helpers.tracking.TrackingWriter`, which upserts the
+        doc at :py:attr:`doc_id`.
+
+        :param flush: Write the update (and any others buffered) right away
+        """
         doc = self.build_doc()
+        cache = self.job.cache
         try:
-            update_doc(
-                self.job.client, self.job.index, self.doc_id, doc  # type: ignore
-            )
+            self.job.writer.update(self.doc_id, doc)
+            if flush:
+                self.job.writer.flush()
+            if cache is not None:
+                doc['logs'] = list(self.logs)
+                cache.put_task(self.job.name, self.task_id, self.doc_id, doc)
         except Exception as exc:
             msg = f'Fatal error encountered: {exc.args[0]}'
             self.logger.critical(msg)
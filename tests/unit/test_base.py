@@ -0,0 +1,77 @@
+"""Test redacting the indices of a job concurrently in es_pii_tool.base"""
+
+# pylint: disable=missing-function-docstring
+import threading
+from unittest import TestCase, mock
+from es_pii_tool.base import PiiTool
+
+#: Longer than any test should take, so a call which waits for it fails the test
+MAX_WAIT = 5.0
+
+
+def make_tool(max_concurrent_indices, redact_index):
+    tool = object.__new__(PiiTool)
+    tool.max_concurrent_indices = max_concurrent_indices
+    tool.redact_index = redact_index
+    return tool
+
+
+class TestIterateIndicesConcurrently(TestCase):
+    """TestIterateIndicesConcurrently"""
+
+    def setUp(self):
+        self.job = mock.Mock(indices=[f'index-{num}' for num in range(6)])
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def record(self, idx):
+        with self.lock:
+            self.calls.append(idx)
+
+    def test_fans_out_to_every_index(self):
+        # Every call waits until 3 are running at once, or breaks the barrier
+        barrier = threading.Barrier(3, timeout=MAX_WAIT)
+
+        def redact_index(_, idx):
+            self.record(idx)
+            barrier.wait()
+            return idx != 'index-4'
+
+        tool = make_tool(3, redact_index)
+        self.assertFalse(tool.iterate_indices_concurrently(self.job))
+        self.assertEqual(sorted(self.calls), self.job.indices)
+        self.assertEqual(self.job.workers, {'restore': 3, 'snapshot': 3})
+        self.assertEqual(self.job.retire_worker.call_count, 3)
+
+    def test_all_succeeded(self):
+        def redact_index(_, idx):
+            self.record(idx)
+            return True
+
+        tool = make_tool(10, redact_index)
+        self.assertTrue(tool.iterate_indices_concurrently(self.job))
+        self.assertEqual(sorted(self.calls), self.job.indices)
+        self.assertEqual(self.job.workers, {'restore': 6, 'snapshot': 6})
+
+    def test_first_failure_cancels_pending_indices(self):
+        started = threading.Event()
+        released = threading.Event()
+
+        def redact_index(_, idx):
+            self.record(idx)
+            if idx == 'index-0':
+                started.wait(MAX_WAIT)
+                raise RuntimeError('boom')
+            started.set()
+            # Stay in flight until the indices still pending have been cancelled
+            released.wait(MAX_WAIT)
+            return True
+
+        tool = make_tool(2, redact_index)
+        threading.Timer(0.5, released.set).start()
+        with self.assertRaisesRegex(RuntimeError, 'boom'):
+            tool.iterate_indices_concurrently(self.job)
+        # index-1 was in flight, and the freed worker can take at most one more
+        self.assertLessEqual(len(self.calls), 3)
+        self.assertEqual(set(self.calls[:2]), {'index-0', 'index-1'})
+        self.assertNotIn('index-3', self.calls)
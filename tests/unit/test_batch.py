@@ -0,0 +1,113 @@
+"""Test when a Batcher closes its batches"""
+
+# pylint: disable=missing-function-docstring
+import threading
+import time
+from unittest import TestCase
+from es_pii_tool.helpers.batch import Batch, Batcher, Countdown
+
+#: Longer than any test should take, so a batch which waits for it fails the test
+MAX_WAIT = 5.0
+
+
+class Recorder(Batcher):
+    """Record the members of every submitted batch"""
+
+    def __init__(self, **kwargs):
+        super().__init__(None, max_wait=MAX_WAIT, **kwargs)
+        self.batches = []
+
+    def submit(self, batch: Batch) -> None:
+        self.batches.append(sorted(batch.members))
+
+
+def run_all(batcher: Batcher, members, key='key') -> float:
+    """Run each member in its own thread, and return how long they all took"""
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=batcher.run, args=(key, member)) for member in members
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - start
+
+
+class TestBatcher(TestCase):
+    """TestBatcher"""
+
+    def test_single_worker_never_waits(self):
+        batcher = Recorder()
+        start = time.monotonic()
+        batcher.run('key', 'a')
+        batcher.run('key', 'b')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(batcher.batches, [['a'], ['b']])
+
+    def test_closes_when_every_worker_waits(self):
+        batcher = Recorder(workers=3)
+        self.assertLess(run_all(batcher, ['a', 'b', 'c']), 1)
+        self.assertEqual(batcher.batches, [['a', 'b', 'c']])
+
+    def test_closes_when_full(self):
+        batcher = Recorder(workers=4, max_indices=2)
+        batcher.retire()
+        batcher.retire()
+        self.assertLess(run_all(batcher, ['a', 'b']), 1)
+        self.assertEqual(batcher.batches, [['a', 'b']])
+
+    def test_retired_workers_are_not_waited_for(self):
+        batcher = Recorder(workers=3)
+        threading.Timer(0.1, batcher.retire).start()
+        self.assertLess(run_all(batcher, ['a', 'b']), 1)
+        self.assertEqual(batcher.batches, [['a', 'b']])
+
+    def test_waiting_across_keys(self):
+        batcher = Recorder(workers=2)
+
+        def work(key):
+            batcher.run(key, key)
+            batcher.retire()  # This worker has no more indices
+
+        threads = [threading.Thread(target=work, args=(key,)) for key in 'xy']
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(sorted(batcher.batches), [['x'], ['y']])
+
+    def test_submit_error_reaches_every_member(self):
+        batcher = Recorder(workers=2)
+        errors = []
+
+        def fail(batch):
+            raise RuntimeError(batch.name)
+
+        def run(member):
+            try:
+                batcher.run('key', member)
+            except RuntimeError as exc:
+                errors.append(exc)
+
+        batcher.submit = fail
+        threads = [threading.Thread(target=run, args=(m,)) for m in 'ab']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(batcher.waiting, 0)
+
+
+class TestCountdown(TestCase):
+    """TestCountdown"""
+
+    def test_retires_each_worker_once_items_run_out(self):
+        retired = []
+        countdown = Countdown(5, 2, lambda: retired.append(True))
+        for expected in [0, 0, 0, 1, 2]:
+            countdown.finished()
+            self.assertEqual(len(retired), expected)
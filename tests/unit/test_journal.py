@@ -0,0 +1,133 @@
+"""Test the local write-ahead journal of es_pii_tool.helpers.journal"""
+
+# pylint: disable=missing-function-docstring
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+from es_pii_tool.helpers import journal
+from es_pii_tool.helpers.journal import Journal
+
+INDEX = 'redactions-tracker'
+
+
+class TestJournal(TestCase):
+    """TestJournal"""
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'journal.ndjson')
+        self.client = mock.Mock()
+        patcher = mock.patch.object(journal, 'bulk_update_docs')
+        self.bulk = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def lines(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def reopen(self, jnl):
+        jnl.close()
+        return Journal(self.path)
+
+    def test_torn_last_line_is_skipped(self):
+        jnl = Journal(self.path)
+        jnl.append(INDEX, 'job1', {'completed': False})
+        jnl.file.close()
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write('{"seq": 2, "index": "redac')  # Killed mid-write
+        jnl = Journal(self.path)
+        self.assertEqual([entry['seq'] for entry in jnl.entries], [1])
+        self.assertEqual(jnl.seq, 1)
+        # The next update starts on its own line, so it is not lost on reopen
+        jnl.append(INDEX, 'job2', {'completed': False})
+        jnl.file.close()
+        jnl = Journal(self.path)
+        self.assertEqual([entry['id'] for entry in jnl.entries], ['job1', 'job2'])
+        jnl.file.close()
+
+    def test_entries_at_or_below_checkpoint_are_not_loaded(self):
+        jnl = Journal(self.path)
+        seqs = [jnl.append(INDEX, f'job{num}', {'num': num}) for num in range(1, 4)]
+        jnl.synced(seqs[:2])
+        self.assertEqual(jnl.checkpoint, 2)
+        jnl = self.reopen(jnl)
+        self.assertEqual([entry['seq'] for entry in jnl.entries], [3])
+        self.assertEqual(jnl.unsynced, {3})
+        jnl.file.close()
+
+    def test_flushed_entries_after_checkpoint_are_not_loaded(self):
+        jnl = Journal(self.path)
+        old = jnl.append(INDEX, 'job1', {'step': 'one'})
+        new = jnl.append(INDEX, 'job1', {'step': 'two'})
+        other = jnl.append(INDEX, 'job2', {'step': 'one'})
+        # The newer update reached Elasticsearch first, with a merged doc
+        jnl.synced([new, other])
+        self.assertEqual(jnl.checkpoint, 0)
+        self.assertEqual(self.lines()[-1], {'synced': 0, 'flushed': [new, other]})
+        jnl = self.reopen(jnl)
+        self.assertEqual([entry['seq'] for entry in jnl.entries], [old])
+        jnl.file.close()
+
+    def test_replay_writes_later_updates_last(self):
+        jnl = Journal(self.path)
+        jnl.append(INDEX, 'job1', {'step': 'one', 'completed': False})
+        jnl.append(INDEX, 'job2', {'step': 'one'})
+        jnl.append(INDEX, 'job1', {'step': 'two'})
+        jnl.append('other-tracker', 'job1', {'step': 'one'})
+        jnl = self.reopen(jnl)
+        self.assertEqual(jnl.replay(self.client), 3)
+        self.assertEqual(
+            self.bulk.call_args_list,
+            [
+                mock.call(
+                    self.client,
+                    INDEX,
+                    {
+                        'job1': {'step': 'two', 'completed': False},
+                        'job2': {'step': 'one'},
+                    },
+                ),
+                mock.call(self.client, 'other-tracker', {'job1': {'step': 'one'}}),
+            ],
+        )
+        self.assertEqual(jnl.entries, [])
+        self.assertEqual(jnl.unsynced, set())
+        jnl = self.reopen(jnl)
+        self.assertEqual(jnl.replay(self.client), 0)
+        self.assertEqual(self.bulk.call_count, 2)
+        jnl.file.close()
+
+    def test_replay_error_keeps_entries(self):
+        jnl = Journal(self.path)
+        jnl.append(INDEX, 'job1', {'step': 'one'})
+        jnl = self.reopen(jnl)
+        self.bulk.side_effect = RuntimeError('unreachable')
+        with self.assertRaises(RuntimeError):
+            jnl.replay(self.client)
+        jnl = self.reopen(jnl)
+        self.assertEqual(len(jnl.entries), 1)
+        jnl.file.close()
+
+    def test_close_empties_journal_when_all_synced(self):
+        jnl = Journal(self.path)
+        jnl.synced([jnl.append(INDEX, 'job1', {'step': 'one'})])
+        jnl.close()
+        self.assertEqual(os.path.getsize(self.path), 0)
+        jnl = Journal(self.path)
+        self.assertEqual(jnl.entries, [])
+        # Sequence numbers start over in an empty journal
+        self.assertEqual(jnl.append(INDEX, 'job1', {'step': 'two'}), 1)
+        jnl.file.close()
+
+    def test_close_keeps_unsynced_entries(self):
+        jnl = Journal(self.path)
+        jnl.synced([jnl.append(INDEX, 'job1', {'step': 'one'})])
+        jnl.append(INDEX, 'job1', {'step': 'two'})
+        jnl = self.reopen(jnl)
+        self.assertEqual([entry['doc'] for entry in jnl.entries], [{'step': 'two'}])
+        # New updates follow on from the old ones
+        self.assertEqual(jnl.append(INDEX, 'job2', {'step': 'one'}), 3)
+        jnl.file.close()
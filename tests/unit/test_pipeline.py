@@ -0,0 +1,92 @@
+"""Test the stage ordering and back-pressure of RedactionPipeline"""
+
+# pylint: disable=missing-function-docstring
+import typing as t
+import threading
+import time
+from collections import deque
+from unittest import TestCase
+from es_pii_tool.redacters.pipeline import RedactionPipeline
+from es_pii_tool.redacters.steps import RedactionSteps
+
+STAGES = list(RedactionSteps.STAGES)
+
+
+class Recorder:
+    """Record every stage run, and the most items running each stage at once"""
+
+    def __init__(self, pause: float = 0.0, fail: t.Union[t.Tuple, None] = None):
+        self.pause = pause
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.calls: t.List[t.Tuple[str, str]] = []
+        self.running = {stage: 0 for stage in STAGES}
+        self.peak = {stage: 0 for stage in STAGES}
+
+    def __call__(self, item: str, stage: str) -> None:
+        with self.lock:
+            self.calls.append((item, stage))
+            self.running[stage] += 1
+            self.peak[stage] = max(self.peak[stage], self.running[stage])
+        try:
+            time.sleep(self.pause)
+            if self.fail == (item, stage):
+                raise RuntimeError(f'{item} failed {stage}')
+        finally:
+            with self.lock:
+                self.running[stage] -= 1
+
+    def stages_of(self, item: str) -> t.List[str]:
+        return [stage for name, stage in self.calls if name == item]
+
+
+class TestRedactionPipeline(TestCase):
+    """TestRedactionPipeline"""
+
+    def test_default_depths(self):
+        pipeline = RedactionPipeline({STAGES[0]: 3, STAGES[-1]: 0})
+        self.assertEqual(pipeline.depths[STAGES[0]], 3)
+        self.assertEqual(pipeline.depths[STAGES[-1]], 1)  # Never below 1
+        for stage in STAGES[1:-1]:
+            self.assertEqual(pipeline.depths[stage], 1)
+
+    def test_every_item_runs_every_stage_in_order(self):
+        items = [f'index{num}' for num in range(5)]
+        recorder = Recorder()
+        RedactionPipeline({stage: 2 for stage in STAGES}).run(items, recorder)
+        for item in items:
+            self.assertEqual(recorder.stages_of(item), STAGES)
+
+    def test_depth_limits_concurrency(self):
+        depths = {stage: 2 for stage in STAGES}
+        depths[STAGES[0]] = 3
+        recorder = Recorder(pause=0.02)
+        RedactionPipeline(depths).run([f'i{num}' for num in range(8)], recorder)
+        for stage in STAGES:
+            self.assertLessEqual(recorder.peak[stage], depths[stage])
+        self.assertGreater(recorder.peak[STAGES[0]], 1)
+
+    def test_admissible_applies_back_pressure(self):
+        pipeline = RedactionPipeline()
+        waiting = {pos: deque() for pos in range(len(STAGES))}
+        running = [0] * len(STAGES)
+        self.assertTrue(pipeline.admissible(0, waiting, running))
+        # The next stage already has as many waiting items as its depth
+        waiting[1].append('busy')
+        self.assertFalse(pipeline.admissible(0, waiting, running))
+        # A stage which is already full
+        running[1] = 1
+        self.assertFalse(pipeline.admissible(1, waiting, running))
+        # The last stage has no next stage to wait on
+        last = len(STAGES) - 1
+        self.assertTrue(pipeline.admissible(last, waiting, running))
+
+    def test_failure_stops_new_items_but_finishes_started_ones(self):
+        recorder = Recorder(fail=('i0', STAGES[0]))
+        with self.assertRaises(RuntimeError):
+            RedactionPipeline().run(['i0', 'i1', 'i2'], recorder)
+        self.assertEqual(recorder.stages_of('i0'), [STAGES[0]])
+        started = {item for item, _ in recorder.calls} - {'i0'}
+        for item in started:
+            self.assertEqual(recorder.stages_of(item), STAGES)
+        self.assertNotIn('i2', started)
@@ -0,0 +1,55 @@
+"""Test the point in time scan of es_pii_tool.helpers.search_api"""
+
+# pylint: disable=missing-function-docstring
+from unittest import TestCase, mock
+from elasticsearch8.exceptions import TransportError
+from es_pii_tool.exceptions import BadClientResult
+from es_pii_tool.helpers.search_api import scan_hits
+
+
+def page(pit_id, *doc_ids):
+    hits = [{'_id': doc_id, 'sort': [num]} for num, doc_id in enumerate(doc_ids)]
+    return {'pit_id': pit_id, 'hits': {'hits': hits}}
+
+
+class TestScanHits(TestCase):
+    """TestScanHits"""
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.open_point_in_time.return_value = {'id': 'pit1'}
+
+    def closed(self):
+        return [
+            call.kwargs['id'] for call in self.client.close_point_in_time.mock_calls
+        ]
+
+    def test_closes_latest_pit_id(self):
+        self.client.search.side_effect = [
+            page('pit2', 'a', 'b'),
+            page('pit3', 'c'),
+            page('pit3'),
+        ]
+        hits = list(scan_hits(self.client, 'index', {'match_all': {}}))
+        self.assertEqual([hit['_id'] for hit in hits], ['a', 'b', 'c'])
+        pits = [call.kwargs['pit']['id'] for call in self.client.search.mock_calls]
+        self.assertEqual(pits, ['pit1', 'pit2', 'pit3'])
+        self.assertEqual(self.closed(), ['pit3'])
+
+    def test_closes_latest_pit_id_when_stopped_early(self):
+        self.client.search.side_effect = [page('pit2', 'a', 'b'), page('pit3', 'c')]
+        hits = scan_hits(self.client, 'index', {'match_all': {}})
+        next(hits)
+        hits.close()
+        self.assertEqual(self.closed(), ['pit2'])
+
+    def test_closes_latest_pit_id_on_error(self):
+        self.client.search.side_effect = [page('pit2', 'a'), TransportError('reset')]
+        with self.assertRaises(BadClientResult):
+            list(scan_hits(self.client, 'index', {'match_all': {}}))
+        self.assertEqual(self.closed(), ['pit2'])
+
+    def test_closes_opened_pit_id_without_hits(self):
+        self.client.search.side_effect = [page('pit1')]
+        self.assertEqual(list(scan_hits(self.client, 'index', {'match_all': {}})), [])
+        self.assertEqual(self.closed(), ['pit1'])
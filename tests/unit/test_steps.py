@@ -0,0 +1,82 @@
+"""Test resuming the restore steps of es_pii_tool.helpers.steps"""
+
+# pylint: disable=missing-function-docstring
+from unittest import TestCase, mock
+from dotmap import DotMap  # type: ignore
+from es_pii_tool.exceptions import MissingIndex
+from es_pii_tool.helpers import steps
+
+TARGET = 'redacted-index'
+BATCH_TARGET = 'redacted-20240102030405-batch001-index'
+
+
+def make_task(handle, batcher=None):
+    task = mock.Mock()
+    task.job.dry_run = False
+    task.job.restore_batcher = batcher
+    task.get_handle.return_value = handle
+    return task
+
+
+def make_var():
+    return DotMap(
+        client=mock.Mock(),
+        redaction_target=TARGET,
+        repository='repo',
+        ss_snap='snap',
+        ss_idx='index',
+    )
+
+
+class TestResumeBatchedRestore(TestCase):
+    """TestResumeBatchedRestore"""
+
+    def setUp(self):
+        self.batcher = mock.Mock()
+        self.var = make_var()
+        patcher = mock.patch.object(steps, 'api')
+        self.api = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pre_delete(self, task):
+        steps.pre_delete(task, 'pre_delete', self.var, data=DotMap())
+
+    def test_keeps_and_reuses_batch_target(self):
+        task = make_task(BATCH_TARGET, self.batcher)
+        self.api.index_exists.return_value = True
+        self.pre_delete(task)
+        self.api.index_exists.assert_called_once_with(self.var.client, BATCH_TARGET)
+        self.api.delete_index.assert_not_called()
+        task.clear_handles.assert_not_called()
+        with mock.patch.object(steps.snapshot_api, 'restore_index') as restore:
+            steps.batch_restore(task, self.var, self.batcher)
+        restore.assert_called_once_with(
+            self.var.client, 'repo', 'snap', 'index', BATCH_TARGET, handle=BATCH_TARGET
+        )
+        self.batcher.restore.assert_not_called()
+        self.assertEqual(self.var.redaction_target, BATCH_TARGET)
+        self.assertEqual(self.var.new_snap_name, f'{BATCH_TARGET}-snap')
+
+    def test_missing_batch_target_is_restored_again(self):
+        task = make_task(BATCH_TARGET, self.batcher)
+        self.api.index_exists.return_value = False
+        self.api.delete_index.side_effect = MissingIndex('gone', None, 'x')
+        self.pre_delete(task)
+        deleted = [call.args[1] for call in self.api.delete_index.call_args_list]
+        self.assertEqual(deleted, [TARGET, BATCH_TARGET])
+        task.clear_handles.assert_called_once()
+
+    def test_batch_target_deleted_without_batcher(self):
+        task = make_task(BATCH_TARGET)
+        self.pre_delete(task)
+        self.api.index_exists.assert_not_called()
+        deleted = [call.args[1] for call in self.api.delete_index.call_args_list]
+        self.assertEqual(deleted, [TARGET, BATCH_TARGET])
+        task.clear_handles.assert_called_once()
+
+    def test_keeps_unbatched_target(self):
+        task = make_task(TARGET)
+        self.api.index_exists.return_value = True
+        self.pre_delete(task)
+        self.api.delete_index.assert_not_called()
+        task.clear_handles.assert_not_called()
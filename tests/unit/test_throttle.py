@@ -0,0 +1,91 @@
+"""Test the AIMD steps of AdaptiveThrottle"""
+
+# pylint: disable=missing-function-docstring
+from unittest import TestCase, mock
+from es_pii_tool.helpers.throttle import AdaptiveThrottle, Pressure
+
+SETTINGS = {
+    'interval': 30,
+    'min_requests_per_second': 10,
+    'max_requests_per_second': 1000,
+    'increase': 50,
+    'decrease': 0.5,
+    'max_queue': 100,
+    'latency_budget_ms': 5,
+}
+
+
+def throttle(initial: float = 200, **overrides) -> AdaptiveThrottle:
+    return AdaptiveThrottle(
+        mock.MagicMock(), 'node:1', {**SETTINGS, **overrides}, initial, mock.Mock()
+    )
+
+
+class TestAdjust(TestCase):
+    """TestAdjust"""
+
+    def test_additive_increase(self):
+        self.assertEqual(throttle(200).adjust(False), 250)
+
+    def test_multiplicative_decrease(self):
+        self.assertEqual(throttle(200).adjust(True), 100)
+
+    def test_bounds(self):
+        self.assertEqual(throttle(980).adjust(False), 1000)
+        self.assertEqual(throttle(15).adjust(True), 10)
+        self.assertEqual(throttle(10).adjust(True), 10)
+        self.assertEqual(throttle(1000).adjust(False), 1000)
+
+
+class TestPressured(TestCase):
+    """TestPressured"""
+
+    def setUp(self):
+        self.throttle = throttle()
+        self.throttle.last = Pressure(
+            queue=0, rejected=5, index_total=1000, index_time=1000
+        )
+
+    def test_calm(self):
+        # 100 docs in 200ms is 2ms per doc, within the 5ms budget
+        self.assertFalse(self.throttle.pressured(Pressure(10, 5, 1100, 1200)))
+
+    def test_long_queue(self):
+        self.assertTrue(self.throttle.pressured(Pressure(101, 5, 1100, 1200)))
+        self.assertFalse(self.throttle.pressured(Pressure(100, 5, 1100, 1200)))
+
+    def test_new_rejections(self):
+        self.assertTrue(self.throttle.pressured(Pressure(0, 6, 1100, 1200)))
+
+    def test_latency_over_budget(self):
+        # 100 docs in 600ms is 6ms per doc
+        self.assertTrue(self.throttle.pressured(Pressure(0, 5, 1100, 1600)))
+
+    def test_no_new_docs(self):
+        self.assertFalse(self.throttle.pressured(Pressure(0, 5, 1000, 5000)))
+
+    def test_first_sample_is_baseline(self):
+        self.throttle.last = None
+        self.assertFalse(self.throttle.pressured(Pressure(0, 50, 1000, 1000)))
+
+    def test_sample_sums_nodes(self):
+        self.throttle.client.nodes.stats.return_value = {
+            'nodes': {
+                'a': {
+                    'thread_pool': {
+                        'write': {'queue': 3, 'rejected': 1},
+                        'search': {'queue': 7, 'rejected': 2},
+                    },
+                    'indices': {
+                        'indexing': {'index_total': 10, 'index_time_in_millis': 20}
+                    },
+                },
+                'b': {
+                    'thread_pool': {'write': {'queue': 5, 'rejected': 4}},
+                    'indices': {
+                        'indexing': {'index_total': 30, 'index_time_in_millis': 40}
+                    },
+                },
+            }
+        }
+        self.assertEqual(self.throttle.sample(), Pressure(7, 7, 40, 60))
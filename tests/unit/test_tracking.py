@@ -0,0 +1,109 @@
+"""Test the tracking index migration in es_pii_tool.helpers.tracking"""
+
+# pylint: disable=missing-function-docstring
+from unittest import TestCase, mock
+from elasticsearch8.exceptions import TransportError
+from es_pii_tool.exceptions import BadClientResult
+from es_pii_tool.helpers import tracking
+from es_pii_tool.helpers.tracking import convert_doc, migrate_tracking, task_doc_id
+
+
+def hit(doc_id, **source):
+    return {'_id': doc_id, '_source': source}
+
+
+class TestConvertDoc(TestCase):
+    """TestConvertDoc"""
+
+    def test_job_doc_is_keyed_by_job_name(self):
+        doc_id, doc = convert_doc(
+            hit('abc123', job='job1', join_field='job', completed=True)
+        )
+        self.assertEqual(doc_id, 'job1')
+        self.assertEqual(doc, {'job': 'job1', 'completed': True})
+
+    def test_task_doc_is_keyed_by_job_and_task(self):
+        source = {
+            'job': 'job1',
+            'task': 'idx---REDACT-INDEX',
+            'join_field': {'name': 'task', 'parent': 'job1'},
+            'step': 'restore',
+        }
+        doc_id, doc = convert_doc(hit('random-id', **source))
+        self.assertEqual(doc_id, 'job1::idx---REDACT-INDEX')
+        self.assertEqual(doc_id, task_doc_id('job1', 'idx---REDACT-INDEX'))
+        self.assertNotIn('join_field', doc)
+        self.assertEqual(doc['step'], 'restore')
+
+    def test_logs_stay_on_the_doc(self):
+        # Readers merge the logs field of a doc with its separate log line docs
+        _, doc = convert_doc(hit('x', job='job1', logs=['one', 'two']))
+        self.assertEqual(doc['logs'], ['one', 'two'])
+
+    def test_doc_without_job_keeps_its_id(self):
+        self.assertEqual(convert_doc(hit('orphan', note='?'))[0], 'orphan')
+
+    def test_hit_is_not_changed(self):
+        original = hit('x', job='job1', join_field='job')
+        convert_doc(original)
+        self.assertIn('join_field', original['_source'])
+
+
+class TestMigrateTracking(TestCase):
+    """TestMigrateTracking"""
+
+    HITS = [
+        hit('a', job='job1', join_field='job'),
+        hit('b', job='job1', task='t1', join_field={'name': 'task'}, step='one'),
+        hit('c', job='job1', task='t1', join_field={'name': 'task'}, logs=['x']),
+    ]
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.written = {}
+        patches = {
+            'get_tracking_version': mock.Mock(return_value=1),
+            'create_index': mock.Mock(),
+            'scan_hits': mock.Mock(return_value=iter(self.HITS)),
+            'bulk_update_docs': mock.Mock(side_effect=self.bulk),
+            'count_docs': mock.Mock(side_effect=lambda *_: len(self.written)),
+        }
+        for name, value in patches.items():
+            patcher = mock.patch.object(tracking, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def bulk(self, _client, _index, batch):
+        for doc_id, doc in batch.items():
+            self.written[doc_id] = {**self.written.get(doc_id, {}), **doc}
+
+    def test_duplicate_tasks_are_merged(self):
+        with mock.patch.object(tracking, 'replace_with_alias'):
+            self.assertEqual(migrate_tracking(self.client, 'tracking'), 3)
+        self.assertEqual(set(self.written), {'job1', 'job1::t1'})
+        self.assertEqual(self.written['job1::t1']['step'], 'one')
+        self.assertEqual(self.written['job1::t1']['logs'], ['x'])
+
+    def test_swap_is_one_call(self):
+        with mock.patch.object(tracking, 'replace_with_alias') as replace:
+            migrate_tracking(self.client, 'tracking')
+        replace.assert_called_once_with(self.client, 'tracking', 'tracking-v2')
+
+    def test_keep_source(self):
+        with mock.patch.object(tracking, 'replace_with_alias') as replace:
+            migrate_tracking(self.client, 'tracking', keep_source=True)
+        replace.assert_not_called()
+
+    def test_failed_swap_keeps_the_old_index(self):
+        self.client.indices.update_aliases.side_effect = TransportError('reset')
+        with self.assertRaises(BadClientResult):
+            migrate_tracking(self.client, 'tracking')
+        self.client.indices.delete.assert_not_called()
+        actions = self.client.indices.update_aliases.call_args.kwargs['actions']
+        self.assertEqual(
+            actions,
+            [
+                {'remove_index': {'index': 'tracking'}},
+                {'add': {'index': 'tracking-v2', 'alias': 'tracking'}},
+            ],
+        )
@@ -0,0 +1,198 @@
+"""Test the pure helper functions in es_pii_tool.helpers.utils"""
+
+# pylint: disable=missing-function-docstring
+import os
+import tempfile
+from itertools import islice
+from unittest import TestCase, mock
+from voluptuous import Schema
+from es_pii_tool.defaults import (
+    BACKOFF_JITTER,
+    BACKOFF_SCHEDULES,
+    MAX_TERMS_COUNT,
+    forcemerge_schema,
+)
+from es_pii_tool.exceptions import BadClientResult, ConfigError
+from es_pii_tool.helpers import utils
+from es_pii_tool.helpers.utils import (
+    backoff,
+    choose_forcemerge,
+    chunk_terms_queries,
+    es_waiter,
+    pop_wait_time,
+    read_terms_file,
+)
+
+
+def no_jitter(low, high):  # pylint: disable=unused-argument
+    return 1.0
+
+
+class TestBackoff(TestCase):
+    """TestBackoff"""
+
+    def test_schedule_grows_to_cap(self):
+        with mock.patch.object(utils.random, 'uniform', no_jitter):
+            pauses = list(islice(backoff('task'), 7))
+        self.assertEqual(pauses, [0.5, 1.0, 2.0, 4.0, 8.0, 9.0, 9.0])
+
+    def test_each_kind_uses_its_schedule(self):
+        for kind, schedule in BACKOFF_SCHEDULES.items():
+            with mock.patch.object(utils.random, 'uniform', no_jitter):
+                pauses = list(islice(backoff(kind), 20))
+            self.assertEqual(pauses[0], schedule['initial'])
+            self.assertEqual(pauses[-1], schedule['cap'])
+            self.assertEqual(pauses, sorted(pauses))
+
+    def test_unknown_kind_uses_task_schedule(self):
+        with mock.patch.object(utils.random, 'uniform', no_jitter):
+            self.assertEqual(
+                list(islice(backoff('nonsense'), 3)), list(islice(backoff('task'), 3))
+            )
+
+    def test_cap_override(self):
+        with mock.patch.object(utils.random, 'uniform', no_jitter):
+            self.assertEqual(
+                list(islice(backoff('task', cap=1.5), 4)), [0.5, 1.0, 1.5, 1.5]
+            )
+            # A cap above the schedule's own cap does not raise it
+            self.assertEqual(max(islice(backoff('task', cap=100), 10)), 9.0)
+            # A cap below the initial pause
+            self.assertEqual(list(islice(backoff('task', cap=0.1), 2)), [0.1, 0.1])
+
+    def test_jitter_bounds(self):
+        schedule = BACKOFF_SCHEDULES['restore']
+        for pause in islice(backoff('restore'), 200):
+            self.assertGreaterEqual(
+                pause, schedule['initial'] * (1 - BACKOFF_JITTER) - 1e-9
+            )
+            self.assertLessEqual(pause, schedule['cap'])
+
+
+class FakeWait:
+    """An es_wait class whose check succeeds after ``ready`` checks"""
+
+    ready = 3
+
+    def __init__(self, client, **kwargs):  # pylint: disable=unused-argument
+        self.checks = 0
+        self.waitstr = 'for the fake'
+
+    @property
+    def check(self):
+        self.checks += 1
+        return self.checks > self.ready
+
+
+class TestEsWaiter(TestCase):
+    """TestEsWaiter"""
+
+    def setUp(self):
+        pop_wait_time()
+
+    def test_sleeps_on_backoff_schedule(self):
+        with mock.patch.object(utils.random, 'uniform', no_jitter), mock.patch.object(
+            utils, 'sleep'
+        ) as sleep:
+            es_waiter(None, FakeWait, kind='task')
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.5, 1, 2])
+
+    def test_pause_caps_schedule(self):
+        with mock.patch.object(utils.random, 'uniform', no_jitter), mock.patch.object(
+            utils, 'sleep'
+        ) as sleep:
+            es_waiter(None, FakeWait, kind='task', pause=0.75)
+        self.assertEqual(
+            [call.args[0] for call in sleep.call_args_list], [0.5, 0.75, 0.75]
+        )
+
+    def test_timeout_raises(self):
+        with mock.patch.object(utils, 'sleep'), mock.patch.object(
+            FakeWait, 'ready', 10**9
+        ):
+            with self.assertRaises(BadClientResult):
+                es_waiter(None, FakeWait, kind='task', timeout=0)
+
+    def test_wait_time_is_recorded(self):
+        with mock.patch.object(utils, 'sleep'):
+            elapsed = es_waiter(None, FakeWait, kind='task')
+        self.assertAlmostEqual(pop_wait_time(), elapsed, places=2)
+        self.assertEqual(pop_wait_time(), 0.0)
+
+
+class TestChooseForcemerge(TestCase):
+    """TestChooseForcemerge"""
+
+    #: docs, deleted, max_segments, settings overrides, expected choice
+    CASES = [
+        (1000, 0, 1, {}, 'skip'),
+        (0, 0, 0, {}, 'skip'),
+        (1000, 1, 1, {}, 'expunge'),
+        (1000, 5, 10, {}, 'expunge'),
+        (800, 200, 1, {}, 'full'),
+        (900, 100, 1, {'full_above_deleted_pct': 10.0}, 'full'),
+        (1000, 0, 11, {}, 'full'),
+        (1000, 0, 11, {'max_segments_per_shard': 11}, 'skip'),
+        (1000, 5, 3, {'max_segments_per_shard': 2}, 'full'),
+        (0, 0, 20, {}, 'full'),
+    ]
+
+    def test_choices(self):
+        for docs, deleted, segments, overrides, expected in self.CASES:
+            settings = Schema(forcemerge_schema())({'auto': True, **overrides})
+            stats = {'docs': docs, 'deleted': deleted, 'max_segments': segments}
+            with self.subTest(stats=stats, overrides=overrides):
+                choice, reason = choose_forcemerge(stats, settings)
+                self.assertEqual(choice, expected)
+                self.assertIn(f'{deleted} of {docs + deleted} docs', reason)
+
+
+class TestChunkTermsQueries(TestCase):
+    """TestChunkTermsQueries"""
+
+    def chunks(self, count, size=MAX_TERMS_COUNT):
+        values = [str(num) for num in range(count)]
+        queries = chunk_terms_queries('user.id', values, size)
+        return [query['terms']['user.id'] for query in queries]
+
+    def test_no_values(self):
+        self.assertEqual(self.chunks(0), [])
+
+    def test_exactly_max_terms_count(self):
+        chunks = self.chunks(MAX_TERMS_COUNT)
+        self.assertEqual([len(chunk) for chunk in chunks], [MAX_TERMS_COUNT])
+
+    def test_one_over_max_terms_count(self):
+        chunks = self.chunks(MAX_TERMS_COUNT + 1)
+        self.assertEqual([len(chunk) for chunk in chunks], [MAX_TERMS_COUNT, 1])
+        self.assertEqual(chunks[1], [str(MAX_TERMS_COUNT)])
+
+    def test_small_chunks_keep_order(self):
+        self.assertEqual(self.chunks(5, size=2), [['0', '1'], ['2', '3'], ['4']])
+
+
+class TestReadTermsFile(TestCase):
+    """TestReadTermsFile"""
+
+    def read(self, text):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+            file.write(text)
+        self.addCleanup(os.remove, file.name)
+        return read_terms_file(file.name)
+
+    def test_lines_and_commas(self):
+        self.assertEqual(self.read('a\nb, c\n"d",\'e\'\n'), ['a', 'b', 'c', 'd', 'e'])
+
+    def test_blank_values_are_dropped(self):
+        self.assertEqual(self.read('\n  \na,,b\n,\n\n'), ['a', 'b'])
+
+    def test_duplicates_keep_first_position(self):
+        self.assertEqual(self.read('b\na\nb,c\na\n'), ['b', 'a', 'c'])
+
+    def test_empty_file(self):
+        self.assertEqual(self.read(''), [])
+
+    def test_missing_file(self):
+        with tempfile.TemporaryDirectory() as path:
+            with self.assertRaises(ConfigError):
+                read_terms_file(os.path.join(path, 'missing.txt'))
@@ -0,0 +1,112 @@
+"""Test the long-poll task wait of es_pii_tool.helpers.waiter"""
+
+# pylint: disable=missing-function-docstring
+from unittest import TestCase, mock
+from elasticsearch8.exceptions import ApiError
+from elastic_transport import ApiResponseMeta, HttpHeaders
+from es_pii_tool.exceptions import BadClientResult
+from es_pii_tool.helpers import waiter
+from es_pii_tool.helpers.waiter import (
+    SNAPSHOT_MISSING,
+    WaitHub,
+    long_poll_task,
+    wait_for_snapshot,
+)
+
+DONE = {'completed': True, 'task': {'status': {}}, 'response': {'failures': []}}
+
+
+def api_error(status, error_type):
+    meta = ApiResponseMeta(status, '1.1', HttpHeaders(), 0.0, None)
+    body = {'error': {'type': error_type, 'root_cause': [{'reason': 'timed out'}]}}
+    return ApiError(error_type, meta, body)
+
+
+class TestLongPollTask(TestCase):
+    """TestLongPollTask"""
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.get = self.client.options.return_value.tasks.get
+
+    def timeouts(self):
+        return [call.kwargs['timeout'] for call in self.get.call_args_list]
+
+    def test_whole_seconds(self):
+        for timeout, expected in ((7200.0, '60s'), (-1, '60s'), (7.5, '7s')):
+            self.get.reset_mock()
+            self.get.return_value = DONE
+            long_poll_task(self.client, 'node:1', timeout=timeout)
+            self.assertEqual(self.timeouts(), [expected])
+
+    def test_never_below_one_second(self):
+        self.get.return_value = DONE
+        with mock.patch('es_pii_tool.helpers.waiter.monotonic', side_effect=[0, 0.6]):
+            long_poll_task(self.client, 'node:1', timeout=1.0)
+        self.assertEqual(self.timeouts(), ['1s'])
+
+    def test_request_timeout_is_retried(self):
+        self.get.side_effect = [
+            api_error(408, 'elasticsearch_timeout_exception'),
+            api_error(500, 'receive_timeout_transport_exception'),
+            DONE,
+        ]
+        self.assertEqual(long_poll_task(self.client, 'node:1', timeout=-1), DONE)
+        self.assertEqual(self.get.call_count, 3)
+
+    def test_other_errors_are_raised(self):
+        # Mentions a timeout, but is not one
+        error = api_error(400, 'parse_exception')
+        error.body['error']['root_cause'][0]['reason'] = 'failed to parse timeout'
+        self.get.side_effect = [error, DONE]
+        with self.assertRaises(ApiError):
+            long_poll_task(self.client, 'node:1', timeout=-1)
+        self.assertEqual(self.get.call_count, 1)
+
+
+class TestCheckSnapshots(TestCase):
+    """TestCheckSnapshots"""
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.snapshot.status.return_value = {
+            'snapshots': [
+                {'snapshot': 'done', 'state': 'SUCCESS'},
+                {'snapshot': 'running', 'state': 'STARTED'},
+            ]
+        }
+        self.hub = WaitHub(self.client)
+        # Check every snapshot right away, without a polling thread
+        self.hub.due = dict
+        self.hub.register = self.register
+
+    def register(self, registry, key, value):
+        return registry.setdefault(key, value)
+
+    def test_missing_snapshot_is_resolved(self):
+        futures = {
+            name: self.hub.add_snapshot('repo', name)
+            for name in ('done', 'running', 'gone')
+        }
+        self.hub.check_snapshots()
+        self.client.snapshot.status.assert_called_once_with(
+            repository='repo',
+            snapshot=['done', 'running', 'gone'],
+            ignore_unavailable=True,
+        )
+        self.assertEqual(futures['done'].result(timeout=0), 'SUCCESS')
+        self.assertEqual(futures['gone'].result(timeout=0), SNAPSHOT_MISSING)
+        self.assertFalse(futures['running'].done())
+        self.assertEqual(list(self.hub.snapshots), [('repo', 'running')])
+
+    def test_wait_for_missing_snapshot_fails(self):
+        def register(registry, key, value):
+            value = self.register(registry, key, value)
+            self.hub.check_snapshots()
+            return value
+
+        self.hub.register = register
+        with mock.patch.object(waiter, 'get_hub', return_value=self.hub):
+            with self.assertRaises(BadClientResult):
+                wait_for_snapshot(self.client, 'repo', 'gone')
+            wait_for_snapshot(self.client, 'repo', 'done')